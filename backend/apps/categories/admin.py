@@ -4,11 +4,12 @@ from .models import Category, CategoryAttribute
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'slug', 'parent', 'is_active', 'sort_order', 'listings_count']
+    list_display = ['name', 'slug', 'parent', 'is_active', 'sort_order', 'listings_count', 'subtree_listings_count']
     list_filter = ['is_active', 'parent']
     search_fields = ['name', 'description']
     prepopulated_fields = {'slug': ('name',)}
     ordering = ['sort_order', 'name']
+    readonly_fields = ['active_listings_count', 'subtree_listings_count']
     
     fieldsets = (
         ('Basic Information', {
@@ -20,6 +21,10 @@ class CategoryAdmin(admin.ModelAdmin):
         ('Settings', {
             'fields': ('is_active', 'sort_order')
         }),
+        ('Statistics', {
+            'fields': ('active_listings_count', 'subtree_listings_count'),
+            'classes': ('collapse',)
+        }),
     )
     
     def listings_count(self, obj):
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class CategoriesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'apps.categories' 
\ No newline at end of file
+    name = 'apps.categories'
+    
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,177 @@
+"""
+In-memory snapshot of the category tree.
+
+The whole tree is loaded with one query and kept per process. A version
+number stored in the cache is bumped whenever a category changes, which
+makes processes sharing that cache reload their snapshot on next access.
+A process-local cache only sees its own bumps, so snapshots are also
+reloaded once they are older than ``CATEGORY_INDEX['MAX_AGE']``.
+"""
+
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from marketplace.cache import invalidate_tags, new_tag_version
+
+VERSION_KEY = 'categories:index:version'
+COUNTS_VERSION_KEY = 'categories:counts:version'
+
+
+def get_index_settings():
+    options = {
+        'MAX_AGE': 60,
+    }
+    options.update(getattr(settings, 'CATEGORY_INDEX', {}))
+    return options
+
+
+class CategoryIndex:
+    """Lookup structure for descendants, ancestors and breadcrumbs."""
+    
+    def __init__(self, categories, version=None):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.tree = None
+        self.by_id = {category.id: category for category in categories}
+        self.children_by_parent = defaultdict(list)
+        for category in categories:
+            self.children_by_parent[category.parent_id].append(category)
+        for children in self.children_by_parent.values():
+            children.sort(key=lambda category: (category.sort_order, category.name))
+    
+    def get(self, category_id):
+        return self.by_id.get(category_id)
+    
+    def children(self, category_id, active_only=True):
+        """Get the immediate children of a category."""
+        children = self.children_by_parent.get(category_id, [])
+        if active_only:
+            return [child for child in children if child.is_active]
+        return list(children)
+    
+    def roots(self, active_only=True):
+        return self.children(None, active_only=active_only)
+    
+    def descendants(self, category_id, active_only=False):
+        """Get all descendants of a category, depth first."""
+        descendants = []
+        stack = list(reversed(self.children(category_id, active_only)))
+        while stack:
+            category = stack.pop()
+            descendants.append(category)
+            stack.extend(reversed(self.children(category.id, active_only)))
+        return descendants
+    
+    def descendant_ids(self, category_id, include_self=True):
+        ids = [category.id for category in self.descendants(category_id)]
+        if include_self:
+            ids.insert(0, category_id)
+        return ids
+    
+    def ancestors(self, category_id):
+        """Get the ancestors of a category, root first."""
+        ancestors = []
+        category = self.by_id.get(category_id)
+        while category is not None and category.parent_id is not None:
+            category = self.by_id.get(category.parent_id)
+            if category is not None:
+                ancestors.append(category)
+        return ancestors[::-1]
+    
+    def is_fresh(self, version):
+        return self.version == version and time.monotonic() - self.loaded_at < get_index_settings()['MAX_AGE']
+    
+    def breadcrumb(self, category_id):
+        """Get the breadcrumb path for a category, root first."""
+        category = self.by_id.get(category_id)
+        if category is None:
+            return []
+        return self.ancestors(category_id) + [category]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index_version():
+    # Counters live on the category rows, so count changes refresh the snapshot too.
+    # Versions start from the clock, so a flushed cache never revives an old snapshot.
+    return (
+        cache.get_or_set(VERSION_KEY, new_tag_version, timeout=None),
+        cache.get_or_set(COUNTS_VERSION_KEY, new_tag_version, timeout=None),
+    )
+
+
+def invalidate_category_index():
+    """Bump the index version so processes sharing the cache reload their snapshot."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, new_tag_version(), timeout=None)
+    invalidate_tags('categories')
+
+
+def get_category_index():
+    """Return an up to date snapshot of the category tree."""
+    global _index
+    from .models import Category
+    
+    version = get_index_version()
+    index = _index
+    if index is None or not index.is_fresh(version):
+        with _index_lock:
+            if _index is None or not _index.is_fresh(version):
+                _index = CategoryIndex(list(Category.objects.all()), version=version)
+            index = _index
+    return index
+
+
+def invalidate_category_counts():
+    """Bump the listing counts version after listing status changes."""
+    try:
+        cache.incr(COUNTS_VERSION_KEY)
+    except ValueError:
+        cache.set(COUNTS_VERSION_KEY, new_tag_version(), timeout=None)
+    invalidate_tags('category_counts')
+
+
+def build_category_tree(index):
+    """Assemble the active category tree from a snapshot."""
+    def build_node(category):
+        return {
+            'id': category.id,
+            'name': category.name,
+            'slug': category.slug,
+            'icon': category.icon.url if category.icon else None,
+            'children': [build_node(child) for child in index.children(category.id)],
+            'listings_count': category.active_listings_count,
+        }
+    
+    return [build_node(root) for root in index.roots()]
+
+
+def absolutize_icons(nodes, request):
+    return [
+        dict(
+            node,
+            icon=request.build_absolute_uri(node['icon']) if node['icon'] else None,
+            children=absolutize_icons(node['children'], request)
+        )
+        for node in nodes
+    ]
+
+
+def get_category_tree(request=None):
+    """Return the serialized category tree, built once per snapshot.
+    
+    Icons are absolute URLs when a request is given, as serializers render them.
+    """
+    index = get_category_index()
+    if index.tree is None:
+        index.tree = build_category_tree(index)
+    if request is not None:
+        return absolutize_icons(index.tree, request)
+    return index.tree
@@ -0,0 +1,54 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from apps.categories.index import invalidate_category_counts
+from apps.categories.models import Category, path_to_ids
+from apps.listings.models import Listing
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized active listing counters of all categories.'
+    
+    def handle(self, *args, **options):
+        direct_counts = dict(
+            Listing.objects.filter(
+                status='active',
+                is_active=True
+            ).values_list('category_id').annotate(count=Count('id')).order_by()
+        )
+        
+        categories = list(Category.objects.only(
+            'id', 'path', 'active_listings_count', 'subtree_listings_count'
+        ))
+        
+        # Roll every direct count up to all categories on its path
+        subtree_counts = Counter()
+        for category in categories:
+            count = direct_counts.get(category.id, 0)
+            if count:
+                for ancestor_id in path_to_ids(category.path):
+                    subtree_counts[ancestor_id] += count
+        
+        changed = []
+        for category in categories:
+            active = direct_counts.get(category.id, 0)
+            subtree = subtree_counts.get(category.id, 0)
+            if (category.active_listings_count, category.subtree_listings_count) != (active, subtree):
+                category.active_listings_count = active
+                category.subtree_listings_count = subtree
+                changed.append(category)
+        
+        with transaction.atomic():
+            Category.objects.bulk_update(
+                changed,
+                ['active_listings_count', 'subtree_listings_count'],
+                batch_size=500
+            )
+            transaction.on_commit(invalidate_category_counts)
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'Recounted {len(categories)} categories, {len(changed)} updated'
+        ))
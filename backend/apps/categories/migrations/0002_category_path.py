@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:01
+
+from django.db import migrations, models
+
+
+def build_paths(apps, schema_editor):
+    Category = apps.get_model('categories', 'Category')
+    categories = list(Category.objects.only('id', 'parent_id'))
+    children = {}
+    for category in categories:
+        children.setdefault(category.parent_id, []).append(category)
+    
+    # Walk the tree from the roots, parents before children
+    queue = [(category, f'/{category.id}/', 0) for category in children.get(None, [])]
+    while queue:
+        category, path, depth = queue.pop()
+        category.path = path
+        category.depth = depth
+        queue.extend(
+            (child, f'{path}{child.id}/', depth + 1)
+            for child in children.get(category.id, [])
+        )
+    
+    Category.objects.bulk_update(categories, ['path', 'depth'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('categories', '0001_initial'),
+    ]
+    
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:02
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_counters(apps, schema_editor):
+    Category = apps.get_model('categories', 'Category')
+    Listing = apps.get_model('listings', 'Listing')
+    
+    direct_counts = dict(
+        Listing.objects.filter(
+            status='active',
+            is_active=True
+        ).values_list('category_id').annotate(count=Count('id')).order_by()
+    )
+    categories = list(Category.objects.only('id', 'path'))
+    
+    subtree_counts = Counter()
+    for category in categories:
+        count = direct_counts.get(category.id, 0)
+        for ancestor_id in category.path.strip('/').split('/'):
+            if ancestor_id and count:
+                subtree_counts[int(ancestor_id)] += count
+    
+    for category in categories:
+        category.active_listings_count = direct_counts.get(category.id, 0)
+        category.subtree_listings_count = subtree_counts.get(category.id, 0)
+    
+    Category.objects.bulk_update(
+        categories,
+        ['active_listings_count', 'subtree_listings_count'],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('categories', '0002_category_path'),
+        ('listings', '0002_initial'),
+    ]
+    
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='active_listings_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='subtree_listings_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
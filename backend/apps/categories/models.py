@@ -1,7 +1,50 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
+from django.core.exceptions import ValidationError
 from django.core.validators import FileExtensionValidator
 
 
+class CategoryQuerySet(models.QuerySet):
+    """QuerySet with materialized path lookups."""
+    
+    def subtree(self, path, include_self=True):
+        """Filter categories under the given path using an index range scan."""
+        # Paths look like '/1/5/'; every descendant sorts between the path
+        # itself and the path with its trailing '/' bumped to '0'.
+        if not path:
+            # An empty bound would match every category
+            return self.none()
+        queryset = self.filter(path__gte=path, path__lt=path[:-1] + '0')
+        if not include_self:
+            queryset = queryset.exclude(path=path)
+        return queryset
+    
+    def ancestors_of(self, path, include_self=False):
+        """Filter the categories on the given path, root first."""
+        ids = path_to_ids(path)
+        if not include_self:
+            ids = ids[:-1]
+        return self.filter(id__in=ids).order_by('depth')
+    
+    def adjust_listing_counts(self, category_id, delta):
+        """Apply a change in active listings to a category and its ancestors."""
+        path = self.filter(id=category_id).values_list('path', flat=True).first()
+        if not path or not delta:
+            return
+        self.filter(id=category_id).update(
+            active_listings_count=F('active_listings_count') + delta
+        )
+        self.filter(id__in=path_to_ids(path)).update(
+            subtree_listings_count=F('subtree_listings_count') + delta
+        )
+
+
+def path_to_ids(path):
+    """Convert a materialized path into a list of category ids."""
+    return [int(part) for part in path.strip('/').split('/') if part]
+
+
 class Category(models.Model):
     """Model for marketplace categories."""
     
@@ -24,6 +67,14 @@ class Category(models.Model):
     is_active = models.BooleanField(default=True)
     sort_order = models.IntegerField(default=0)
     
+    # Materialized path, e.g. '/1/5/12/', maintained on save
+    path = models.CharField(max_length=255, blank=True, default='', editable=False, db_index=True)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    
+    # Active listings counters, maintained by listing signals
+    active_listings_count = models.PositiveIntegerField(default=0, editable=False)
+    subtree_listings_count = models.PositiveIntegerField(default=0, editable=False)
+    
     # Metadata
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -34,37 +85,83 @@ class Category(models.Model):
         verbose_name_plural = 'Categories'
         ordering = ['sort_order', 'name']
     
+    objects = CategoryQuerySet.as_manager()
+    
+    # Fields maintained with targeted UPDATEs, never written from a stale instance
+    MANAGED_FIELDS = ('path', 'depth', 'active_listings_count', 'subtree_listings_count')
+    
     def __str__(self):
         return self.name
     
+    def clean(self):
+        if self.pk and self.parent_id:
+            if self.parent_id == self.pk or self.pk in path_to_ids(self.parent.path):
+                raise ValidationError({'parent': 'A category cannot be moved under itself.'})
+    
+    def save(self, *args, **kwargs):
+        old_path = self.path
+        old_depth = self.depth
+        
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.MANAGED_FIELDS
+            ]
+        
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            
+            parent_path = self.parent.path if self.parent_id else '/'
+            if self.pk in path_to_ids(parent_path):
+                raise ValueError('A category cannot be moved under itself.')
+            
+            new_path = f'{parent_path}{self.pk}/'
+            new_depth = new_path.count('/') - 2
+            if new_path == old_path:
+                return
+            
+            Category.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+            
+            # Re-root the whole subtree with a single UPDATE
+            if old_path:
+                Category.objects.subtree(old_path, include_self=False).update(
+                    path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                    depth=F('depth') + (new_depth - old_depth)
+                )
+                
+                # Move the subtree's listings from the old ancestors to the new ones
+                subtree_count = Category.objects.filter(pk=self.pk).values_list(
+                    'subtree_listings_count', flat=True
+                ).get()
+                if subtree_count:
+                    Category.objects.filter(id__in=path_to_ids(old_path)[:-1]).update(
+                        subtree_listings_count=F('subtree_listings_count') - subtree_count
+                    )
+                    Category.objects.filter(id__in=path_to_ids(new_path)[:-1]).update(
+                        subtree_listings_count=F('subtree_listings_count') + subtree_count
+                    )
+            
+            self.path = new_path
+            self.depth = new_depth
+    
     def get_absolute_url(self):
         return f'/categories/{self.slug}/'
     
     def get_listings_count(self):
         """Get count of active listings in this category."""
-        from apps.listings.models import Listing
-        return Listing.objects.filter(
-            category=self,
-            is_active=True,
-            status='active'
-        ).count()
+        return self.active_listings_count
+    
+    def get_subtree_listings_count(self):
+        """Get count of active listings in this category and its subcategories."""
+        return self.subtree_listings_count
     
     def get_all_children(self):
-        """Get all children categories recursively."""
-        children = []
-        for child in self.children.all():
-            children.append(child)
-            children.extend(child.get_all_children())
-        return children
+        """Get all descendant categories in a single query."""
+        return list(Category.objects.subtree(self.path, include_self=False).order_by('path'))
     
     def get_all_parents(self):
-        """Get all parent categories."""
-        parents = []
-        parent = self.parent
-        while parent:
-            parents.append(parent)
-            parent = parent.parent
-        return parents[::-1]  # Reverse to get root first
+        """Get all parent categories, root first, in a single query."""
+        return list(Category.objects.ancestors_of(self.path))
     
     def get_breadcrumb(self):
         """Get breadcrumb path for this category."""
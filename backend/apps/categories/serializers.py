@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Category, CategoryAttribute # type: ignore
+from .index import get_category_index
 
 
 class CategoryAttributeSerializer(serializers.ModelSerializer):
@@ -30,8 +31,8 @@ class CategorySerializer(serializers.ModelSerializer):
     
     def get_children(self, obj):
         """Get immediate children categories."""
-        children = obj.children.filter(is_active=True)
-        return CategorySerializer(children, many=True).data
+        children = get_category_index().children(obj.id)
+        return CategorySerializer(children, many=True, context=self.context).data
     
     def get_listings_count(self, obj):
         """Get count of active listings in this category."""
@@ -39,7 +40,7 @@ class CategorySerializer(serializers.ModelSerializer):
     
     def get_breadcrumb(self, obj):
         """Get breadcrumb path for this category."""
-        breadcrumb = obj.get_breadcrumb()
+        breadcrumb = get_category_index().breadcrumb(obj.id)
         return [
             {
                 'id': cat.id,
@@ -50,6 +51,27 @@ class CategorySerializer(serializers.ModelSerializer):
         ]
 
 
+class CategorySummarySerializer(serializers.ModelSerializer):
+    """Lightweight category representation for lists, served from the tree snapshot."""
+    
+    breadcrumb = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'slug', 'parent', 'breadcrumb']
+    
+    def get_breadcrumb(self, obj):
+        """Get breadcrumb path for this category."""
+        return [
+            {
+                'id': cat.id,
+                'name': cat.name,
+                'slug': cat.slug
+            }
+            for cat in get_category_index().breadcrumb(obj.id)
+        ]
+
+
 class CategoryDetailSerializer(CategorySerializer):
     """Detailed serializer for categories with attributes."""
     
@@ -73,8 +95,8 @@ class CategoryTreeSerializer(serializers.ModelSerializer):
     
     def get_children(self, obj):
         """Get all children recursively."""
-        children = obj.children.filter(is_active=True)
-        return CategoryTreeSerializer(children, many=True).data
+        children = get_category_index().children(obj.id)
+        return CategoryTreeSerializer(children, many=True, context=self.context).data
     
     def get_listings_count(self, obj):
         """Get count of active listings in this category."""
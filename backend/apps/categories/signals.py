@@ -0,0 +1,21 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from marketplace.cache import invalidate_tags
+from .index import invalidate_category_index
+from .models import Category, CategoryAttribute
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, **kwargs):
+    """Drop cached category snapshots when the tree changes."""
+    transaction.on_commit(invalidate_category_index)
+
+
+@receiver(post_save, sender=CategoryAttribute)
+@receiver(post_delete, sender=CategoryAttribute)
+def category_attribute_changed(sender, **kwargs):
+    """Drop cached category details when attributes change."""
+    transaction.on_commit(lambda: invalidate_tags('categories'))
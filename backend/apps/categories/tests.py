@@ -0,0 +1,167 @@
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from apps.listings.models import Listing
+from apps.users.models import User
+from .index import get_category_index
+from .models import Category
+
+
+class CategoryTreeTests(TestCase):
+    """The category tree is served in a constant number of queries."""
+    
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('categories:category-tree')
+    
+    def create_tree(self, roots, children, grandchildren, prefix='c'):
+        leaves = []
+        for root_number in range(roots):
+            root = Category.objects.create(name=f'{prefix}{root_number}', slug=f'{prefix}{root_number}')
+            for child_number in range(children):
+                child = Category.objects.create(
+                    name=f'{prefix}{root_number}-{child_number}',
+                    slug=f'{prefix}{root_number}-{child_number}',
+                    parent=root
+                )
+                for leaf_number in range(grandchildren):
+                    leaves.append(Category.objects.create(
+                        name=f'{prefix}{root_number}-{child_number}-{leaf_number}',
+                        slug=f'{prefix}{root_number}-{child_number}-{leaf_number}',
+                        parent=child
+                    ))
+        return leaves
+    
+    def count_tree_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+    
+    def test_query_count_does_not_grow_with_the_tree(self):
+        self.create_tree(2, 2, 2, prefix='small')
+        small_tree_queries = self.count_tree_queries()
+        
+        # 20 roots, 80 children and 400 leaves
+        self.create_tree(20, 4, 5)
+        self.assertEqual(Category.objects.count(), 514)
+        cache.clear()
+        with self.assertNumQueries(small_tree_queries):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(small_tree_queries, 2)
+    
+    def test_tree_counts_listings_and_renders_absolute_icons(self):
+        leaf = self.create_tree(1, 1, 1)[0]
+        root = Category.objects.get(parent=None)
+        Category.objects.filter(id=root.id).update(icon='category_icons/root.png')
+        seller = User.objects.create_user(username='seller', email='seller@example.com', password='secret')
+        Listing.objects.create(
+            title='Desk',
+            description='Oak desk',
+            price=50,
+            category=leaf,
+            seller=seller,
+            status='active'
+        )
+        cache.clear()
+        
+        response = self.client.get(self.url)
+        
+        root_node = response.json()['results'][0]
+        self.assertTrue(root_node['icon'].startswith('http://testserver/'))
+        self.assertTrue(root_node['icon'].endswith('category_icons/root.png'))
+        leaf_node = root_node['children'][0]['children'][0]
+        self.assertEqual(leaf_node['id'], leaf.id)
+        self.assertEqual(leaf_node['listings_count'], 1)
+        self.assertIsNone(leaf_node['icon'])
+
+
+class CategoryHierarchyTests(TestCase):
+    """Moving a category carries its subtree, counters and snapshot along."""
+    
+    def setUp(self):
+        cache.clear()
+        self.electronics = Category.objects.create(name='Electronics', slug='electronics')
+        self.furniture = Category.objects.create(name='Furniture', slug='furniture')
+        self.phones = Category.objects.create(name='Phones', slug='phones', parent=self.electronics)
+        self.android = Category.objects.create(name='Android', slug='android', parent=self.phones)
+    
+    def move(self, category, parent):
+        category.parent = parent
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+    
+    def assertPath(self, category, *ancestors):
+        category.refresh_from_db()
+        ids = [ancestor.id for ancestor in ancestors] + [category.id]
+        self.assertEqual(category.path, '/' + ''.join(f'{category_id}/' for category_id in ids))
+        self.assertEqual(category.depth, len(ancestors))
+    
+    def test_new_categories_get_paths(self):
+        self.assertPath(self.electronics)
+        self.assertPath(self.phones, self.electronics)
+        self.assertPath(self.android, self.electronics, self.phones)
+    
+    def test_reparenting_rewrites_the_subtree(self):
+        self.move(self.phones, self.furniture)
+        
+        self.assertPath(self.phones, self.furniture)
+        self.assertPath(self.android, self.furniture, self.phones)
+        self.assertEqual(self.furniture.get_all_children(), [self.phones, self.android])
+        self.assertEqual(self.electronics.get_all_children(), [])
+        self.assertEqual(self.android.get_all_parents(), [self.furniture, self.phones])
+    
+    def test_moving_to_the_root(self):
+        self.move(self.phones, None)
+        
+        self.assertPath(self.phones)
+        self.assertPath(self.android, self.phones)
+        self.assertPath(self.electronics)
+    
+    def test_reparenting_moves_listing_counts(self):
+        seller = User.objects.create(username='seller', email='seller@example.com')
+        Listing.objects.create(
+            title='Phone',
+            description='Barely used',
+            price=100,
+            category=self.android,
+            seller=seller,
+            status='active'
+        )
+        
+        self.move(self.phones, self.furniture)
+        
+        counts = dict(Category.objects.values_list('slug', 'subtree_listings_count'))
+        self.assertEqual(counts, {'electronics': 0, 'furniture': 1, 'phones': 1, 'android': 1})
+    
+    def test_cycles_are_rejected(self):
+        for parent in (self.phones, self.android):
+            self.phones.parent = parent
+            with self.assertRaises(ValidationError):
+                self.phones.full_clean()
+            with self.assertRaises(ValueError):
+                self.phones.save()
+            
+            self.phones.refresh_from_db()
+            self.assertEqual(self.phones.parent_id, self.electronics.id)
+            self.assertPath(self.phones, self.electronics)
+            self.assertPath(self.android, self.electronics, self.phones)
+    
+    def test_snapshot_is_reloaded_after_a_move(self):
+        index = get_category_index()
+        self.assertIs(get_category_index(), index)
+        self.assertEqual(index.descendant_ids(self.electronics.id), [
+            self.electronics.id, self.phones.id, self.android.id
+        ])
+        
+        self.move(self.phones, self.furniture)
+        
+        index = get_category_index()
+        self.assertEqual(index.descendant_ids(self.electronics.id), [self.electronics.id])
+        self.assertEqual(index.breadcrumb(self.android.id), [self.furniture, self.phones, self.android])
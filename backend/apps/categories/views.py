@@ -1,6 +1,9 @@
 from rest_framework import generics, permissions, filters
+from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from marketplace.cache import CachedResponseMixin
 from .models import Category, CategoryAttribute
+from .index import get_category_tree
 from .serializers import (
     CategorySerializer, CategoryDetailSerializer, CategoryTreeSerializer,
     CategoryAttributeSerializer
@@ -22,23 +25,35 @@ class CategoryListView(generics.ListAPIView):
         return Category.objects.filter(is_active=True)
 
 
-class CategoryDetailView(generics.RetrieveAPIView):
+class CategoryDetailView(CachedResponseMixin, generics.RetrieveAPIView):
     """View for category details."""
     
     serializer_class = CategoryDetailSerializer
     permission_classes = [permissions.AllowAny]
+    cache_name = 'category_detail'
+    cache_tags = ('categories', 'category_counts')
     queryset = Category.objects.filter(is_active=True)
     lookup_field = 'slug'
 
 
-class CategoryTreeView(generics.ListAPIView):
+class CategoryTreeView(CachedResponseMixin, generics.ListAPIView):
     """View for category tree structure."""
     
     serializer_class = CategoryTreeSerializer
     permission_classes = [permissions.AllowAny]
+    cache_name = 'category_tree'
+    cache_tags = ('categories', 'category_counts')
     
     def get_queryset(self):
         return Category.objects.filter(is_active=True, parent=None)
+    
+    def list(self, request, *args, **kwargs):
+        # Built from one category fetch and one grouped count, then cached
+        tree = get_category_tree(request)
+        page = self.paginate_queryset(tree)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(tree)
 
 
 class CategoryChildrenView(generics.ListAPIView):
@@ -8,7 +8,7 @@ class ChatRoomAdmin(admin.ModelAdmin):
     list_filter = ['is_active', 'created_at']
     search_fields = ['participants__username', 'listing__title']
     ordering = ['-created_at']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['last_message', 'created_at', 'updated_at']
     
     def participants_display(self, obj):
         return ', '.join([user.username for user in obj.participants.all()])
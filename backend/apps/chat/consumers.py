@@ -1,14 +1,35 @@
 import json
+import logging
+
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer # type: ignore
 from channels.db import database_sync_to_async # type: ignore
 from django.contrib.auth.models import AnonymousUser
-from .models import ChatRoom, Message, MessageRead, ChatNotification # type: ignore
+from .models import ChatRoom # type: ignore
+from .persistence import get_message_writer
+from .presence import get_contact_ids, get_presence_backend, get_typing_coalescer
+from .utils import mark_room_read
+
+logger = logging.getLogger(__name__)
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['room_name']
         self.room_group_name = f'chat_{self.room_name}'
+        self.user = self.scope['user']
+        
+        # Room membership is loaded once per connection and kept up to date
+        # by membership_changed broadcasts
+        self.participant_ids = set()
+        if self.user == AnonymousUser():
+            await self.close()
+            return
+        
+        self.participant_ids = await self.load_participant_ids()
+        if self.user.id not in self.participant_ids:
+            await self.close()
+            return
         
         # Join room group
         await self.channel_layer.group_add(
@@ -34,8 +55,17 @@ class ChatConsumer(AsyncWebsocketConsumer):
             message = text_data_json['message']
             user = self.scope['user']
             
-            # Save message to database
-            await self.save_message(user, message)
+            # Save message to database, batched with concurrent messages
+            try:
+                message_obj = await self.save_message(user, message)
+            except Exception:
+                # A failed write must not take the socket down with it
+                logger.exception('Could not store a message for chat room %s', self.room_name)
+                await self.send_error('Message could not be sent.')
+                return
+            if message_obj is None:
+                await self.send_error('You are not a participant of this chat.')
+                return
             
             # Send message to room group
             await self.channel_layer.group_send(
@@ -43,20 +73,45 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 {
                     'type': 'chat_message',
                     'message': message,
-                    'username': user.username if user != AnonymousUser() else 'Anonymous',
-                    'user_id': user.id if user != AnonymousUser() else None,
+                    'message_id': message_obj.id,
+                    'created_at': message_obj.created_at.isoformat(),
+                    'username': user.username,
+                    'user_id': user.id,
                 }
             )
         
         elif message_type == 'typing':
-            # Send typing indicator
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_typing',
-                    'username': self.scope['user'].username if self.scope['user'] != AnonymousUser() else 'Anonymous',
-                }
-            )
+            # Send typing indicator, at most once per user per window
+            if get_typing_coalescer().should_broadcast(self.room_name, self.user.id):
+                await self.channel_layer.group_send(
+                    self.room_group_name,
+                    {
+                        'type': 'user_typing',
+                        'username': self.user.username,
+                        'user_id': self.user.id,
+                    }
+                )
+        
+        elif message_type == 'mark_read':
+            user = self.scope['user']
+            last_read_message_id = await self.mark_read(user)
+            
+            if last_read_message_id is not None:
+                # Let the other participants update their read receipts
+                await self.channel_layer.group_send(
+                    self.room_group_name,
+                    {
+                        'type': 'messages_read',
+                        'user_id': user.id,
+                        'last_read_message_id': last_read_message_id,
+                    }
+                )
+    
+    async def send_error(self, error):
+        await self.send(text_data=json.dumps({
+            'type': 'error',
+            'error': error,
+        }))
     
     # Receive message from room group
     async def chat_message(self, event):
@@ -68,6 +123,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.send(text_data=json.dumps({
             'type': 'chat_message',
             'message': message,
+            'message_id': event.get('message_id'),
+            'created_at': event.get('created_at'),
             'username': username,
             'user_id': user_id,
         }))
@@ -80,50 +137,71 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.send(text_data=json.dumps({
             'type': 'user_typing',
             'username': username,
+            'user_id': event.get('user_id'),
+        }))
+    
+    # Receive membership changes from room group
+    async def membership_changed(self, event):
+        if event['cleared']:
+            self.participant_ids = set()
+        self.participant_ids |= set(event['added'])
+        self.participant_ids -= set(event['removed'])
+        
+        # Drop sockets of users who left the room
+        if self.user.id not in self.participant_ids:
+            await self.close()
+    
+    # Receive read receipts from room group
+    async def messages_read(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'messages_read',
+            'user_id': event['user_id'],
+            'last_read_message_id': event['last_read_message_id'],
         }))
     
     @database_sync_to_async
-    def save_message(self, user, message):
-        """Save message to database."""
-        if user == AnonymousUser():
-            return
+    def mark_read(self, user):
+        """Mark the room read for a participant, returning the read watermark."""
+        if user == AnonymousUser() or user.id not in self.participant_ids:
+            return None
         
         try:
             chat_room = ChatRoom.objects.get(id=self.room_name)
-            
-            # Check if user is participant
-            if chat_room.participants.filter(id=user.id).exists():
-                # Create message
-                message_obj = Message.objects.create(
-                    chat_room=chat_room,
-                    sender=user,
-                    content=message
-                )
-                
-                # Mark as read for sender
-                MessageRead.objects.get_or_create(
-                    message=message_obj,
-                    user=user
-                )
-                
-                # Create notifications for other participants
-                for participant in chat_room.participants.exclude(id=user.id):
-                    ChatNotification.objects.create(
-                        recipient=participant,
-                        sender=user,
-                        chat_room=chat_room,
-                        notification_type='new_message',
-                        message=f"New message from {user.username}"
-                    )
-                
-                return message_obj
-        except ChatRoom.DoesNotExist:
-            pass
+        except (ChatRoom.DoesNotExist, ValueError):
+            return None
+        
+        if mark_room_read(chat_room, user) is None:
+            return None
+        return chat_room.last_message_id
+    
+    @database_sync_to_async
+    def load_participant_ids(self):
+        """Load the ids of the room's participants."""
+        try:
+            return set(ChatRoom.objects.filter(
+                id=int(self.room_name)
+            ).values_list('participants', flat=True)) - {None}
+        except ValueError:
+            return set()
+    
+    async def save_message(self, user, message):
+        """Save message to database."""
+        if user == AnonymousUser() or user.id not in self.participant_ids:
+            return None
+        
+        return await get_message_writer().submit(
+            self.room_name,
+            user,
+            message,
+            self.participant_ids
+        )
 
 
 class NotificationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope['user']
+        # Set before any await, disconnect runs even if the socket drops mid-connect
+        self.contact_ids = set()
         
         if self.user == AnonymousUser():
             await self.close()
@@ -138,24 +216,71 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        
+        # Track presence per socket and tell contacts when the user comes online
+        presence = get_presence_backend()
+        self.contact_ids = await database_sync_to_async(get_contact_ids)(self.user.id)
+        if await sync_to_async(presence.connect)(self.user.id, self.channel_name):
+            await self.broadcast_presence(self.user.id, 'online', self.contact_ids)
+        
+        online_contact_ids = await sync_to_async(presence.online_user_ids)(self.contact_ids)
+        await self.send(text_data=json.dumps({
+            'type': 'presence_snapshot',
+            'online_user_ids': sorted(online_contact_ids),
+        }))
     
     async def disconnect(self, close_code):
+        if self.user == AnonymousUser():
+            return
+        
         # Leave user group
         await self.channel_layer.group_discard(
             self.user_group_name,
             self.channel_name
         )
+        
+        presence = get_presence_backend()
+        if await sync_to_async(presence.disconnect)(self.user.id, self.channel_name):
+            await self.broadcast_presence(self.user.id, 'offline', self.contact_ids)
     
     async def receive(self, text_data):
-        # Handle any incoming messages if needed
-        pass
+        data = json.loads(text_data)
+        
+        if data.get('type') == 'heartbeat':
+            presence = get_presence_backend()
+            await sync_to_async(presence.heartbeat)(self.user.id, self.channel_name)
+            
+            # Sessions of crashed workers stop heartbeating; expire them lazily
+            if presence.sweep_due():
+                for user_id in await sync_to_async(presence.expire)():
+                    contact_ids = await database_sync_to_async(get_contact_ids)(user_id)
+                    await self.broadcast_presence(user_id, 'offline', contact_ids)
+    
+    async def broadcast_presence(self, user_id, status, contact_ids):
+        """Push a presence change to the user's contacts that are online."""
+        presence = get_presence_backend()
+        for contact_id in await sync_to_async(presence.online_user_ids)(contact_ids):
+            await self.channel_layer.group_send(
+                f'user_{contact_id}',
+                {
+                    'type': 'presence_update',
+                    'user_id': user_id,
+                    'status': status,
+                }
+            )
+    
+    async def presence_update(self, event):
+        """Send presence change to WebSocket."""
+        await self.send(text_data=json.dumps({
+            'type': 'presence_update',
+            'notification_type': f"user_{event['status']}",
+            'user_id': event['user_id'],
+            'status': event['status'],
+        }))
     
     async def notification_message(self, event):
         """Send notification to WebSocket."""
         await self.send(text_data=json.dumps({
             'type': 'notification',
-            'message': event['message'],
-            'notification_type': event['notification_type'],
-            'sender_id': event.get('sender_id'),
-            'chat_room_id': event.get('chat_room_id'),
+            **event['notification'],
         })) 
\ No newline at end of file
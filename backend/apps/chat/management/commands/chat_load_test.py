@@ -0,0 +1,92 @@
+import asyncio
+import json
+import time
+import uuid
+
+from channels.layers import DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer, channel_layers
+from channels.routing import URLRouter
+from channels.testing.websocket import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+
+from apps.chat.models import ChatRoom
+from apps.chat.routing import websocket_urlpatterns
+from apps.users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the chat websocket consumer on an in-memory channel layer '
+        'and report throughput and latency.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=50, help='Concurrent websocket clients')
+        parser.add_argument('--messages', type=int, default=20, help='Messages sent per client')
+        parser.add_argument('--room-size', type=int, default=2, help='Clients per chat room')
+    
+    def handle(self, *args, **options):
+        clients = options['clients']
+        room_size = max(1, options['room_size'])
+        prefix = f'loadtest-{uuid.uuid4().hex[:8]}'
+        previous_layer = channel_layers.set(DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer(capacity=10000))
+        
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}-{index}') for index in range(clients)
+        ])
+        rooms = []
+        for start in range(0, clients, room_size):
+            room = ChatRoom.objects.create()
+            room.participants.add(*users[start:start + room_size])
+            rooms.append(room)
+        
+        try:
+            latencies, elapsed = asyncio.run(self.run_clients(users, rooms, room_size, options['messages']))
+        finally:
+            ChatRoom.objects.filter(id__in=[room.id for room in rooms]).delete()
+            User.objects.filter(username__startswith=prefix).delete()
+            channel_layers.set(DEFAULT_CHANNEL_LAYER, previous_layer)
+        
+        latencies.sort()
+        total = len(latencies)
+        self.stdout.write(f'Messages: {total} in {elapsed:.2f}s')
+        self.stdout.write(f'Throughput: {total / elapsed:.1f} messages/s')
+        if total:
+            self.stdout.write(f'Latency p50: {latencies[total // 2] * 1000:.1f}ms')
+            self.stdout.write(f'Latency p99: {latencies[min(total - 1, int(total * 0.99))] * 1000:.1f}ms')
+    
+    async def run_clients(self, users, rooms, room_size, message_count):
+        application = URLRouter(websocket_urlpatterns)
+        communicators = []
+        for index, user in enumerate(users):
+            room = rooms[index // room_size]
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{room.id}/')
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise RuntimeError(f'Client {user.username} could not connect')
+            communicators.append((user, communicator))
+        
+        async def client(user, communicator):
+            latencies = []
+            for sequence in range(message_count):
+                sent_at = time.perf_counter()
+                await communicator.send_to(text_data=json.dumps({
+                    'type': 'chat_message',
+                    'message': f'{user.id}:{sequence}',
+                }))
+                # Wait for our own message to come back through the room group
+                while True:
+                    event = json.loads(await communicator.receive_from(timeout=30))
+                    if event.get('type') == 'chat_message' and event.get('message') == f'{user.id}:{sequence}':
+                        break
+                latencies.append(time.perf_counter() - sent_at)
+            return latencies
+        
+        started = time.perf_counter()
+        results = await asyncio.gather(*(client(user, communicator) for user, communicator in communicators))
+        elapsed = time.perf_counter() - started
+        
+        for _, communicator in communicators:
+            await communicator.disconnect()
+        
+        return [latency for latencies in results for latency in latencies], elapsed
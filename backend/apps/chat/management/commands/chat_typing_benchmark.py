@@ -0,0 +1,83 @@
+import asyncio
+import json
+import uuid
+
+from channels.layers import DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer, channel_layers
+from channels.routing import URLRouter
+from channels.testing.websocket import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+
+from apps.chat import presence
+from apps.chat.models import ChatRoom
+from apps.chat.routing import websocket_urlpatterns
+from apps.users.models import User
+
+
+class CountingChannelLayer(InMemoryChannelLayer):
+    """In-memory channel layer that counts group sends and deliveries."""
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.group_sends = 0
+        self.deliveries = 0
+    
+    async def group_send(self, group, message):
+        self.group_sends += 1
+        self.deliveries += len(self.groups.get(group, {}))
+        await super().group_send(group, message)
+
+
+class Command(BaseCommand):
+    help = 'Compare channel layer traffic of typing indicators with and without coalescing.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=10, help='Typing clients in one room')
+        parser.add_argument('--keystrokes', type=int, default=50, help='Typing frames sent per client')
+        parser.add_argument('--interval', type=float, default=0.02, help='Seconds between typing frames')
+        parser.add_argument('--window', type=float, default=3.0, help='Coalescing window in seconds')
+    
+    def handle(self, *args, **options):
+        prefix = f'typingbench-{uuid.uuid4().hex[:8]}'
+        previous_layer = channel_layers.set(DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer())
+        previous_coalescer = presence._typing_coalescer
+        
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}-{index}') for index in range(options['clients'])
+        ])
+        room = ChatRoom.objects.create()
+        room.participants.add(*users)
+        
+        try:
+            for label, window in (('without coalescing', 0), ('with coalescing', options['window'])):
+                presence._typing_coalescer = presence.TypingCoalescer(window=window)
+                layer = CountingChannelLayer(capacity=100000)
+                channel_layers.set(DEFAULT_CHANNEL_LAYER, layer)
+                asyncio.run(self.run_clients(users, room, options['keystrokes'], options['interval']))
+                self.stdout.write(
+                    f'{label}: {layer.group_sends} group sends, {layer.deliveries} socket deliveries'
+                )
+        finally:
+            presence._typing_coalescer = previous_coalescer
+            room.delete()
+            User.objects.filter(username__startswith=prefix).delete()
+            channel_layers.set(DEFAULT_CHANNEL_LAYER, previous_layer)
+    
+    async def run_clients(self, users, room, keystrokes, interval):
+        application = URLRouter(websocket_urlpatterns)
+        communicators = []
+        for user in users:
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{room.id}/')
+            communicator.scope['user'] = user
+            await communicator.connect()
+            communicators.append(communicator)
+        
+        async def client(communicator):
+            for _ in range(keystrokes):
+                await communicator.send_to(text_data=json.dumps({'type': 'typing'}))
+                await asyncio.sleep(interval)
+        
+        await asyncio.gather(*(client(communicator) for communicator in communicators))
+        # Let the consumers drain their inboxes before disconnecting
+        await asyncio.sleep(0.1)
+        for communicator in communicators:
+            await communicator.disconnect()
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from apps.chat.utils import rebuild_room_states
+
+
+class Command(BaseCommand):
+    help = 'Recompute per participant unread counters and last message pointers of all chat rooms.'
+    
+    def handle(self, *args, **options):
+        updated_states, updated_rooms = rebuild_room_states()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {updated_states} room states and {updated_rooms} last message pointers'
+        ))
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:10
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def backfill_room_states(apps, schema_editor):
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    ChatRoomState = apps.get_model('chat', 'ChatRoomState')
+    Message = apps.get_model('chat', 'Message')
+    Membership = ChatRoom.participants.through
+    
+    ChatRoomState.objects.bulk_create(
+        [
+            ChatRoomState(chat_room_id=chat_room_id, user_id=user_id)
+            for chat_room_id, user_id in Membership.objects.values_list('chatroom_id', 'user_id')
+        ],
+        ignore_conflicts=True,
+        batch_size=1000
+    )
+    
+    unread = Message.objects.filter(
+        chat_room=OuterRef('chat_room'),
+        is_read=False
+    ).exclude(
+        sender=OuterRef('user')
+    ).order_by().values('chat_room').annotate(count=Count('id')).values('count')
+    ChatRoomState.objects.update(unread_count=Coalesce(Subquery(unread), 0))
+    
+    last_message = Message.objects.filter(
+        chat_room=OuterRef('pk')
+    ).order_by('-created_at', '-id').values('id')[:1]
+    ChatRoom.objects.update(last_message=Subquery(last_message))
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0002_initial'),
+    ]
+    
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.CreateModel(
+            name='ChatRoomState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('chat_room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='states', to='chat.chatroom')),
+                ('last_read_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_room_states', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'chat_room_states',
+                'indexes': [models.Index(fields=['user', 'chat_room'], name='chat_room_s_user_id_a6cd5e_idx')],
+                'unique_together': {('chat_room', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_room_states, migrations.RunPython.noop),
+    ]
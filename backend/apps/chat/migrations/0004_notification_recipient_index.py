@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('chat', '0003_chat_room_state'),
+    ]
+    
+    operations = [
+        migrations.AddIndex(
+            model_name='chatnotification',
+            index=models.Index(fields=['recipient', 'is_read', 'created_at'], name='chat_notifi_recipie_7999cc_idx'),
+        ),
+    ]
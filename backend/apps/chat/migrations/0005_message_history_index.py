@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('chat', '0004_notification_recipient_index'),
+    ]
+    
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat_room', 'created_at', 'id'], name='chat_messag_chat_ro_3078c8_idx'),
+        ),
+    ]
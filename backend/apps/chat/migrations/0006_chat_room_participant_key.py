@@ -0,0 +1,51 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:18
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def backfill_participant_keys(apps, schema_editor):
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Membership = ChatRoom.participants.through
+    
+    participants = defaultdict(list)
+    for chat_room_id, user_id in Membership.objects.values_list('chatroom_id', 'user_id'):
+        participants[chat_room_id].append(user_id)
+    
+    # Only two person rooms get a key, and only the oldest room of duplicates
+    seen = set()
+    for chat_room_id, listing_id in ChatRoom.objects.order_by('created_at', 'id').values_list('id', 'listing_id'):
+        user_ids = participants.get(chat_room_id, [])
+        if len(user_ids) != 2:
+            continue
+        low, high = sorted(user_ids)
+        participant_key = f"{low}:{high}"
+        if (participant_key, listing_id) in seen:
+            continue
+        seen.add((participant_key, listing_id))
+        ChatRoom.objects.filter(id=chat_room_id).update(participant_key=participant_key)
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('chat', '0005_message_history_index'),
+    ]
+    
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='participant_key',
+            field=models.CharField(blank=True, editable=False, max_length=41, null=True),
+        ),
+        migrations.RunPython(backfill_participant_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(condition=models.Q(('listing__isnull', False)), fields=('participant_key', 'listing'), name='unique_chat_room_pair_listing'),
+        ),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(condition=models.Q(('listing__isnull', True)), fields=('participant_key',), name='unique_chat_room_pair'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_chat_room_participant_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='image_blurhash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
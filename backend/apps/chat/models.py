@@ -1,21 +1,88 @@
-from django.db import models
-from django.contrib.gis.db import models as gis_models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, OuterRef, Q, Subquery
 from apps.users.models import User
 from apps.listings.models import Listing
 
 
+class ChatRoomQuerySet(models.QuerySet):
+    """Custom queryset for chat rooms."""
+    
+    def inbox_for(self, user):
+        """Annotate a user's rooms with everything the inbox renders, in one query."""
+        others = User.objects.filter(chat_rooms=OuterRef('pk')).exclude(id=user.id).order_by('id')
+        return self.filter(
+            states__user=user
+        ).select_related('last_message').annotate(
+            unread=F('states__unread_count'),
+            other_id=Subquery(others.values('id')[:1]),
+            other_username=Subquery(others.values('username')[:1]),
+            other_avatar=Subquery(others.values('avatar')[:1]),
+        )
+    
+    def get_or_create_between(self, user_id, other_id, listing_id=None):
+        """Get the room of two users about a listing, creating it if needed.
+        
+        Existing rooms are found with one lookup on the participant key. Two
+        requests racing to create the same room are settled by the unique
+        constraint: the loser reads the winner's room.
+        """
+        if int(user_id) == int(other_id):
+            raise ValueError("Users cannot chat with themselves.")
+        participant_key = ChatRoom.make_participant_key(user_id, other_id)
+        room = self.filter(participant_key=participant_key, listing_id=listing_id).first()
+        if room is not None:
+            return room, False
+        
+        # Foreign keys are only checked at commit, so validate before creating
+        user_ids = {int(user_id), int(other_id)}
+        if User.objects.filter(id__in=user_ids).count() != len(user_ids):
+            raise User.DoesNotExist("Chat participant not found.")
+        if listing_id is not None and not Listing.objects.filter(id=listing_id).exists():
+            raise Listing.DoesNotExist("Chat listing not found.")
+        
+        try:
+            with transaction.atomic():
+                room = self.create(participant_key=participant_key, listing_id=listing_id)
+                room.participants.add(user_id, other_id)
+        except IntegrityError:
+            return self.get(participant_key=participant_key, listing_id=listing_id), False
+        return room, True
+
+
 class ChatRoom(models.Model):
     """Model for chat rooms between users."""
     
     participants = models.ManyToManyField(User, related_name='chat_rooms')
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='chat_rooms', null=True, blank=True)
+    participant_key = models.CharField(max_length=41, null=True, blank=True, editable=False)
     is_active = models.BooleanField(default=True)
+    last_message = models.ForeignKey(
+        'Message',
+        on_delete=models.SET_NULL,
+        related_name='+',
+        null=True,
+        blank=True
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ChatRoomQuerySet.as_manager()
+    
     class Meta:
         db_table = 'chat_rooms'
         ordering = ['-updated_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['participant_key', 'listing'],
+                condition=Q(listing__isnull=False),
+                name='unique_chat_room_pair_listing'
+            ),
+            models.UniqueConstraint(
+                fields=['participant_key'],
+                condition=Q(listing__isnull=True),
+                name='unique_chat_room_pair'
+            ),
+        ]
     
     def __str__(self):
         participants_names = ', '.join([user.username for user in self.participants.all()])
@@ -24,6 +91,12 @@ class ChatRoom(models.Model):
     def get_other_participant(self, user):
         """Get the other participant in the chat."""
         return self.participants.exclude(id=user.id).first()
+    
+    @staticmethod
+    def make_participant_key(user_id, other_id):
+        """Build the order independent key of a pair of users."""
+        low, high = sorted((int(user_id), int(other_id)))
+        return f"{low}:{high}"
 
 
 class Message(models.Model):
@@ -41,6 +114,8 @@ class Message(models.Model):
     message_type = models.CharField(max_length=10, choices=MESSAGE_TYPES, default='text')
     content = models.TextField()
     image = models.ImageField(upload_to='chat_images/', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    image_blurhash = models.CharField(max_length=64, blank=True, editable=False)
     file = models.FileField(upload_to='chat_files/', null=True, blank=True)
     is_read = models.BooleanField(default=False)
     read_at = models.DateTimeField(null=True, blank=True)
@@ -49,6 +124,9 @@ class Message(models.Model):
     class Meta:
         db_table = 'chat_messages'
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['chat_room', 'created_at', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.sender.username}: {self.content[:50]}"
@@ -62,6 +140,32 @@ class Message(models.Model):
             self.save(update_fields=['is_read', 'read_at'])
 
 
+class ChatRoomState(models.Model):
+    """Per participant state of a chat room, kept up to date on message create and read."""
+    
+    chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='states')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_room_states')
+    unread_count = models.PositiveIntegerField(default=0)
+    last_read_message = models.ForeignKey(
+        Message,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        null=True,
+        blank=True
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'chat_room_states'
+        unique_together = ['chat_room', 'user']
+        indexes = [
+            models.Index(fields=['user', 'chat_room']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} in room {self.chat_room_id}: {self.unread_count} unread"
+
+
 class MessageRead(models.Model):
     """Model for tracking message read status."""
     
@@ -98,6 +202,9 @@ class ChatNotification(models.Model):
     class Meta:
         db_table = 'chat_notifications'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['recipient', 'is_read', 'created_at']),
+        ]
     
     def __str__(self):
         return f"{self.recipient.username} - {self.notification_type}" 
\ No newline at end of file
@@ -0,0 +1,53 @@
+"""
+Chat notification dispatch.
+
+Notifications are stored with one ``bulk_create`` and pushed to each
+recipient's ``user_{id}`` channel group once the surrounding transaction
+commits, so clients never hear about rows that were rolled back.
+"""
+
+from functools import partial
+
+from django.db import transaction
+
+from .models import ChatNotification
+from .serializers import ChatNotificationCompactSerializer
+from .utils import broadcast_to_group
+
+
+def build_message_notifications(chat_room_id, sender_id, sender_username, participant_ids):
+    """Build unsaved new message notifications for every participant but the sender."""
+    return [
+        ChatNotification(
+            recipient_id=participant_id,
+            sender_id=sender_id,
+            chat_room_id=chat_room_id,
+            notification_type='new_message',
+            message=f"New message from {sender_username}"
+        )
+        for participant_id in participant_ids
+        if participant_id != sender_id
+    ]
+
+
+def push_notifications(payloads):
+    """Send serialized notifications to their recipients' sockets."""
+    for recipient_id, payload in payloads:
+        broadcast_to_group(f'user_{recipient_id}', {
+            'type': 'notification_message',
+            'notification': payload,
+        })
+
+
+def dispatch_notifications(notifications):
+    """Store notifications in bulk and push them after the transaction commits."""
+    if not notifications:
+        return []
+    
+    notifications = ChatNotification.objects.bulk_create(notifications)
+    payloads = [
+        (notification.recipient_id, ChatNotificationCompactSerializer(notification).data)
+        for notification in notifications
+    ]
+    transaction.on_commit(partial(push_notifications, payloads))
+    return notifications
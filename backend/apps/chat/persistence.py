@@ -0,0 +1,167 @@
+"""
+Batched persistence for websocket chat messages.
+
+Consumers hand inbound messages to a per event loop writer instead of
+saving them one by one. The writer coalesces everything that arrives within
+a short window into a micro-batch and stores it with one transaction per
+room: messages, sender read receipts and notifications are written with
+``bulk_create`` and counters are bumped once per room. A room that fails
+to store only fails the messages sent to it.
+"""
+
+import asyncio
+import logging
+import weakref
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from channels.db import database_sync_to_async  # type: ignore
+from django.conf import settings
+from django.db import transaction
+
+from .models import ChatRoom, Message, MessageRead
+from .notifications import build_message_notifications, dispatch_notifications
+from .utils import register_new_messages
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingMessage:
+    """A message waiting for the next batch flush."""
+    
+    chat_room_id: int
+    sender_id: int
+    sender_username: str
+    content: str
+    participant_ids: frozenset
+    future: asyncio.Future = field(repr=False)
+
+
+def persist_room_messages(chat_room_id, pending):
+    """Store the pending messages of one room in one transaction."""
+    with transaction.atomic():
+        messages = Message.objects.bulk_create([
+            Message(
+                chat_room_id=chat_room_id,
+                sender_id=item.sender_id,
+                content=item.content
+            )
+            for item in pending
+        ])
+        
+        # Senders have read their own messages
+        MessageRead.objects.bulk_create(
+            [MessageRead(message=message, user_id=message.sender_id) for message in messages],
+            ignore_conflicts=True
+        )
+        
+        register_new_messages(
+            ChatRoom(id=chat_room_id),
+            messages,
+            participant_ids=pending[-1].participant_ids
+        )
+        
+        dispatch_notifications([
+            notification
+            for item in pending
+            for notification in build_message_notifications(
+                chat_room_id,
+                item.sender_id,
+                item.sender_username,
+                item.participant_ids
+            )
+        ])
+    
+    return messages
+
+
+def persist_messages(pending):
+    """Store a batch of pending messages, one transaction per room.
+    
+    Returns the saved message for each pending message in order, or the
+    exception that rolled back its room.
+    """
+    pending_by_room = defaultdict(list)
+    for item in pending:
+        pending_by_room[item.chat_room_id].append(item)
+    
+    results = {}
+    for chat_room_id, room_pending in pending_by_room.items():
+        try:
+            messages = persist_room_messages(chat_room_id, room_pending)
+        except Exception as exc:
+            logger.exception('Could not store %d messages for chat room %s', len(room_pending), chat_room_id)
+            messages = [exc] * len(room_pending)
+        for item, message in zip(room_pending, messages):
+            results[id(item)] = message
+    
+    return [results[id(item)] for item in pending]
+
+
+class MessageWriter:
+    """Coalesces messages submitted on one event loop into batched writes."""
+    
+    def __init__(self, max_batch_size=100, max_delay=0.01):
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.pending = []
+        self.flush_task = None
+    
+    async def submit(self, chat_room_id, sender, content, participant_ids):
+        """Queue a message and wait until its batch is stored."""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(PendingMessage(
+            chat_room_id=int(chat_room_id),
+            sender_id=sender.id,
+            sender_username=sender.username,
+            content=content,
+            participant_ids=frozenset(participant_ids),
+            future=future
+        ))
+        
+        if len(self.pending) >= self.max_batch_size:
+            asyncio.ensure_future(self.flush())
+        elif self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+        return await future
+    
+    async def flush_later(self):
+        await asyncio.sleep(self.max_delay)
+        self.flush_task = None
+        await self.flush()
+    
+    async def flush(self):
+        """Write everything queued so far as one batch."""
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        
+        try:
+            results = await database_sync_to_async(persist_messages)(batch)
+        except Exception as exc:
+            results = [exc] * len(batch)
+        
+        for item, result in zip(batch, results):
+            if item.future.done():
+                continue
+            if isinstance(result, Exception):
+                item.future.set_exception(result)
+            else:
+                item.future.set_result(result)
+
+
+_writers = weakref.WeakKeyDictionary()
+
+
+def get_message_writer():
+    """Return the message writer of the running event loop."""
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None:
+        options = getattr(settings, 'CHAT_MESSAGE_BATCH', {})
+        writer = _writers[loop] = MessageWriter(
+            max_batch_size=options.get('MAX_BATCH_SIZE', 100),
+            max_delay=options.get('MAX_DELAY', 0.01)
+        )
+    return writer
@@ -0,0 +1,293 @@
+"""
+Presence tracking and typing indicator coalescing.
+
+A user is online while at least one of their notification sockets is
+connected and heartbeating. Sessions that miss heartbeats for longer than
+the timeout are expired, so crashed workers do not leave users online
+forever. Typing frames are coalesced per user and room so that at most one
+broadcast goes out per window. The default coalescer only sees its own
+process, so with several workers each lets a frame through per window;
+``RedisTypingCoalescer`` enforces the window across all of them.
+"""
+
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import ChatRoom
+
+
+class BasePresenceBackend:
+    """Base class for presence backends."""
+    
+    def __init__(self, timeout=60, **options):
+        self.timeout = timeout
+        self.last_sweep = time.monotonic()
+    
+    def connect(self, user_id, session_id):
+        """Register a session, returning True if the user just came online."""
+        raise NotImplementedError
+    
+    def heartbeat(self, user_id, session_id):
+        """Extend the lifetime of a session."""
+        raise NotImplementedError
+    
+    def disconnect(self, user_id, session_id):
+        """Remove a session, returning True if the user just went offline."""
+        raise NotImplementedError
+    
+    def expire(self):
+        """Drop timed out sessions, returning the ids of users who went offline."""
+        raise NotImplementedError
+    
+    def online_user_ids(self, user_ids):
+        """Get the subset of the given users that is online."""
+        raise NotImplementedError
+    
+    def is_online(self, user_id):
+        return user_id in self.online_user_ids([user_id])
+    
+    def sweep_due(self):
+        """Check whether expiry should run, at most twice per timeout."""
+        now = time.monotonic()
+        if now - self.last_sweep < self.timeout / 2:
+            return False
+        self.last_sweep = now
+        return True
+
+
+class InMemoryPresenceBackend(BasePresenceBackend):
+    """In-process presence, used for tests and single-node deployments."""
+    
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._sessions = defaultdict(dict)
+        self._lock = threading.Lock()
+    
+    def connect(self, user_id, session_id):
+        with self._lock:
+            was_online = bool(self._live_sessions(user_id))
+            self._sessions[user_id][session_id] = time.monotonic() + self.timeout
+            return not was_online
+    
+    def heartbeat(self, user_id, session_id):
+        with self._lock:
+            self._sessions[user_id][session_id] = time.monotonic() + self.timeout
+    
+    def disconnect(self, user_id, session_id):
+        with self._lock:
+            sessions = self._sessions.get(user_id, {})
+            sessions.pop(session_id, None)
+            if self._live_sessions(user_id):
+                return False
+            self._sessions.pop(user_id, None)
+            return True
+    
+    def expire(self):
+        now = time.monotonic()
+        offline = []
+        with self._lock:
+            for user_id, sessions in list(self._sessions.items()):
+                for session_id, expires_at in list(sessions.items()):
+                    if expires_at <= now:
+                        del sessions[session_id]
+                if not sessions:
+                    del self._sessions[user_id]
+                    offline.append(user_id)
+        return offline
+    
+    def online_user_ids(self, user_ids):
+        with self._lock:
+            return {user_id for user_id in user_ids if self._live_sessions(user_id)}
+    
+    def _live_sessions(self, user_id):
+        now = time.monotonic()
+        return [
+            session_id for session_id, expires_at in self._sessions.get(user_id, {}).items()
+            if expires_at > now
+        ]
+
+
+class RedisPresenceBackend(BasePresenceBackend):
+    """Presence shared by all workers.
+    
+    Each user has a sorted set of sessions scored by expiry time. A global
+    sorted set of ``user:session`` members lets expiry find timed out
+    sessions without scanning every user.
+    """
+    
+    def __init__(self, url=None, prefix='chat:presence', **options):
+        super().__init__(**options)
+        import redis
+        self.client = redis.Redis.from_url(url or settings.REDIS_URL)
+        self.prefix = prefix
+        self.sessions_key = f'{prefix}:sessions'
+    
+    def user_key(self, user_id):
+        return f'{self.prefix}:user:{user_id}'
+    
+    def connect(self, user_id, session_id):
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(self.user_key(user_id), 0, now)
+        pipe.zcard(self.user_key(user_id))
+        pipe.zadd(self.user_key(user_id), {session_id: now + self.timeout})
+        pipe.zadd(self.sessions_key, {f'{user_id}:{session_id}': now + self.timeout})
+        pipe.expire(self.user_key(user_id), self.timeout * 2)
+        _, live_sessions, _, _, _ = pipe.execute()
+        return live_sessions == 0
+    
+    def heartbeat(self, user_id, session_id):
+        expires_at = time.time() + self.timeout
+        pipe = self.client.pipeline()
+        pipe.zadd(self.user_key(user_id), {session_id: expires_at})
+        pipe.zadd(self.sessions_key, {f'{user_id}:{session_id}': expires_at})
+        pipe.expire(self.user_key(user_id), self.timeout * 2)
+        pipe.execute()
+    
+    def disconnect(self, user_id, session_id):
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zrem(self.user_key(user_id), session_id)
+        pipe.zrem(self.sessions_key, f'{user_id}:{session_id}')
+        pipe.zremrangebyscore(self.user_key(user_id), 0, now)
+        pipe.zcard(self.user_key(user_id))
+        return pipe.execute()[-1] == 0
+    
+    def expire(self):
+        now = time.time()
+        expired = self.client.zrangebyscore(self.sessions_key, 0, now)
+        if not expired:
+            return []
+        
+        sessions_by_user = defaultdict(list)
+        for member in expired:
+            user_id, _, session_id = member.decode().partition(':')
+            sessions_by_user[int(user_id)].append(session_id)
+        
+        pipe = self.client.pipeline()
+        pipe.zrem(self.sessions_key, *expired)
+        for user_id, session_ids in sessions_by_user.items():
+            pipe.zrem(self.user_key(user_id), *session_ids)
+            pipe.zremrangebyscore(self.user_key(user_id), 0, now)
+            pipe.zcard(self.user_key(user_id))
+        results = pipe.execute()
+        
+        # Every user contributed three results after the first ZREM
+        live_counts = results[3::3]
+        return [
+            user_id for user_id, live_sessions in zip(sessions_by_user, live_counts)
+            if live_sessions == 0
+        ]
+    
+    def online_user_ids(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        now = time.time()
+        pipe = self.client.pipeline()
+        for user_id in user_ids:
+            pipe.zcount(self.user_key(user_id), now, '+inf')
+        return {user_id for user_id, live_sessions in zip(user_ids, pipe.execute()) if live_sessions}
+
+
+class TypingCoalescer:
+    """Let through at most one typing event per user and room per window, within this process."""
+    
+    def __init__(self, window=3.0):
+        self.window = window
+        self._last_sent = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+    
+    def should_broadcast(self, chat_room_id, user_id):
+        now = time.monotonic()
+        key = (chat_room_id, user_id)
+        with self._lock:
+            if now - self._last_prune > self.window * 10:
+                self._prune(now)
+            last_sent = self._last_sent.get(key)
+            if last_sent is not None and now - last_sent < self.window:
+                return False
+            self._last_sent[key] = now
+            return True
+    
+    def _prune(self, now):
+        self._last_prune = now
+        self._last_sent = {
+            key: sent_at for key, sent_at in self._last_sent.items()
+            if now - sent_at < self.window
+        }
+
+
+class RedisTypingCoalescer:
+    """Typing coalescer shared by all workers, one expiring key per user and room."""
+    
+    def __init__(self, window=3.0, url=None, prefix='chat:typing'):
+        import redis
+        self.client = redis.Redis.from_url(url or settings.REDIS_URL)
+        self.window = window
+        self.prefix = prefix
+    
+    def should_broadcast(self, chat_room_id, user_id):
+        # Only the first SET in a window creates the key
+        return bool(self.client.set(
+            f'{self.prefix}:{chat_room_id}:{user_id}',
+            1,
+            nx=True,
+            px=max(int(self.window * 1000), 1)
+        ))
+
+
+def get_contact_ids(user_id):
+    """Get the users sharing an active chat room with a user."""
+    Membership = ChatRoom.participants.through
+    return set(Membership.objects.filter(
+        chatroom__participants=user_id,
+        chatroom__is_active=True
+    ).exclude(
+        user_id=user_id
+    ).values_list('user_id', flat=True).distinct())
+
+
+_presence_backend = None
+_typing_coalescer = None
+_setup_lock = threading.Lock()
+
+
+def get_presence_settings():
+    return dict(getattr(settings, 'CHAT_PRESENCE', {}))
+
+
+def get_presence_backend():
+    """Return the configured presence backend, creating it on first use."""
+    global _presence_backend
+    if _presence_backend is None:
+        with _setup_lock:
+            if _presence_backend is None:
+                options = get_presence_settings()
+                backend = options.pop('BACKEND', 'apps.chat.presence.InMemoryPresenceBackend')
+                options.pop('TYPING_WINDOW', None)
+                options.pop('TYPING_BACKEND', None)
+                _presence_backend = import_string(backend)(
+                    timeout=options.pop('TIMEOUT', 60),
+                    **{key.lower(): value for key, value in options.items()}
+                )
+    return _presence_backend
+
+
+def get_typing_coalescer():
+    """Return the configured typing coalescer, creating it on first use."""
+    global _typing_coalescer
+    if _typing_coalescer is None:
+        with _setup_lock:
+            if _typing_coalescer is None:
+                options = get_presence_settings()
+                backend = options.get('TYPING_BACKEND', 'apps.chat.presence.TypingCoalescer')
+                _typing_coalescer = import_string(backend)(
+                    window=options.get('TYPING_WINDOW', 3.0)
+                )
+    return _typing_coalescer
@@ -1,8 +1,10 @@
 from rest_framework import serializers
+from marketplace.images import get_variant_urls
 from .models import ChatRoom, Message, MessageRead, ChatNotification
 from apps.users.serializers import UserProfileSerializer
 from apps.listings.serializers import ListingSerializer
 from apps.users.models import User
+from apps.listings.models import Listing
 
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -10,14 +12,50 @@ class MessageSerializer(serializers.ModelSerializer):
     
     sender = UserProfileSerializer(read_only=True)
     sender_name = serializers.CharField(source='sender.username', read_only=True)
+    image_variants = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
         fields = [
             'id', 'chat_room', 'sender', 'sender_name', 'message_type',
-            'content', 'image', 'file', 'is_read', 'read_at', 'created_at'
+            'content', 'image', 'image_variants', 'image_blurhash', 'file',
+            'is_read', 'read_at', 'created_at'
         ]
-        read_only_fields = ['sender', 'is_read', 'read_at', 'created_at']
+        read_only_fields = ['sender', 'image_blurhash', 'is_read', 'read_at', 'created_at']
+    
+    def get_image_variants(self, obj):
+        return get_variant_urls(obj.image.storage, obj.image_variants, self.context.get('request'))
+
+
+class MessageCompactSerializer(serializers.ModelSerializer):
+    """Compact message representation for history pages, senders are side-loaded."""
+    
+    sender_id = serializers.IntegerField(read_only=True)
+    image_variants = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Message
+        fields = [
+            'id', 'sender_id', 'message_type', 'content', 'image', 'image_variants',
+            'image_blurhash', 'file', 'is_read', 'read_at', 'created_at'
+        ]
+        read_only_fields = fields
+    
+    def get_image_variants(self, obj):
+        return get_variant_urls(obj.image.storage, obj.image_variants, self.context.get('request'))
+
+
+class MessageHistorySerializer(serializers.Serializer):
+    """Query parameters of the message history endpoint."""
+    
+    before = serializers.IntegerField(required=False, min_value=1)
+    after = serializers.IntegerField(required=False, min_value=1)
+    limit = serializers.IntegerField(required=False, default=50, min_value=1, max_value=200)
+    
+    def validate(self, attrs):
+        if 'before' in attrs and 'after' in attrs:
+            raise serializers.ValidationError("Use either before or after, not both.")
+        return attrs
 
 
 class ChatRoomSerializer(serializers.ModelSerializer):
@@ -39,16 +77,19 @@ class ChatRoomSerializer(serializers.ModelSerializer):
     
     def get_last_message(self, obj):
         """Get the last message in the chat room."""
-        last_message = obj.messages.last()
+        last_message = obj.last_message
         if last_message:
             return MessageSerializer(last_message).data
         return None
     
     def get_unread_count(self, obj):
         """Get unread message count for current user."""
+        if hasattr(obj, 'unread'):
+            return obj.unread
         user = self.context['request'].user
         if user.is_authenticated:
-            return obj.messages.filter(is_read=False).exclude(sender=user).count()
+            state = obj.states.filter(user=user).values_list('unread_count', flat=True).first()
+            return state or 0
         return 0
     
     def get_other_participant(self, obj):
@@ -71,37 +112,26 @@ class ChatRoomCreateSerializer(serializers.ModelSerializer):
         model = ChatRoom
         fields = ['participant_id', 'listing_id']
     
+    def validate_participant_id(self, value):
+        if value == self.context['request'].user.id:
+            raise serializers.ValidationError("You cannot start a chat with yourself.")
+        return value
+    
     def create(self, validated_data):
         participant_id = validated_data.pop('participant_id')
         listing_id = validated_data.pop('listing_id', None)
         
-        # Get or create chat room
         user = self.context['request'].user
-        participant = User.objects.get(id=participant_id)
-        
-        # Check if chat room already exists
-        existing_room = ChatRoom.objects.filter(
-            participants=user
-        ).filter(
-            participants=participant
-        ).first()
-        
-        if existing_room:
-            return existing_room
-        
-        # Create new chat room
-        chat_room = ChatRoom.objects.create(**validated_data)
-        chat_room.participants.add(user, participant)
-        
-        if listing_id:
-            from apps.listings.models import Listing
-            try:
-                listing = Listing.objects.get(id=listing_id)
-                chat_room.listing = listing
-                chat_room.save()
-            except Listing.DoesNotExist:
-                pass
-        
+        try:
+            chat_room, _ = ChatRoom.objects.get_or_create_between(
+                user.id,
+                participant_id,
+                listing_id=listing_id or None
+            )
+        except User.DoesNotExist:
+            raise serializers.ValidationError({'participant_id': "User not found."})
+        except Listing.DoesNotExist:
+            raise serializers.ValidationError({'listing_id': "Listing not found."})
         return chat_room
 
 
@@ -141,6 +171,21 @@ class ChatNotificationSerializer(serializers.ModelSerializer):
         read_only_fields = ['recipient', 'created_at']
 
 
+class ChatNotificationCompactSerializer(serializers.ModelSerializer):
+    """Flat notification payload for lists and realtime pushes."""
+    
+    sender_id = serializers.IntegerField(read_only=True)
+    chat_room_id = serializers.IntegerField(read_only=True)
+    
+    class Meta:
+        model = ChatNotification
+        fields = [
+            'id', 'notification_type', 'message', 'sender_id',
+            'chat_room_id', 'is_read', 'created_at'
+        ]
+        read_only_fields = fields
+
+
 class ChatRoomListSerializer(serializers.ModelSerializer):
     """Serializer for listing chat rooms."""
     
@@ -158,6 +203,16 @@ class ChatRoomListSerializer(serializers.ModelSerializer):
     
     def get_other_participant(self, obj):
         """Get the other participant in the chat."""
+        if hasattr(obj, 'other_id'):
+            if obj.other_id is None:
+                return None
+            avatar = User._meta.get_field('avatar').storage.url(obj.other_avatar) if obj.other_avatar else None
+            return {
+                'id': obj.other_id,
+                'username': obj.other_username,
+                'avatar': avatar
+            }
+        
         user = self.context['request'].user
         if user.is_authenticated:
             other_user = obj.get_other_participant(user)
@@ -171,20 +226,23 @@ class ChatRoomListSerializer(serializers.ModelSerializer):
     
     def get_last_message(self, obj):
         """Get the last message in the chat room."""
-        last_message = obj.messages.last()
+        last_message = obj.last_message
         if last_message:
             return {
                 'id': last_message.id,
                 'content': last_message.content,
                 'message_type': last_message.message_type,
-                'sender_id': last_message.sender.id,
+                'sender_id': last_message.sender_id,
                 'created_at': last_message.created_at
             }
         return None
     
     def get_unread_count(self, obj):
         """Get unread message count for current user."""
+        if hasattr(obj, 'unread'):
+            return obj.unread
         user = self.context['request'].user
         if user.is_authenticated:
-            return obj.messages.filter(is_read=False).exclude(sender=user).count()
+            state = obj.states.filter(user=user).values_list('unread_count', flat=True).first()
+            return state or 0
         return 0 
\ No newline at end of file
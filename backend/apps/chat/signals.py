@@ -0,0 +1,62 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+
+from marketplace.images import schedule_image_processing
+from .models import ChatRoom, ChatRoomState, Message
+from .utils import broadcast_to_group, ensure_room_states
+
+
+def broadcast_membership_change(chat_room_ids, added=(), removed=(), cleared=False):
+    """Tell connected consumers of each room to update their membership cache."""
+    for chat_room_id in chat_room_ids:
+        broadcast_to_group(f'chat_{chat_room_id}', {
+            'type': 'membership_changed',
+            'added': list(added),
+            'removed': list(removed),
+            'cleared': cleared,
+        })
+
+
+@receiver(m2m_changed, sender=ChatRoom.participants.through)
+def sync_room_states(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep one state row per chat room participant."""
+    if action == 'post_add' and pk_set:
+        if reverse:
+            ensure_room_states(pk_set, [instance.pk])
+            broadcast = partial(broadcast_membership_change, pk_set, added=[instance.pk])
+        else:
+            ensure_room_states([instance.pk], pk_set)
+            broadcast = partial(broadcast_membership_change, [instance.pk], added=pk_set)
+    elif action == 'post_remove' and pk_set:
+        # The participant key no longer describes rooms that lost someone
+        if reverse:
+            ChatRoom.objects.filter(id__in=pk_set).update(participant_key=None)
+            ChatRoomState.objects.filter(user=instance, chat_room_id__in=pk_set).delete()
+            broadcast = partial(broadcast_membership_change, pk_set, removed=[instance.pk])
+        else:
+            ChatRoom.objects.filter(id=instance.pk).update(participant_key=None)
+            ChatRoomState.objects.filter(chat_room=instance, user_id__in=pk_set).delete()
+            broadcast = partial(broadcast_membership_change, [instance.pk], removed=pk_set)
+    elif action == 'pre_clear':
+        if reverse:
+            chat_room_ids = list(instance.chat_rooms.values_list('id', flat=True))
+            ChatRoom.objects.filter(id__in=chat_room_ids).update(participant_key=None)
+            ChatRoomState.objects.filter(user=instance).delete()
+            broadcast = partial(broadcast_membership_change, chat_room_ids, removed=[instance.pk])
+        else:
+            ChatRoom.objects.filter(id=instance.pk).update(participant_key=None)
+            ChatRoomState.objects.filter(chat_room=instance).delete()
+            broadcast = partial(broadcast_membership_change, [instance.pk], cleared=True)
+    else:
+        return
+    
+    transaction.on_commit(broadcast)
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, **kwargs):
+    if instance.image:
+        schedule_image_processing(instance, variants_field='image_variants', blurhash_field='image_blurhash')
@@ -0,0 +1,673 @@
+import json
+import uuid
+from importlib import import_module
+from unittest import mock, skipUnless
+
+from channels.db import database_sync_to_async  # type: ignore
+from channels.routing import URLRouter  # type: ignore
+from channels.testing import WebsocketCommunicator  # type: ignore
+from django.apps import apps
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.categories.models import Category
+from apps.listings.models import Listing
+from apps.users.models import User
+from .consumers import ChatConsumer, NotificationConsumer
+from .models import ChatNotification, ChatRoom, ChatRoomQuerySet, ChatRoomState, Message
+from .notifications import build_message_notifications, dispatch_notifications
+from .persistence import PendingMessage, persist_messages
+from .presence import (
+    InMemoryPresenceBackend, RedisPresenceBackend, RedisTypingCoalescer, TypingCoalescer, get_presence_backend
+)
+from .routing import websocket_urlpatterns
+from .serializers import ChatNotificationCompactSerializer
+from .utils import mark_room_read, rebuild_room_states, register_new_messages
+
+
+def redis_available():
+    try:
+        import redis
+        return redis.Redis.from_url(settings.REDIS_URL, socket_connect_timeout=0.2).ping()
+    except Exception:
+        return False
+
+
+def delete_redis_keys(client, prefix):
+    keys = client.keys(f'{prefix}:*')
+    if keys:
+        client.delete(*keys)
+
+
+@override_settings(ROOT_URLCONF='apps.chat.urls')
+class ChatInboxTests(TestCase):
+    """The inbox is served in a constant number of queries."""
+    
+    def setUp(self):
+        self.user = User.objects.create(username='buyer', email='buyer@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def create_rooms(self, count):
+        """Create rooms with two messages from the other participant, one of them read."""
+        start = User.objects.count()
+        others = User.objects.bulk_create([
+            User(username=f'seller{number}', email=f'seller{number}@example.com')
+            for number in range(start, start + count)
+        ])
+        rooms = ChatRoom.objects.bulk_create([
+            ChatRoom(participant_key=ChatRoom.make_participant_key(self.user.id, other.id))
+            for other in others
+        ])
+        ChatRoom.participants.through.objects.bulk_create([
+            ChatRoom.participants.through(chatroom_id=room.id, user_id=user_id)
+            for room, other in zip(rooms, others)
+            for user_id in (self.user.id, other.id)
+        ])
+        Message.objects.bulk_create([
+            Message(chat_room=room, sender=other, content=content, is_read=is_read)
+            for room, other in zip(rooms, others)
+            for content, is_read in ((f'Hello from {other.username}', True), (f'Still available, {other.username}?', False))
+        ])
+        rebuild_room_states()
+    
+    def get_inbox(self):
+        response = self.client.get('/rooms/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+    
+    def test_query_count_does_not_grow_with_the_inbox(self):
+        self.create_rooms(3)
+        with CaptureQueriesContext(connection) as queries:
+            self.get_inbox()
+        self.assertLessEqual(len(queries), 2)
+        
+        self.create_rooms(997)
+        self.assertEqual(ChatRoom.objects.filter(participants=self.user).count(), 1000)
+        with self.assertNumQueries(len(queries)):
+            data = self.get_inbox()
+        
+        self.assertEqual(data['count'], 1000)
+        for room in data['results']:
+            username = room['other_participant']['username']
+            self.assertEqual(room['last_message']['content'], f'Still available, {username}?')
+            self.assertEqual(room['unread_count'], 1)
+    
+    def test_total_unread_count(self):
+        self.create_rooms(5)
+        response = self.client.get('/unread-count/')
+        self.assertEqual(response.json(), {'unread_count': 5})
+
+
+class MarkRoomReadTests(TestCase):
+    """Marking a room read follows the stored room, not the caller's copy."""
+    
+    def setUp(self):
+        self.buyer = User.objects.create(username='buyer', email='buyer@example.com')
+        self.seller = User.objects.create(username='seller', email='seller@example.com')
+        self.room, _ = ChatRoom.objects.get_or_create_between(self.buyer.id, self.seller.id)
+    
+    def send(self, content):
+        message = Message.objects.create(chat_room=self.room, sender=self.seller, content=content)
+        register_new_messages(self.room, [message], participant_ids=[self.buyer.id, self.seller.id])
+        return message
+    
+    def get_state(self):
+        return ChatRoomState.objects.get(chat_room=self.room, user=self.buyer)
+    
+    def test_stale_room_reads_up_to_the_stored_last_message(self):
+        self.send('Hello')
+        stale = ChatRoom.objects.get(id=self.room.id)
+        last = self.send('Still available?')
+        
+        self.assertEqual(mark_room_read(stale, self.buyer), 2)
+        
+        state = self.get_state()
+        self.assertEqual((state.unread_count, state.last_read_message_id), (0, last.id))
+        self.assertEqual(stale.last_message_id, last.id)
+    
+    def test_messages_past_the_last_message_stay_unread(self):
+        first = self.send('Hello')
+        # Created but not yet the room's last message, as while another batch commits
+        Message.objects.create(chat_room=self.room, sender=self.seller, content='Still available?')
+        Message.objects.create(chat_room=self.room, sender=self.buyer, content='Yes')
+        
+        self.assertEqual(mark_room_read(self.room, self.buyer), 1)
+        
+        state = self.get_state()
+        self.assertEqual((state.unread_count, state.last_read_message_id), (1, first.id))
+    
+    def test_non_participant(self):
+        outsider = User.objects.create(username='outsider', email='outsider@example.com')
+        self.assertIsNone(mark_room_read(self.room, outsider))
+
+
+class PersistMessagesTests(TestCase):
+    """A batch is stored room by room, so one bad room does not sink the others."""
+    
+    def setUp(self):
+        self.buyer = User.objects.create(username='buyer', email='buyer@example.com')
+        self.sellers = [
+            User.objects.create(username=f'seller{number}', email=f'seller{number}@example.com')
+            for number in range(2)
+        ]
+        self.rooms = [
+            ChatRoom.objects.get_or_create_between(self.buyer.id, seller.id)[0]
+            for seller in self.sellers
+        ]
+    
+    def pending(self, room, seller, content):
+        return PendingMessage(
+            chat_room_id=room.id,
+            sender_id=seller.id,
+            sender_username=seller.username,
+            content=content,
+            participant_ids=frozenset([self.buyer.id, seller.id]),
+            future=None
+        )
+    
+    def test_failing_room_only_fails_its_own_messages(self):
+        good, bad = self.rooms
+        batch = [
+            self.pending(good, self.sellers[0], 'Hello'),
+            self.pending(bad, self.sellers[1], None),
+            self.pending(good, self.sellers[0], 'Still available?'),
+            self.pending(bad, self.sellers[1], 'Hi'),
+        ]
+        
+        with self.assertLogs('apps.chat.persistence', 'ERROR'):
+            results = persist_messages(batch)
+        
+        self.assertEqual([message.content for message in results[::2]], ['Hello', 'Still available?'])
+        self.assertTrue(all(isinstance(result, Exception) for result in results[1::2]))
+        self.assertEqual(Message.objects.filter(chat_room=good).count(), 2)
+        self.assertEqual(Message.objects.filter(chat_room=bad).count(), 0)
+        self.assertEqual(ChatRoomState.objects.get(chat_room=good, user=self.buyer).unread_count, 2)
+        self.assertEqual(ChatRoomState.objects.get(chat_room=bad, user=self.buyer).unread_count, 0)
+        self.assertEqual(ChatNotification.objects.filter(chat_room=bad).count(), 0)
+
+
+@mock.patch('apps.chat.notifications.broadcast_to_group')
+class DispatchNotificationsTests(TestCase):
+    """Notifications are stored in one query and pushed only once committed."""
+    
+    def setUp(self):
+        self.sender = User.objects.create(username='seller', email='seller@example.com')
+        self.recipients = [
+            User.objects.create(username=f'buyer{number}', email=f'buyer{number}@example.com')
+            for number in range(3)
+        ]
+        self.room = ChatRoom.objects.create()
+    
+    def build(self):
+        return build_message_notifications(
+            self.room.id,
+            self.sender.id,
+            self.sender.username,
+            [self.sender.id] + [recipient.id for recipient in self.recipients]
+        )
+    
+    def test_notifications_are_created_in_one_query(self, broadcast):
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(1):
+            notifications = dispatch_notifications(self.build())
+        
+        self.assertEqual(len(notifications), 3)
+        self.assertEqual(
+            set(ChatNotification.objects.values_list('recipient_id', flat=True)),
+            {recipient.id for recipient in self.recipients}
+        )
+        self.assertFalse(ChatNotification.objects.filter(recipient=self.sender).exists())
+    
+    def test_pushes_compact_payloads_after_commit(self, broadcast):
+        with self.captureOnCommitCallbacks() as callbacks:
+            dispatch_notifications(self.build())
+            self.assertFalse(broadcast.called)
+        
+        for callback in callbacks:
+            callback()
+        expected = {
+            f'user_{notification.recipient_id}': {
+                'type': 'notification_message',
+                'notification': ChatNotificationCompactSerializer(notification).data,
+            }
+            for notification in ChatNotification.objects.all()
+        }
+        self.assertEqual(len(broadcast.call_args_list), 3)
+        self.assertEqual(dict(call.args for call in broadcast.call_args_list), expected)
+        _, event = broadcast.call_args.args
+        self.assertEqual(set(event['notification']), {
+            'id', 'notification_type', 'message', 'sender_id', 'chat_room_id', 'is_read', 'created_at'
+        })
+    
+    def test_rolled_back_notifications_are_not_pushed(self, broadcast):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(OperationalError), transaction.atomic():
+                dispatch_notifications(self.build())
+                raise OperationalError('message could not be stored')
+        
+        self.assertEqual(callbacks, [])
+        self.assertFalse(broadcast.called)
+        self.assertFalse(ChatNotification.objects.exists())
+    
+    def test_nothing_to_dispatch(self, broadcast):
+        with self.captureOnCommitCallbacks() as callbacks, self.assertNumQueries(0):
+            self.assertEqual(dispatch_notifications([]), [])
+        self.assertEqual(callbacks, [])
+
+
+@override_settings(ROOT_URLCONF='apps.chat.urls')
+class MessageHistoryTests(TestCase):
+    """History pages walk message id cursors in a fixed number of queries."""
+    
+    def setUp(self):
+        self.buyer = User.objects.create(username='buyer', email='buyer@example.com')
+        self.seller = User.objects.create(username='seller', email='seller@example.com')
+        self.room, _ = ChatRoom.objects.get_or_create_between(self.buyer.id, self.seller.id)
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+        Message.objects.bulk_create([
+            Message(
+                chat_room=self.room,
+                sender=self.buyer if number % 2 else self.seller,
+                content=f'Message {number}'
+            )
+            for number in range(12)
+        ])
+        self.message_ids = list(Message.objects.order_by('id').values_list('id', flat=True))
+    
+    def get_history(self, **params):
+        response = self.client.get(f'/rooms/{self.room.id}/history/', params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return data, [message['id'] for message in data['messages']]
+    
+    def test_scrolls_back_and_forward(self):
+        ids = self.message_ids
+        data, page = self.get_history(limit=5)
+        self.assertEqual(page, ids[7:])
+        self.assertEqual((data['has_older'], data['has_newer']), (True, False))
+        self.assertEqual((data['before'], data['after']), (ids[7], ids[11]))
+        
+        data, page = self.get_history(limit=5, before=data['before'])
+        self.assertEqual(page, ids[2:7])
+        self.assertEqual((data['has_older'], data['has_newer']), (True, True))
+        
+        data, page = self.get_history(limit=5, before=data['before'])
+        self.assertEqual(page, ids[:2])
+        self.assertEqual((data['has_older'], data['has_newer']), (False, True))
+        
+        data, page = self.get_history(limit=5, after=data['after'])
+        self.assertEqual(page, ids[2:7])
+        self.assertEqual((data['has_older'], data['has_newer']), (True, True))
+        
+        data, page = self.get_history(limit=5, after=ids[6])
+        self.assertEqual(page, ids[7:])
+        self.assertEqual((data['has_older'], data['has_newer']), (True, False))
+        self.assertEqual(set(data['senders']), {str(self.buyer.id), str(self.seller.id)})
+    
+    def test_messages_sent_at_the_same_time_are_ordered_by_id(self):
+        Message.objects.update(created_at=timezone.now())
+        _, page = self.get_history(limit=4, before=self.message_ids[6])
+        self.assertEqual(page, self.message_ids[2:6])
+        _, page = self.get_history(limit=4, after=self.message_ids[6])
+        self.assertEqual(page, self.message_ids[7:11])
+    
+    def test_query_count_does_not_grow_with_the_page(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.get_history(limit=2, before=self.message_ids[-1])
+        with self.assertNumQueries(len(queries)):
+            _, page = self.get_history(limit=10, before=self.message_ids[-1])
+        self.assertEqual(len(page), 10)
+        with self.assertNumQueries(len(queries)):
+            self.get_history(limit=10, after=self.message_ids[0])
+    
+    def test_cursors_from_other_rooms_return_an_empty_page(self):
+        other_seller = User.objects.create(username='other', email='other@example.com')
+        other_room, _ = ChatRoom.objects.get_or_create_between(self.buyer.id, other_seller.id)
+        foreign = Message.objects.create(chat_room=other_room, sender=other_seller, content='Elsewhere')
+        
+        data, page = self.get_history(before=foreign.id)
+        self.assertEqual(page, [])
+        self.assertEqual((data['before'], data['after']), (None, None))
+    
+    def test_invalid_parameters_are_rejected(self):
+        url = f'/rooms/{self.room.id}/history/'
+        self.assertEqual(self.client.get(url, {'before': 1, 'after': 2}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': 500}).status_code, 400)
+    
+    def test_non_participants_are_rejected(self):
+        outsider = User.objects.create(username='outsider', email='outsider@example.com')
+        self.client.force_authenticate(outsider)
+        response = self.client.get(f'/rooms/{self.room.id}/history/')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('messages', response.json())
+        
+        self.client.force_authenticate(None)
+        self.assertIn(self.client.get(f'/rooms/{self.room.id}/history/').status_code, (401, 403))
+
+
+@override_settings(ROOT_URLCONF='apps.chat.urls')
+class GetOrCreateRoomTests(TestCase):
+    """Rooms are looked up by participant key and created once per pair and listing."""
+    
+    def setUp(self):
+        self.buyer = User.objects.create(username='buyer', email='buyer@example.com')
+        self.seller = User.objects.create(username='seller', email='seller@example.com')
+        self.listing = Listing.objects.create(
+            title='Oak desk',
+            description='Solid oak desk',
+            price=50,
+            category=Category.objects.create(name='Desks', slug='desks'),
+            seller=self.seller
+        )
+    
+    def test_existing_room_is_found_in_one_query_either_way_round(self):
+        room, created = ChatRoom.objects.get_or_create_between(self.buyer.id, self.seller.id)
+        self.assertTrue(created)
+        self.assertEqual(set(room.participants.values_list('id', flat=True)), {self.buyer.id, self.seller.id})
+        
+        with self.assertNumQueries(1):
+            found, created = ChatRoom.objects.get_or_create_between(self.seller.id, self.buyer.id)
+        self.assertEqual((found, created), (room, False))
+    
+    def test_listing_rooms_are_separate(self):
+        general, _ = ChatRoom.objects.get_or_create_between(self.buyer.id, self.seller.id)
+        about_listing, created = ChatRoom.objects.get_or_create_between(
+            self.buyer.id, self.seller.id, listing_id=self.listing.id
+        )
+        
+        self.assertTrue(created)
+        self.assertNotEqual(general, about_listing)
+        self.assertEqual(
+            ChatRoom.objects.get_or_create_between(self.seller.id, self.buyer.id, listing_id=self.listing.id),
+            (about_listing, False)
+        )
+    
+    def test_losing_a_creation_race_returns_the_winners_room(self):
+        room, _ = ChatRoom.objects.get_or_create_between(self.buyer.id, self.seller.id)
+        
+        # The lookup misses as it would before the other request commits
+        with mock.patch.object(ChatRoomQuerySet, 'first', return_value=None):
+            found, created = ChatRoom.objects.get_or_create_between(self.buyer.id, self.seller.id)
+        
+        self.assertEqual((found, created), (room, False))
+        self.assertEqual(ChatRoom.objects.count(), 1)
+    
+    def test_self_chats_are_rejected(self):
+        with self.assertRaises(ValueError):
+            ChatRoom.objects.get_or_create_between(self.buyer.id, self.buyer.id)
+        
+        client = APIClient()
+        client.force_authenticate(self.buyer)
+        response = client.post('/rooms/create/', {'participant_id': self.buyer.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('participant_id', response.json())
+        self.assertFalse(ChatRoom.objects.exists())
+    
+    def test_unknown_participant(self):
+        with self.assertRaises(User.DoesNotExist):
+            ChatRoom.objects.get_or_create_between(self.buyer.id, self.seller.id + 100)
+        self.assertFalse(ChatRoom.objects.exists())
+    
+    def test_backfill_keys_the_oldest_of_duplicate_rooms(self):
+        backfill = import_module('apps.chat.migrations.0006_chat_room_participant_key').backfill_participant_keys
+        third = User.objects.create(username='third', email='third@example.com')
+        
+        def make_room(*users, listing=None):
+            room = ChatRoom.objects.create(listing=listing)
+            room.participants.add(*users)
+            return room
+        
+        oldest = make_room(self.seller, self.buyer)
+        duplicate = make_room(self.buyer, self.seller)
+        about_listing = make_room(self.buyer, self.seller, listing=self.listing)
+        group = make_room(self.buyer, self.seller, third)
+        
+        backfill(apps, None)
+        
+        keys = dict(ChatRoom.objects.values_list('id', 'participant_key'))
+        pair_key = ChatRoom.make_participant_key(self.buyer.id, self.seller.id)
+        self.assertEqual(keys, {
+            oldest.id: pair_key,
+            duplicate.id: None,
+            about_listing.id: pair_key,
+            group.id: None,
+        })
+        self.assertEqual(ChatRoom.objects.get_or_create_between(self.buyer.id, self.seller.id), (oldest, False))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatConsumerTests(TransactionTestCase):
+    """Only participants can open a room's socket or post to it."""
+    
+    def setUp(self):
+        self.buyer = User.objects.create(username='buyer', email='buyer@example.com')
+        self.seller = User.objects.create(username='seller', email='seller@example.com')
+        self.room, _ = ChatRoom.objects.get_or_create_between(self.buyer.id, self.seller.id)
+    
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.room.id}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        return communicator, connected
+    
+    async def test_non_participants_are_rejected_at_connect(self):
+        outsider = await database_sync_to_async(User.objects.create)(
+            username='outsider', email='outsider@example.com'
+        )
+        communicator, connected = await self.connect(outsider)
+        
+        self.assertFalse(connected)
+        await communicator.disconnect()
+    
+    async def test_participant_messages_are_stored_and_broadcast(self):
+        buyer, _ = await self.connect(self.buyer)
+        seller, connected = await self.connect(self.seller)
+        self.assertTrue(connected)
+        
+        await buyer.send_json_to({'type': 'chat_message', 'message': 'Still available?'})
+        
+        event = await seller.receive_json_from(timeout=5)
+        message = await database_sync_to_async(Message.objects.get)()
+        self.assertEqual(
+            (event['type'], event['message'], event['user_id'], event['message_id']),
+            ('chat_message', 'Still available?', self.buyer.id, message.id)
+        )
+        await buyer.disconnect()
+        await seller.disconnect()
+    
+    async def test_messages_are_checked_against_the_current_membership(self):
+        consumer = ChatConsumer()
+        consumer.scope = {'user': self.seller}
+        consumer.user = self.seller
+        consumer.room_name = str(self.room.id)
+        consumer.room_group_name = f'chat_{self.room.id}'
+        # As left by a membership_changed broadcast removing the seller
+        consumer.participant_ids = {self.buyer.id}
+        consumer.channel_layer = mock.Mock(group_send=mock.AsyncMock())
+        consumer.send = mock.AsyncMock()
+        
+        await consumer.receive(text_data=json.dumps({'type': 'chat_message', 'message': 'Hello'}))
+        
+        consumer.channel_layer.group_send.assert_not_called()
+        self.assertEqual(json.loads(consumer.send.call_args.kwargs['text_data'])['type'], 'error')
+        self.assertFalse(await database_sync_to_async(Message.objects.exists)())
+    
+    async def test_removed_participants_are_disconnected(self):
+        buyer, _ = await self.connect(self.buyer)
+        seller, _ = await self.connect(self.seller)
+        
+        await database_sync_to_async(self.room.participants.remove)(self.seller)
+        
+        output = await seller.receive_output(timeout=5)
+        self.assertEqual(output['type'], 'websocket.close')
+        self.assertTrue(await buyer.receive_nothing())
+        await buyer.disconnect()
+    
+    async def test_failed_write_sends_an_error_and_keeps_the_socket(self):
+        buyer, _ = await self.connect(self.buyer)
+        writer = mock.Mock()
+        writer.submit = mock.AsyncMock(side_effect=OperationalError('database is locked'))
+        
+        with mock.patch('apps.chat.consumers.get_message_writer', return_value=writer):
+            with self.assertLogs('apps.chat.consumers', 'ERROR'):
+                await buyer.send_json_to({'type': 'chat_message', 'message': 'Hello'})
+                error = await buyer.receive_json_from(timeout=5)
+        
+        self.assertEqual(error['type'], 'error')
+        await buyer.send_json_to({'type': 'chat_message', 'message': 'Hello again'})
+        event = await buyer.receive_json_from(timeout=5)
+        self.assertEqual(event['message'], 'Hello again')
+        await buyer.disconnect()
+
+
+class PresenceBackendTests(SimpleTestCase):
+    """Users are online while one of their sessions is connected and heartbeating."""
+    
+    def setUp(self):
+        self.now = 1000.0
+        clock = mock.Mock(monotonic=lambda: self.now, time=lambda: self.now)
+        patcher = mock.patch('apps.chat.presence.time', clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.presence = self.make_backend()
+    
+    def make_backend(self):
+        return InMemoryPresenceBackend(timeout=60)
+    
+    def test_first_session_brings_the_user_online(self):
+        self.assertTrue(self.presence.connect(1, 'tab-1'))
+        self.assertFalse(self.presence.connect(1, 'tab-2'))
+        
+        self.assertEqual(self.presence.online_user_ids([1, 2]), {1})
+        self.assertTrue(self.presence.is_online(1))
+    
+    def test_last_session_takes_the_user_offline(self):
+        self.presence.connect(1, 'tab-1')
+        self.presence.connect(1, 'tab-2')
+        
+        self.assertFalse(self.presence.disconnect(1, 'tab-1'))
+        self.assertTrue(self.presence.is_online(1))
+        self.assertTrue(self.presence.disconnect(1, 'tab-2'))
+        self.assertFalse(self.presence.is_online(1))
+    
+    def test_sessions_without_heartbeats_expire(self):
+        self.presence.connect(1, 'tab-1')
+        self.presence.connect(2, 'tab-1')
+        self.now += 40
+        self.presence.heartbeat(2, 'tab-1')
+        self.now += 40
+        
+        self.assertEqual(self.presence.online_user_ids([1, 2]), {2})
+        self.assertEqual(self.presence.expire(), [1])
+        self.assertEqual(self.presence.expire(), [])
+        # Coming back after expiry counts as coming online again
+        self.assertTrue(self.presence.connect(1, 'tab-2'))
+    
+    def test_sweeps_run_at_most_twice_per_timeout(self):
+        self.assertFalse(self.presence.sweep_due())
+        self.now += 30
+        self.assertTrue(self.presence.sweep_due())
+        self.assertFalse(self.presence.sweep_due())
+
+
+@skipUnless(redis_available(), 'Redis is not reachable')
+class RedisPresenceBackendTests(PresenceBackendTests):
+    
+    def make_backend(self):
+        presence = RedisPresenceBackend(timeout=60, prefix=f'test:presence:{uuid.uuid4().hex}')
+        self.addCleanup(delete_redis_keys, presence.client, presence.prefix)
+        return presence
+
+
+class TypingCoalescerTests(SimpleTestCase):
+    """At most one typing event per user and room goes out per window."""
+    
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('apps.chat.presence.time', mock.Mock(monotonic=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.coalescer = TypingCoalescer(window=3.0)
+    
+    def test_window_is_per_user_and_room(self):
+        self.assertTrue(self.coalescer.should_broadcast(1, 10))
+        self.assertFalse(self.coalescer.should_broadcast(1, 10))
+        self.assertTrue(self.coalescer.should_broadcast(1, 11))
+        self.assertTrue(self.coalescer.should_broadcast(2, 10))
+        
+        self.now += 3
+        self.assertTrue(self.coalescer.should_broadcast(1, 10))
+    
+    def test_old_entries_are_pruned(self):
+        for user_id in range(100):
+            self.coalescer.should_broadcast(1, user_id)
+        self.now += 31
+        self.coalescer.should_broadcast(2, 1)
+        
+        self.assertEqual(len(self.coalescer._last_sent), 1)
+
+
+@skipUnless(redis_available(), 'Redis is not reachable')
+class RedisTypingCoalescerTests(SimpleTestCase):
+    
+    def test_window_is_shared_by_workers(self):
+        prefix = f'test:typing:{uuid.uuid4().hex}'
+        workers = [RedisTypingCoalescer(window=3.0, prefix=prefix) for _ in range(2)]
+        self.addCleanup(delete_redis_keys, workers[0].client, prefix)
+        
+        self.assertTrue(workers[0].should_broadcast(1, 10))
+        self.assertFalse(workers[1].should_broadcast(1, 10))
+        self.assertTrue(workers[1].should_broadcast(1, 11))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class NotificationConsumerTests(TransactionTestCase):
+    """Contacts hear when a user comes online and goes offline."""
+    
+    def setUp(self):
+        self.buyer = User.objects.create(username='buyer', email='buyer@example.com')
+        self.seller = User.objects.create(username='seller', email='seller@example.com')
+        ChatRoom.objects.get_or_create_between(self.buyer.id, self.seller.id)
+    
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/notifications/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+    
+    async def test_contacts_follow_presence(self):
+        seller = await self.connect(self.seller)
+        snapshot = await seller.receive_json_from(timeout=5)
+        self.assertEqual(snapshot, {'type': 'presence_snapshot', 'online_user_ids': []})
+        
+        buyer = await self.connect(self.buyer)
+        snapshot = await buyer.receive_json_from(timeout=5)
+        self.assertEqual(snapshot['online_user_ids'], [self.seller.id])
+        update = await seller.receive_json_from(timeout=5)
+        self.assertEqual((update['user_id'], update['status']), (self.buyer.id, 'online'))
+        
+        await buyer.disconnect()
+        update = await seller.receive_json_from(timeout=5)
+        self.assertEqual((update['user_id'], update['status']), (self.buyer.id, 'offline'))
+        await seller.disconnect()
+    
+    async def test_socket_dropped_while_connecting(self):
+        consumer = NotificationConsumer()
+        consumer.scope = {'user': self.buyer}
+        consumer.channel_name = 'dropped'
+        consumer.channel_layer = mock.Mock(
+            group_add=mock.AsyncMock(side_effect=ConnectionError('channel layer unavailable')),
+            group_discard=mock.AsyncMock()
+        )
+        with self.assertRaises(ConnectionError):
+            await consumer.connect()
+        
+        await consumer.disconnect(1006)
+        
+        self.assertFalse(get_presence_backend().is_online(self.buyer.id))
@@ -14,6 +14,7 @@ urlpatterns = [
     
     # Messages
     path('rooms/<int:chat_room_id>/messages/', views.MessageListView.as_view(), name='message-list'),
+    path('rooms/<int:chat_room_id>/history/', views.MessageHistoryView.as_view(), name='message-history'),
     path('messages/create/', views.MessageCreateView.as_view(), name='message-create'),
     path('messages/read/', views.MessageReadView.as_view(), name='message-read'),
     
@@ -0,0 +1,197 @@
+import logging
+from collections import Counter, defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer  # type: ignore
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import ChatRoom, ChatRoomState, Message
+
+logger = logging.getLogger(__name__)
+
+
+def broadcast_to_group(group_name, event):
+    """Send an event to a channel layer group from synchronous code."""
+    try:
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        async_to_sync(channel_layer.group_send)(group_name, event)
+    except Exception:
+        # Realtime delivery is best effort, the database stays authoritative
+        logger.exception('Could not send %s to group %s', event.get('type'), group_name)
+
+
+def ensure_room_states(chat_room_ids, user_ids):
+    """Create missing state rows for the given participants."""
+    ChatRoomState.objects.bulk_create(
+        [
+            ChatRoomState(chat_room_id=chat_room_id, user_id=user_id)
+            for chat_room_id in chat_room_ids
+            for user_id in user_ids
+        ],
+        ignore_conflicts=True
+    )
+
+
+def register_new_messages(chat_room, messages, participant_ids=None):
+    """Bump unread counters and the last message pointer after messages are created."""
+    if not messages:
+        return
+    
+    if participant_ids is None:
+        participant_ids = list(chat_room.participants.values_list('id', flat=True))
+    senders = Counter(message.sender_id for message in messages)
+    
+    # Every participant gets the messages someone else sent; group by delta
+    participants_by_delta = defaultdict(list)
+    for user_id in participant_ids:
+        delta = len(messages) - senders.get(user_id, 0)
+        if delta:
+            participants_by_delta[delta].append(user_id)
+    
+    last_message = max(messages, key=lambda message: message.id)
+    with transaction.atomic():
+        for delta, user_ids in participants_by_delta.items():
+            ChatRoomState.objects.filter(
+                chat_room=chat_room,
+                user_id__in=user_ids
+            ).update(unread_count=F('unread_count') + delta)
+        
+        ChatRoom.objects.filter(id=chat_room.id).update(
+            last_message=last_message,
+            updated_at=timezone.now()
+        )
+    chat_room.last_message = last_message
+
+
+def decrement_unread(chat_room_id, user_id, count=1):
+    """Lower a participant's unread counter, never below zero."""
+    ChatRoomState.objects.filter(
+        chat_room_id=chat_room_id,
+        user_id=user_id
+    ).update(unread_count=Greatest(F('unread_count') - count, Value(0)))
+
+
+def mark_room_read(chat_room, user):
+    """Mark a room read for a participant with set-based updates.
+    
+    The participant's watermark moves to the room's last message, read
+    again inside the transaction so a stale room instance cannot move it
+    backwards. Messages past the watermark stay unread and are counted,
+    so no per message receipt rows are needed. Returns the number of
+    messages flagged read, or None if the user is not a participant.
+    """
+    now = timezone.now()
+    
+    with transaction.atomic():
+        # Lock the state before reading the room, the order register_new_messages writes them in
+        state = ChatRoomState.objects.select_for_update().filter(
+            chat_room=chat_room,
+            user=user
+        ).first()
+        if state is None:
+            return None
+        
+        last_message_id = ChatRoom.objects.filter(id=chat_room.id).values_list('last_message_id', flat=True).first()
+        chat_room.last_message_id = last_message_id
+        
+        others = Message.objects.filter(chat_room=chat_room).exclude(sender=user)
+        if last_message_id is not None:
+            others = others.filter(id__gt=last_message_id)
+        state.unread_count = others.count()
+        state.last_read_message_id = last_message_id
+        state.updated_at = now
+        state.save(update_fields=['unread_count', 'last_read_message', 'updated_at'])
+        
+        if last_message_id is None:
+            return 0
+        
+        return Message.objects.filter(
+            chat_room=chat_room,
+            is_read=False,
+            id__lte=last_message_id
+        ).exclude(
+            sender=user
+        ).update(is_read=True, read_at=now)
+
+
+def get_total_unread(user):
+    """Get the unread message count over all of a user's active rooms."""
+    return ChatRoomState.objects.filter(
+        user=user,
+        chat_room__is_active=True
+    ).aggregate(total=Coalesce(Sum('unread_count'), 0))['total']
+
+
+def rebuild_room_states():
+    """Recompute every state row and last message pointer from the messages."""
+    Membership = ChatRoom.participants.through
+    
+    with transaction.atomic():
+        ChatRoomState.objects.bulk_create(
+            [
+                ChatRoomState(chat_room_id=chat_room_id, user_id=user_id)
+                for chat_room_id, user_id in Membership.objects.values_list('chatroom_id', 'user_id')
+            ],
+            ignore_conflicts=True,
+            batch_size=1000
+        )
+        
+        unread = Message.objects.filter(
+            chat_room=OuterRef('chat_room'),
+            is_read=False
+        ).exclude(
+            sender=OuterRef('user')
+        ).order_by().values('chat_room').annotate(count=Count('id')).values('count')
+        updated_states = ChatRoomState.objects.update(
+            unread_count=Coalesce(Subquery(unread), 0)
+        )
+        
+        last_message = Message.objects.filter(
+            chat_room=OuterRef('pk')
+        ).order_by('-created_at', '-id').values('id')[:1]
+        updated_rooms = ChatRoom.objects.update(last_message=Subquery(last_message))
+    
+    return updated_states, updated_rooms
+
+
+def get_message_history(chat_room_id, before=None, after=None, limit=50):
+    """Get a page of messages next to a cursor message, in chronological order.
+    
+    Pages walk the (chat_room, created_at, id) index from the cursor, so the
+    cost depends on the page size and not on how far back the page is.
+    Returns the messages and whether more exist past the far end of the page.
+    """
+    messages = Message.objects.filter(chat_room_id=chat_room_id)
+    cursor_id = after if after is not None else before
+    if cursor_id is not None:
+        cursor = Message.objects.filter(
+            chat_room_id=chat_room_id,
+            id=cursor_id
+        ).values('created_at', 'id').first()
+        if cursor is None:
+            return [], False
+        if after is not None:
+            messages = messages.filter(
+                Q(created_at__gt=cursor['created_at']) |
+                Q(created_at=cursor['created_at'], id__gt=cursor['id'])
+            )
+        else:
+            messages = messages.filter(
+                Q(created_at__lt=cursor['created_at']) |
+                Q(created_at=cursor['created_at'], id__lt=cursor['id'])
+            )
+    
+    if after is not None:
+        page = list(messages.order_by('created_at', 'id')[:limit + 1])
+        has_more = len(page) > limit
+        return page[:limit], has_more
+    
+    # Without a cursor, or scrolling back, read newest first and flip the page
+    page = list(messages.order_by('-created_at', '-id')[:limit + 1])
+    has_more = len(page) > limit
+    return page[:limit][::-1], has_more
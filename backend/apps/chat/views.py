@@ -2,15 +2,24 @@ from rest_framework import generics, permissions, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
+from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
+from marketplace.pagination import KeysetPagination
 
 from .models import ChatRoom, Message, MessageRead, ChatNotification
+from apps.users.models import User
+from apps.users.serializers import UserSummarySerializer
+from .utils import (
+    register_new_messages, decrement_unread, mark_room_read, get_total_unread,
+    get_message_history
+)
 from .serializers import (
     ChatRoomSerializer, ChatRoomCreateSerializer, ChatRoomListSerializer,
     MessageSerializer, MessageCreateSerializer, MessageReadSerializer,
-    ChatNotificationSerializer
+    MessageCompactSerializer, MessageHistorySerializer, ChatNotificationCompactSerializer
 )
+from .notifications import build_message_notifications, dispatch_notifications
 
 
 class ChatRoomListView(generics.ListAPIView):
@@ -20,10 +29,7 @@ class ChatRoomListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        return ChatRoom.objects.filter(
-            participants=self.request.user,
-            is_active=True
-        ).prefetch_related('participants', 'messages')
+        return ChatRoom.objects.inbox_for(self.request.user).filter(is_active=True)
 
 
 class ChatRoomCreateView(generics.CreateAPIView):
@@ -56,12 +62,56 @@ class MessageListView(generics.ListAPIView):
     
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
     lookup_field = "chat_room_id"
     lookup_url_kwarg = "chat_room_id"
     
     def get_queryset(self):
         chat_room_id = self.kwargs.get('chat_room_id')
-        return Message.objects.filter(chat_room_id=chat_room_id)
+        return Message.objects.filter(chat_room_id=chat_room_id).select_related(
+            'sender'
+        ).prefetch_related('sender__verifications')
+
+
+class MessageHistoryView(generics.GenericAPIView):
+    """View for scrolling a chat room's history with message id cursors."""
+    
+    serializer_class = MessageCompactSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request, chat_room_id):
+        if not ChatRoom.participants.through.objects.filter(
+            chatroom_id=chat_room_id,
+            user_id=request.user.id
+        ).exists():
+            return Response(
+                {'error': 'Chat room not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        params = MessageHistorySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        before = params.validated_data.get('before')
+        after = params.validated_data.get('after')
+        limit = params.validated_data['limit']
+        
+        messages, has_more = get_message_history(chat_room_id, before=before, after=after, limit=limit)
+        
+        # Each sender is serialized once per page instead of once per message
+        sender_ids = {message.sender_id for message in messages}
+        senders = User.objects.filter(id__in=sender_ids) if sender_ids else []
+        
+        return Response({
+            'messages': self.get_serializer(messages, many=True).data,
+            'senders': {
+                str(sender.id): UserSummarySerializer(sender).data
+                for sender in senders
+            },
+            'has_older': has_more if after is None else True,
+            'has_newer': has_more if after is not None else before is not None,
+            'before': messages[0].id if messages else None,
+            'after': messages[-1].id if messages else None,
+        })
 
 
 class MessageCreateView(generics.CreateAPIView):
@@ -71,24 +121,27 @@ class MessageCreateView(generics.CreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def perform_create(self, serializer):
-        message = serializer.save()
-        
-        # Mark message as read for sender
-        MessageRead.objects.get_or_create(
-            message=message,
-            user=self.request.user
-        )
-        
-        # Create notification for other participants
-        chat_room = message.chat_room
-        for participant in chat_room.participants.exclude(id=self.request.user.id):
-            ChatNotification.objects.create(
-                recipient=participant,
-                sender=self.request.user,
-                chat_room=chat_room,
-                notification_type='new_message',
-                message=f"New message from {self.request.user.username}"
+        # The message becomes visible together with the counters it bumps
+        with transaction.atomic():
+            message = serializer.save()
+            
+            # Mark message as read for sender
+            MessageRead.objects.get_or_create(
+                message=message,
+                user=self.request.user
             )
+            
+            chat_room = message.chat_room
+            participant_ids = list(chat_room.participants.values_list('id', flat=True))
+            register_new_messages(chat_room, [message], participant_ids=participant_ids)
+        
+        # Notify the other participants, pushed to their sockets after commit
+        dispatch_notifications(build_message_notifications(
+            chat_room.id,
+            self.request.user.id,
+            self.request.user.username,
+            participant_ids
+        ))
 
 
 class MessageReadView(generics.CreateAPIView):
@@ -102,11 +155,14 @@ class MessageReadView(generics.CreateAPIView):
         
         # Verify user is participant in the chat room
         if message.chat_room.participants.filter(id=self.request.user.id).exists():
-            MessageRead.objects.get_or_create(
+            _, created = MessageRead.objects.get_or_create(
                 message=message,
                 user=self.request.user
             )
             
+            if created and not message.is_read and message.sender_id != self.request.user.id:
+                decrement_unread(message.chat_room_id, self.request.user.id)
+            
             # Update message read status
             message.mark_as_read()
 
@@ -121,20 +177,14 @@ def mark_chat_room_read(request, chat_room_id):
             participants=request.user
         )
         
-        # Mark all unread messages as read
-        unread_messages = Message.objects.filter(
-            chat_room=chat_room,
-            is_read=False
-        ).exclude(sender=request.user)
+        # One UPDATE for the messages and one for the read watermark
+        marked_count = mark_room_read(chat_room, request.user)
         
-        for message in unread_messages:
-            MessageRead.objects.get_or_create(
-                message=message,
-                user=request.user
-            )
-            message.mark_as_read()
-        
-        return Response({'message': 'Chat room marked as read'})
+        return Response({
+            'message': 'Chat room marked as read',
+            'marked_count': marked_count,
+            'last_read_message_id': chat_room.last_message_id
+        })
     
     except ChatRoom.DoesNotExist:
         return Response(
@@ -146,14 +196,15 @@ def mark_chat_room_read(request, chat_room_id):
 class ChatNotificationListView(generics.ListAPIView):
     """View for listing chat notifications."""
     
-    serializer_class = ChatNotificationSerializer
+    serializer_class = ChatNotificationCompactSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
         return ChatNotification.objects.filter(
             recipient=self.request.user,
             is_read=False
-        ).select_related('sender', 'chat_room')
+        )
 
 
 @api_view(['POST'])
@@ -196,23 +247,13 @@ class ChatRoomSearchView(generics.ListAPIView):
     
     def get_queryset(self):
         query = self.request.query_params.get('q', '')
-        user = self.request.user
+        queryset = ChatRoom.objects.inbox_for(self.request.user).filter(is_active=True)
         
         if query:
-            # Search by participant username
-            return ChatRoom.objects.filter(
-                participants=user,
-                is_active=True
-            ).filter(
-                participants__username__icontains=query
-            ).exclude(
-                participants=user
-            ).distinct()
+            # Search by the other participant's username
+            return queryset.filter(other_username__icontains=query)
         
-        return ChatRoom.objects.filter(
-            participants=user,
-            is_active=True
-        )
+        return queryset
 
 
 @api_view(['DELETE'])
@@ -239,19 +280,4 @@ def delete_chat_room(request, chat_room_id):
 @permission_classes([permissions.IsAuthenticated])
 def unread_count(request):
     """Get total unread message count."""
-    user = request.user
-    total_unread = 0
-    
-    # Count unread messages in all chat rooms
-    chat_rooms = ChatRoom.objects.filter(
-        participants=user,
-        is_active=True
-    )
-    
-    for chat_room in chat_rooms:
-        unread_count = chat_room.messages.filter(
-            is_read=False
-        ).exclude(sender=user).count()
-        total_unread += unread_count
-    
-    return Response({'unread_count': total_unread}) 
\ No newline at end of file
+    return Response({'unread_count': get_total_unread(request.user)}) 
\ No newline at end of file
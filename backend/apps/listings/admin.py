@@ -21,7 +21,7 @@ class ListingAdmin(admin.ModelAdmin):
             'fields': ('seller', 'contact_phone', 'contact_email')
         }),
         ('Location', {
-            'fields': ('location', 'address', 'city', 'state', 'country', 'postal_code')
+            'fields': ('latitude', 'longitude', 'address', 'city', 'state', 'country', 'postal_code')
         }),
         ('Status & Settings', {
             'fields': ('status', 'is_active', 'is_featured', 'is_negotiable')
@@ -57,7 +57,9 @@ class ListingFavoriteAdmin(admin.ModelAdmin):
 class ListingViewAdmin(admin.ModelAdmin):
     list_display = ['listing', 'user', 'ip_address', 'viewed_at']
     list_filter = ['viewed_at']
-    search_fields = ['listing__title', 'user__username', 'ip_address']
+    list_select_related = ['listing', 'user']
+    raw_id_fields = ['listing', 'user', 'user_agent']
+    search_fields = ['listing__title', 'user__username']
     ordering = ['-viewed_at']
     readonly_fields = ['viewed_at']
 
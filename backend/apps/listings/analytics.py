@@ -0,0 +1,329 @@
+"""
+Rolled up listing view analytics.
+
+Raw view logs are compacted into hourly rollups per listing, and hourly
+rollups into daily ones. A rollup holds the view count, a HyperLogLog
+sketch of the visitors and the most common user agents. Sketches of
+different periods merge into the unique visitors of their union, so the
+seller dashboard reads a few rollup rows instead of scanning the raw log.
+Raw logs and hourly rollups are purged after their retention period while
+daily rollups are kept.
+"""
+
+import hashlib
+import logging
+import math
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import Listing, ListingView, ListingViewRollup, UserAgent
+from .trending import truncate_to_hour
+from .view_store import decode_ip, drop_view_partitions
+
+logger = logging.getLogger(__name__)
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+
+def get_analytics_settings():
+    options = {
+        'RAW_RETENTION_DAYS': 90,
+        'HOURLY_RETENTION_DAYS': 7,
+        'TOP_USER_AGENTS': 10,
+    }
+    options.update(getattr(settings, 'LISTING_ANALYTICS', {}))
+    return options
+
+
+def truncate_to_day(value):
+    return truncate_to_hour(value).replace(hour=0)
+
+
+class HyperLogLog:
+    """Cardinality sketch with 2 ** precision one byte registers.
+    
+    With the default precision of 10 the standard error is about 3%. Small
+    sketches are stored sparsely as (register, rank) pairs.
+    """
+    
+    def __init__(self, precision=10, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = registers if registers is not None else bytearray(self.size)
+    
+    def add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+    
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size * self.size / sum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        # Linear counting is more accurate while many registers are empty
+        if estimate <= 2.5 * self.size and zeros:
+            estimate = self.size * math.log(self.size / zeros)
+        return round(estimate)
+    
+    def to_bytes(self):
+        used = [(index, rank) for index, rank in enumerate(self.registers) if rank]
+        if len(used) * 3 < self.size:
+            return b'\x01' + b''.join(index.to_bytes(2, 'big') + bytes((rank,)) for index, rank in used)
+        return b'\x00' + bytes(self.registers)
+    
+    @classmethod
+    def from_bytes(cls, data, precision=10):
+        sketch = cls(precision)
+        if not data:
+            return sketch
+        data = bytes(data)
+        if data[0] == 0:
+            sketch.registers = bytearray(data[1:])
+        else:
+            for offset in range(1, len(data), 3):
+                sketch.registers[int.from_bytes(data[offset:offset + 2], 'big')] = data[offset + 2]
+        return sketch
+
+
+def get_visitor_key(user_id, ip):
+    """Identify a visitor by account, or by address when anonymous.
+    
+    Addresses are keyed in text as they were before views stored them
+    encoded, so sketches rolled up on either side of the switch merge.
+    """
+    if user_id is not None:
+        return f'user:{user_id}'
+    if ip is not None:
+        return f'ip:{decode_ip(ip)}'
+    return None
+
+
+def top_user_agents(counts):
+    return dict(counts.most_common(get_analytics_settings()['TOP_USER_AGENTS']))
+
+
+def lock_live_listings(listing_ids):
+    """Lock the listings that still exist, so none is deleted before its rollups are written.
+    
+    Raw views have no foreign key constraint, so views written while a
+    listing was being deleted can outlive it. Rollups do have one, and
+    leave such views out instead of failing the whole period.
+    """
+    live_ids = set(Listing.objects.select_for_update().filter(
+        id__in=listing_ids
+    ).order_by('id').values_list('id', flat=True))
+    if len(live_ids) < len(listing_ids):
+        logger.info('Skipped views of %d deleted listings', len(listing_ids) - len(live_ids))
+    return live_ids
+
+
+def rollup_hour(hour):
+    """Replace the hourly rollups of one hour from the raw view logs."""
+    views = Counter()
+    sketches = defaultdict(HyperLogLog)
+    user_agents = defaultdict(Counter)
+    for listing_id, user_id, ip, user_agent_id in ListingView.objects.filter(
+        viewed_at__gte=hour,
+        viewed_at__lt=hour + HOUR
+    ).values_list('listing_id', 'user_id', 'ip', 'user_agent_id').iterator(chunk_size=5000):
+        views[listing_id] += 1
+        visitor = get_visitor_key(user_id, ip)
+        if visitor:
+            sketches[listing_id].add(visitor)
+        if user_agent_id is not None:
+            user_agents[listing_id][user_agent_id] += 1
+    
+    # Only the strings of the agents that make a top list are looked up
+    top_ids = {listing_id: top_user_agents(counts) for listing_id, counts in user_agents.items()}
+    names = dict(UserAgent.objects.filter(
+        id__in={user_agent_id for counts in top_ids.values() for user_agent_id in counts}
+    ).values_list('id', 'value'))
+    
+    with transaction.atomic():
+        live_ids = lock_live_listings(list(views))
+        ListingViewRollup.objects.filter(period='hour', start=hour).delete()
+        ListingViewRollup.objects.bulk_create(
+            [
+                ListingViewRollup(
+                    listing_id=listing_id,
+                    period='hour',
+                    start=hour,
+                    views=count,
+                    visitors=sketches[listing_id].to_bytes(),
+                    user_agents={
+                        names[user_agent_id][:200]: agent_count
+                        for user_agent_id, agent_count in top_ids.get(listing_id, {}).items()
+                        if user_agent_id in names
+                    }
+                )
+                for listing_id, count in views.items()
+                if listing_id in live_ids
+            ],
+            batch_size=1000
+        )
+    return len(live_ids)
+
+
+def rollup_day(day):
+    """Replace the daily rollups of one day by merging its hourly rollups."""
+    views = Counter()
+    sketches = {}
+    user_agents = defaultdict(Counter)
+    for listing_id, count, visitors, agents in ListingViewRollup.objects.filter(
+        period='hour',
+        start__gte=day,
+        start__lt=day + DAY
+    ).values_list('listing_id', 'views', 'visitors', 'user_agents').iterator(chunk_size=5000):
+        views[listing_id] += count
+        sketch = HyperLogLog.from_bytes(visitors)
+        if listing_id in sketches:
+            sketches[listing_id].merge(sketch)
+        else:
+            sketches[listing_id] = sketch
+        # Hourly rollups only keep their top agents, so daily totals are a lower bound
+        user_agents[listing_id].update(agents)
+    
+    with transaction.atomic():
+        live_ids = lock_live_listings(list(views))
+        ListingViewRollup.objects.filter(period='day', start=day).delete()
+        ListingViewRollup.objects.bulk_create(
+            [
+                ListingViewRollup(
+                    listing_id=listing_id,
+                    period='day',
+                    start=day,
+                    views=count,
+                    visitors=sketches[listing_id].to_bytes(),
+                    user_agents=top_user_agents(user_agents[listing_id])
+                )
+                for listing_id, count in views.items()
+                if listing_id in live_ids
+            ],
+            batch_size=1000
+        )
+    return len(live_ids)
+
+
+def get_rollup_start():
+    """Get the first hour that may still be missing from the rollups.
+    
+    The latest rolled up hour is redone because it may have been partial.
+    """
+    latest = ListingViewRollup.objects.filter(period='hour').aggregate(latest=Max('start'))['latest']
+    if latest is not None:
+        return latest
+    return get_raw_views_start()
+
+
+def get_raw_views_start():
+    """Get the first day that still has raw views.
+    
+    Raw views are purged a whole month at a time, so that day is complete.
+    """
+    earliest = ListingView.objects.aggregate(earliest=Min('viewed_at'))['earliest']
+    return truncate_to_day(earliest) if earliest is not None else None
+
+
+def rollup_views(since=None):
+    """Roll up raw views from ``since``, or from where the last run stopped, until now.
+    
+    Explicit starts are moved back to midnight so every touched day is
+    rebuilt from a complete set of hourly rollups. They are also moved
+    forward to the oldest raw views: days whose raw views were purged keep
+    their daily rollups, which could not be rebuilt.
+    """
+    if since is None:
+        start = get_rollup_start()
+    else:
+        raw_start = get_raw_views_start()
+        start = max(truncate_to_day(since), raw_start) if raw_start is not None else None
+    if start is None:
+        return 0, 0
+    
+    end = truncate_to_hour(timezone.now())
+    hours = 0
+    days = set()
+    hour = truncate_to_hour(start)
+    while hour <= end:
+        rollup_hour(hour)
+        days.add(truncate_to_day(hour))
+        hour += HOUR
+        hours += 1
+    for day in sorted(days):
+        rollup_day(day)
+    return hours, len(days)
+
+
+def delete_in_batches(queryset, batch_size=5000):
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += queryset.model.objects.filter(id__in=ids).delete()[0]
+
+
+def purge_view_logs():
+    """Expire raw views and hourly rollups past their retention.
+    
+    Raw views are dropped a whole month at a time and only once they are
+    rolled up. Returns the months of views and the hourly rollups removed.
+    """
+    options = get_analytics_settings()
+    now = timezone.now()
+    cutoff = now - timedelta(days=options['RAW_RETENTION_DAYS'])
+    rolled_up = get_rollup_start()
+    if rolled_up is None:
+        return 0, 0
+    
+    months = drop_view_partitions(min(cutoff, rolled_up))
+    # Keep the hourly rollups of every day that may still be rebuilt
+    hourly_cutoff = min(truncate_to_day(now - timedelta(days=options['HOURLY_RETENTION_DAYS'])), truncate_to_day(rolled_up))
+    rollups = delete_in_batches(ListingViewRollup.objects.filter(period='hour', start__lt=hourly_cutoff))
+    return months, rollups
+
+
+def get_listing_analytics(listing, days=30):
+    """Get view analytics for a listing from its rollups."""
+    now = timezone.now()
+    day_cutoff = truncate_to_day(now) - timedelta(days=days - 1)
+    hour_cutoff = truncate_to_hour(now) - timedelta(hours=23)
+    
+    rollups = list(ListingViewRollup.objects.filter(
+        listing=listing,
+        period='day',
+        start__gte=day_cutoff
+    ).order_by('start').values_list('start', 'views', 'visitors', 'user_agents'))
+    hourly = ListingViewRollup.objects.filter(
+        listing=listing,
+        period='hour',
+        start__gte=hour_cutoff
+    ).order_by('start').values_list('start', 'views')
+    
+    visitors = HyperLogLog()
+    user_agents = Counter()
+    for _, _, sketch, agents in rollups:
+        visitors.merge(HyperLogLog.from_bytes(sketch))
+        user_agents.update(agents)
+    
+    return {
+        'daily_views': [{'day': start.date(), 'count': count} for start, count, _, _ in rollups],
+        'hourly_views': [{'hour': start, 'count': count} for start, count in hourly],
+        'referrer_views': [
+            {'user_agent': user_agent, 'count': count} for user_agent, count in user_agents.most_common(5)
+        ],
+        'total_views_period': sum(count for _, count, _, _ in rollups),
+        'unique_visitors': visitors.count() if rollups else 0,
+    }
@@ -3,4 +3,10 @@ from django.apps import AppConfig
 
 class ListingsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'apps.listings' 
\ No newline at end of file
+    name = 'apps.listings'
+    
+    def ready(self):
+        from marketplace.cache import warn_if_cache_not_shared
+        from . import signals  # noqa: F401
+        
+        warn_if_cache_not_shared()
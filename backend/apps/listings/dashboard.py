@@ -0,0 +1,239 @@
+"""
+Seller dashboard covering every listing of a seller at once.
+
+Per listing numbers come from a fixed number of grouped queries whatever
+the size of the catalogue: the listings themselves, their category price
+stats, their recent views from the daily rollups and their completed
+payments. Category price stats are precomputed into a shared table by
+``refresh_category_price_stats``, which listing pages read as well, and
+kept fresh in the background. Dashboards are cached per seller and
+invalidated when the seller's listings or payments change.
+"""
+
+import logging
+import threading
+from bisect import bisect_right
+from collections import Counter
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from apps.payments.models import Payment
+from marketplace.cache import get_or_compute, invalidate_tags
+from .analytics import truncate_to_day
+from .models import CategoryPriceStats, CategoryPriceStatsRefresh, Listing, ListingViewRollup
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_DAYS = 30
+SIMILAR_PRICE_RANGE = 0.3
+
+_refresh_lock = threading.Lock()
+
+
+def get_price_stats_settings():
+    options = {
+        'REFRESH_INTERVAL': 3600,
+    }
+    options.update(getattr(settings, 'LISTING_PRICE_STATS', {}))
+    return options
+
+
+def get_seller_tag(seller_id):
+    return f'seller:{seller_id}'
+
+
+def invalidate_seller_dashboard(seller_id):
+    invalidate_tags(get_seller_tag(seller_id))
+
+
+def refresh_category_price_stats(max_age=None):
+    """Recompute the price stats of every category from its active listings.
+    
+    Concurrent refreshes queue up on the marker row, and a refresh finding
+    one completed within ``max_age`` returns None instead of redoing it.
+    Returns the number of categories with stats otherwise.
+    """
+    CategoryPriceStatsRefresh.objects.bulk_create([CategoryPriceStatsRefresh(pk=1)], ignore_conflicts=True)
+    with transaction.atomic():
+        marker = CategoryPriceStatsRefresh.objects.select_for_update().get(pk=1)
+        if max_age is not None and marker.computed_at is not None and timezone.now() - marker.computed_at < max_age:
+            return None
+        
+        started = timezone.now()
+        stats = []
+        prices = Listing.objects.filter(
+            status='active',
+            is_active=True
+        ).order_by('category_id', 'price').values_list('category_id', 'price')
+        for category_id, rows in groupby(prices.iterator(chunk_size=10000), key=lambda row: row[0]):
+            category_prices = [float(price) for _, price in rows]
+            last = len(category_prices) - 1
+            stats.append(CategoryPriceStats(
+                category_id=category_id,
+                listings_count=len(category_prices),
+                avg_price=sum(category_prices) / len(category_prices),
+                price_quantiles=[category_prices[round(percent * last / 100)] for percent in range(101)]
+            ))
+        
+        CategoryPriceStats.objects.bulk_create(
+            stats,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['category'],
+            update_fields=['listings_count', 'avg_price', 'price_quantiles', 'computed_at']
+        )
+        # Categories left without active listings were not rewritten
+        CategoryPriceStats.objects.filter(computed_at__lt=started).delete()
+        marker.computed_at = timezone.now()
+        marker.categories_count = len(stats)
+        marker.save(update_fields=['computed_at', 'categories_count'])
+    invalidate_tags('category_price_stats')
+    return len(stats)
+
+
+def refresh_category_price_stats_safely(max_age):
+    """Refresh unless another thread is refreshing, logging failures instead of raising."""
+    if not _refresh_lock.acquire(blocking=False):
+        return
+    try:
+        refresh_category_price_stats(max_age=max_age)
+    except Exception:
+        logger.exception('Could not refresh category price stats')
+    finally:
+        _refresh_lock.release()
+        # Refreshes run in their own threads, which must not leak connections
+        connection.close()
+
+
+def get_category_price_stats(category_ids):
+    """Get the price stats of categories by id.
+    
+    Stats are computed on first use and recomputed in a background thread
+    once older than ``REFRESH_INTERVAL``, so only the first readers wait for
+    a scan of the listings. Readers arriving while that first scan runs wait
+    for it and reuse its result.
+    """
+    computed_at = CategoryPriceStatsRefresh.objects.values_list('computed_at', flat=True).first()
+    max_age = timedelta(seconds=get_price_stats_settings()['REFRESH_INTERVAL'])
+    if computed_at is None:
+        with _refresh_lock:
+            refresh_category_price_stats(max_age=max_age)
+    elif timezone.now() - computed_at > max_age:
+        if not _refresh_lock.locked():
+            threading.Thread(
+                target=refresh_category_price_stats_safely,
+                args=(max_age,),
+                name='category-price-stats-refresh',
+                daemon=True
+            ).start()
+    return CategoryPriceStats.objects.in_bulk(category_ids)
+
+
+def quantile_position(quantiles, price):
+    """Estimate the share of a category priced at or below a price."""
+    if price < quantiles[0]:
+        return 0.0
+    if price >= quantiles[-1]:
+        return 1.0
+    index = bisect_right(quantiles, price) - 1
+    low, high = quantiles[index], quantiles[index + 1]
+    fraction = (price - low) / (high - low) if high > low else 1.0
+    return (index + fraction) / (len(quantiles) - 1)
+
+
+def estimate_similar_count(stats, price):
+    """Estimate how many listings of a category are priced within range of a price."""
+    if stats is None or not stats.price_quantiles:
+        return 0
+    low, high = price * (1 - SIMILAR_PRICE_RANGE), price * (1 + SIMILAR_PRICE_RANGE)
+    share = quantile_position(stats.price_quantiles, high) - quantile_position(stats.price_quantiles, low)
+    return round(share * stats.listings_count)
+
+
+def estimate_price_stats(stats, price, is_live):
+    """Get the average price of a category and how many other listings of it are priced alike."""
+    if stats is None:
+        return 0, 0
+    similar_count = estimate_similar_count(stats, price)
+    # A live listing is part of its own category stats
+    if is_live and similar_count:
+        similar_count -= 1
+    return stats.avg_price, similar_count
+
+
+def compute_seller_dashboard(seller_id):
+    listings = list(Listing.objects.filter(seller_id=seller_id).order_by('-created_at').values(
+        'id', 'title', 'status', 'is_active', 'price', 'category_id', 'views_count', 'favorites_count',
+        'created_at'
+    ))
+    
+    price_stats = get_category_price_stats(
+        {listing['category_id'] for listing in listings if listing['category_id'] is not None}
+    )
+    recent_views = dict(ListingViewRollup.objects.filter(
+        listing__seller_id=seller_id,
+        period='day',
+        start__gte=truncate_to_day(timezone.now()) - timedelta(days=DASHBOARD_DAYS - 1)
+    ).values('listing_id').annotate(views=Sum('views')).order_by().values_list('listing_id', 'views'))
+    sales = {
+        listing_id: (count, revenue)
+        for listing_id, count, revenue in Payment.objects.filter(
+            seller_id=seller_id,
+            status='completed'
+        ).values('listing_id').annotate(
+            count=Count('id'),
+            revenue=Sum('amount')
+        ).order_by().values_list('listing_id', 'count', 'revenue')
+    }
+    
+    rows = []
+    for listing in listings:
+        avg_price, similar_count = estimate_price_stats(
+            price_stats.get(listing['category_id']),
+            float(listing['price']),
+            is_live=listing['status'] == 'active' and listing['is_active']
+        )
+        sales_count, revenue = sales.get(listing['id'], (0, 0))
+        rows.append({
+            'id': listing['id'],
+            'title': listing['title'],
+            'status': listing['status'],
+            'price': listing['price'],
+            'created_at': listing['created_at'],
+            'total_views': listing['views_count'],
+            'total_favorites': listing['favorites_count'],
+            'recent_views': recent_views.get(listing['id'], 0),
+            'avg_price_in_category': avg_price,
+            'similar_listings_count': similar_count,
+            'sales_count': sales_count,
+            'revenue': revenue,
+        })
+    
+    return {
+        'summary': {
+            'total_listings': len(listings),
+            'listings_by_status': dict(Counter(listing['status'] for listing in listings)),
+            'total_views': sum(row['total_views'] for row in rows),
+            'total_favorites': sum(row['total_favorites'] for row in rows),
+            'recent_views': sum(row['recent_views'] for row in rows),
+            'recent_days': DASHBOARD_DAYS,
+            'sales_count': sum(row['sales_count'] for row in rows),
+            'revenue': sum(row['revenue'] for row in rows),
+        },
+        'listings': rows,
+    }
+
+
+def get_seller_dashboard(seller_id):
+    """Get the dashboard of a seller, cached until their listings or payments change."""
+    return get_or_compute(
+        'seller_dashboard',
+        lambda: compute_seller_dashboard(seller_id),
+        tags=(get_seller_tag(seller_id), 'category_price_stats'),
+        params={'seller': seller_id}
+    )
@@ -0,0 +1,82 @@
+"""
+Favorites with an atomically maintained counter.
+
+Adding or removing a favorite applies a signed ``F()`` delta to
+``Listing.favorites_count`` in the same transaction as the insert or
+delete, so taps never count the whole favorites table and concurrent taps
+cannot overwrite each other. Drift from writes that bypass this module is
+repaired in bulk by ``reconcile_favorite_counts``.
+"""
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Listing, ListingFavorite
+
+
+def adjust_favorites_count(listing_id, delta):
+    Listing.objects.filter(id=listing_id).update(
+        favorites_count=Greatest(F('favorites_count') + delta, Value(0))
+    )
+
+
+def add_favorite(user, listing_id):
+    """Favorite a listing, returning True if it was not favorited yet."""
+    with transaction.atomic():
+        _, created = ListingFavorite.objects.get_or_create(user=user, listing_id=listing_id)
+        if created:
+            adjust_favorites_count(listing_id, 1)
+    return created
+
+
+def remove_favorite(user, listing_id):
+    """Unfavorite a listing, returning True if it was favorited."""
+    with transaction.atomic():
+        deleted, _ = ListingFavorite.objects.filter(user=user, listing_id=listing_id).delete()
+        if deleted:
+            adjust_favorites_count(listing_id, -1)
+    return bool(deleted)
+
+
+def set_favorite(user, listing_id, favorited=None):
+    """Set or, when ``favorited`` is None, toggle a favorite.
+    
+    Passing the desired state makes retries safe. Returns whether the
+    listing ends up favorited and its favorites count.
+    """
+    with transaction.atomic():
+        if favorited is None:
+            favorited = not remove_favorite(user, listing_id)
+            if favorited:
+                add_favorite(user, listing_id)
+        elif favorited:
+            add_favorite(user, listing_id)
+        else:
+            remove_favorite(user, listing_id)
+        
+        favorites_count = Listing.objects.filter(id=listing_id).values_list('favorites_count', flat=True).first()
+    return favorited, favorites_count
+
+
+def reconcile_favorite_counts(batch_size=1000, dry_run=False):
+    """Repair listings whose counter drifted from their favorites, in bulk."""
+    actual = Coalesce(
+        Subquery(
+            ListingFavorite.objects.filter(
+                listing=OuterRef('pk')
+            ).order_by().values('listing').annotate(count=Count('id')).values('count')
+        ),
+        0
+    )
+    drifted_ids = list(
+        Listing.objects.annotate(actual=actual).exclude(
+            favorites_count=F('actual')
+        ).values_list('id', flat=True)
+    )
+    if dry_run:
+        return drifted_ids
+    
+    for start in range(0, len(drifted_ids), batch_size):
+        Listing.objects.filter(id__in=drifted_ids[start:start + batch_size]).update(favorites_count=actual)
+    return drifted_ids
@@ -1,7 +1,10 @@
 import django_filters
-from django.contrib.gis.geos import Point
-from django.contrib.gis.db.models.functions import Distance
+from rest_framework.filters import OrderingFilter
+from apps.categories.index import get_category_index
+from apps.categories.models import Category
+from .geo import filter_within_radius
 from .models import Listing
+from .search import search_listings
 
 
 class ListingFilter(django_filters.FilterSet):
@@ -14,6 +17,7 @@ class ListingFilter(django_filters.FilterSet):
     # Category
     category = django_filters.NumberFilter(field_name='category__id')
     category_slug = django_filters.CharFilter(field_name='category__slug')
+    category_tree = django_filters.NumberFilter(method='category_tree_filter')
     
     # Location
     city = django_filters.CharFilter(field_name='city', lookup_expr='icontains')
@@ -51,32 +55,28 @@ class ListingFilter(django_filters.FilterSet):
         }
     
     def search_filter(self, queryset, name, value):
-        """Search in title, description, and location."""
-        return queryset.filter(
-            django_filters.Q(title__icontains=value) |
-            django_filters.Q(description__icontains=value) |
-            django_filters.Q(city__icontains=value) |
-            django_filters.Q(state__icontains=value) |
-            django_filters.Q(country__icontains=value)
-        )
+        """Full-text search in title, description, and location."""
+        return search_listings(value, queryset)
+    
+    def category_tree_filter(self, queryset, name, value):
+        """Filter by a category and all of its subcategories."""
+        category = get_category_index().get(int(value))
+        if category is None:
+            return queryset.none()
+        return queryset.filter(category__in=Category.objects.subtree(category.path))
     
     def geo_filter(self, queryset, name, value):
         """Filter by geographic location."""
-        # This method will be called for latitude, longitude, and radius
-        # We need to get all three values to perform the filter
-        latitude = self.data.get('latitude')
-        longitude = self.data.get('longitude')
-        radius = self.data.get('radius', 50)  # Default 50km
+        # Called once per geo parameter, apply the radius filter only once
+        if name != 'latitude':
+            return queryset
         
-        if latitude and longitude:
-            user_location = Point(float(longitude), float(latitude))
-            # Convert km to degrees (approximate)
-            radius_degrees = radius / 100
-            return queryset.filter(
-                location__distance_lte=(user_location, radius_degrees)
-            ).annotate(
-                distance=Distance('location', user_location)
-            ).order_by('distance')
+        latitude = self.form.cleaned_data.get('latitude')
+        longitude = self.form.cleaned_data.get('longitude')
+        radius = self.form.cleaned_data.get('radius') or 50  # Default 50km
+        
+        if latitude is not None and longitude is not None:
+            return filter_within_radius(queryset, float(latitude), float(longitude), float(radius))
         
         return queryset
 
@@ -98,11 +98,15 @@ class ListingSearchFilter(django_filters.FilterSet):
         if not value:
             return queryset
         
-        return queryset.filter(
-            django_filters.Q(title__icontains=value) |
-            django_filters.Q(description__icontains=value) |
-            django_filters.Q(category__name__icontains=value) |
-            django_filters.Q(seller__username__icontains=value) |
-            django_filters.Q(city__icontains=value) |
-            django_filters.Q(state__icontains=value)
-        ) 
\ No newline at end of file
+        return search_listings(value, queryset)
+
+
+class ListingOrderingFilter(OrderingFilter):
+    """Ordering filter that only sorts by distance once a location filter annotated it."""
+    
+    annotated_fields = {'distance'}
+    
+    def remove_invalid_fields(self, queryset, fields, view, request):
+        valid_fields = super().remove_invalid_fields(queryset, fields, view, request)
+        missing = self.annotated_fields - set(queryset.query.annotations)
+        return [term for term in valid_fields if term.lstrip('-') not in missing]
@@ -0,0 +1,151 @@
+"""
+Geospatial helpers that work on plain latitude/longitude columns.
+
+Radius queries are answered in two steps: an index-friendly prefilter on
+geohash cell ranges and a latitude/longitude bounding box, followed by an
+exact haversine distance computed in SQL.
+"""
+
+import math
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Encode coordinates as a geohash string."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    
+    while len(geohash) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    
+    return ''.join(geohash)
+
+
+def geohash_cell_size(precision):
+    """Get the (latitude, longitude) size in degrees of a geohash cell."""
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = math.floor(precision * 5 / 2)
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Get the great-circle distance between two points in kilometers."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """Get the (min_lat, max_lat, min_lon, max_lon) box around a circle.
+    
+    Longitude bounds are None when the circle covers a pole or crosses the
+    antimeridian, in which case only latitude can be bounded.
+    """
+    d_lat = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = latitude - d_lat, latitude + d_lat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), None, None
+    
+    d_lon = d_lat / math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    min_lon, max_lon = longitude - d_lon, longitude + d_lon
+    if min_lon < -180 or max_lon > 180:
+        return min_lat, max_lat, None, None
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def covering_cells(min_lat, max_lat, min_lon, max_lon):
+    """Get the geohash prefixes of the cells covering a bounding box.
+    
+    Uses the finest precision whose cells are at least as large as the box
+    so it is covered by at most 3x3 cells. Sampling the corners, edge
+    midpoints and center then hits every one of them.
+    """
+    precision = 0
+    while precision < GEOHASH_PRECISION:
+        cell_lat, cell_lon = geohash_cell_size(precision + 1)
+        if cell_lat < (max_lat - min_lat) / 2 or cell_lon < (max_lon - min_lon) / 2:
+            break
+        precision += 1
+    
+    if precision == 0:
+        return None
+    
+    mid_lat = (min_lat + max_lat) / 2
+    mid_lon = (min_lon + max_lon) / 2
+    return {
+        encode_geohash(lat, lon, precision)
+        for lat in (min_lat, mid_lat, max_lat)
+        for lon in (min_lon, mid_lon, max_lon)
+    }
+
+
+def haversine_expression(latitude, longitude):
+    """Build a database expression for the distance in km to a point."""
+    phi = Radians(F('latitude'))
+    d_phi = Radians(F('latitude') - Value(latitude))
+    d_lambda = Radians(F('longitude') - Value(longitude))
+    a = (
+        Power(Sin(d_phi / 2), 2) +
+        Value(math.cos(math.radians(latitude))) * Cos(phi) * Power(Sin(d_lambda / 2), 2)
+    )
+    return Value(2 * EARTH_RADIUS_KM) * ASin(
+        Least(Value(1.0), Sqrt(a)),
+        output_field=FloatField()
+    )
+
+
+def filter_within_radius(queryset, latitude, longitude, radius_km):
+    """Narrow a listing queryset to a radius, annotated and ordered by distance."""
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+    queryset = queryset.filter(latitude__gte=min_lat, latitude__lte=max_lat)
+    
+    if min_lon is not None:
+        queryset = queryset.filter(longitude__gte=min_lon, longitude__lte=max_lon)
+        
+        cells = covering_cells(min_lat, max_lat, min_lon, max_lon)
+        if cells:
+            # Range scans over the geohash index; '~' sorts after every geohash character
+            cell_filter = Q()
+            for cell in cells:
+                cell_filter |= Q(geohash__gte=cell, geohash__lt=cell + '~')
+            queryset = queryset.filter(cell_filter)
+    
+    return queryset.annotate(
+        distance=haversine_expression(latitude, longitude)
+    ).filter(distance__lte=radius_km).order_by('distance')
@@ -0,0 +1,39 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.listings.recommendations import (
+    build_recommendations, get_active_user_ids, refresh_user_recommendations
+)
+
+
+class Command(BaseCommand):
+    help = 'Precompute listing recommendations from favorites and views.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--active-since',
+            type=int,
+            metavar='MINUTES',
+            help='Only refresh users who interacted in the last MINUTES, using the stored neighbours'
+        )
+        parser.add_argument('--processes', type=int, help='Worker processes for the full build, defaults to every core')
+    
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        
+        if options['active_since']:
+            since = timezone.now() - timedelta(minutes=options['active_since'])
+            users = refresh_user_recommendations(get_active_user_ids(since))
+            self.stdout.write(self.style.SUCCESS(
+                f'Refreshed {users} active users in {time.perf_counter() - started:.1f}s'
+            ))
+            return
+        
+        listings, users = build_recommendations(processes=options['processes'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored neighbours of {listings} listings and recommendations for {users} users '
+            f'in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.listings.similarity import build_similarity_index, get_similarity_settings
+
+
+class Command(BaseCommand):
+    help = 'Build the similar listings index and write it to the snapshot path.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Snapshot file, defaults to LISTING_SIMILARITY["SNAPSHOT_PATH"]')
+    
+    def handle(self, *args, **options):
+        path = options['output'] or get_similarity_settings().get('SNAPSHOT_PATH')
+        if not path:
+            raise CommandError('No snapshot path configured, pass --output')
+        
+        started = time.perf_counter()
+        index = build_similarity_index()
+        index.save(path)
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {len(index)} listings into {path} in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from marketplace.cache import get_cache_metrics, reset_cache_metrics
+
+
+class Command(BaseCommand):
+    help = 'Report hit and miss counts of the API response caches.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after reporting')
+    
+    def handle(self, *args, **options):
+        for name, counts in get_cache_metrics().items():
+            total = counts['hits'] + counts['misses']
+            ratio = counts['hits'] / total * 100 if total else 0
+            self.stdout.write(
+                f"{name}: {counts['hits']} hits, {counts['misses']} misses ({ratio:.1f}% hit rate)"
+            )
+        
+        if options['reset']:
+            reset_cache_metrics()
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
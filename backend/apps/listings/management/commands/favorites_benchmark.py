@@ -0,0 +1,107 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+
+from apps.categories.models import Category
+from apps.listings.favorites import set_favorite
+from apps.listings.models import Listing, ListingFavorite
+from apps.users.models import User
+from marketplace.benchmarks import scratch_database
+
+
+def legacy_toggle(user, listing):
+    """The previous toggle: recount every favorite and save the listing."""
+    favorite, created = ListingFavorite.objects.get_or_create(user=user, listing=listing)
+    if not created:
+        favorite.delete()
+    listing.favorites_count = listing.favorited_by.count()
+    listing.save(update_fields=['favorites_count'])
+
+
+class Command(BaseCommand):
+    help = 'Measure favorite toggles on a popular listing and stress concurrent toggles, on a scratch database.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--favorites', type=int, default=100000, help='Existing favorites on the listing')
+        parser.add_argument('--toggles', type=int, default=500, help='Toggles timed per approach')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent togglers in the stress run')
+        parser.add_argument('--rounds', type=int, default=50, help='Toggles per thread in the stress run')
+    
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.run(options)
+    
+    def run(self, options):
+        users = User.objects.bulk_create(
+            [
+                User(username=f'favbench-{number}', email=f'favbench-{number}@example.com')
+                for number in range(options['favorites'] + options['threads'] + 1)
+            ],
+            batch_size=5000
+        )
+        if users[0].pk is None:
+            users = list(User.objects.filter(username__startswith='favbench-').order_by('id'))
+        seller, togglers, fans = users[0], users[1:options['threads'] + 1], users[options['threads'] + 1:]
+        
+        category = Category.objects.create(name='favbench', slug='favbench')
+        listing = Listing.objects.create(
+            title='favbench',
+            description='favbench',
+            price=10,
+            category=category,
+            seller=seller,
+            status='active'
+        )
+        ListingFavorite.objects.bulk_create(
+            [ListingFavorite(user=user, listing=listing) for user in fans],
+            batch_size=5000
+        )
+        Listing.objects.filter(id=listing.id).update(favorites_count=len(fans))
+        self.stdout.write(f'Listing {listing.id} has {len(fans)} favorites')
+        
+        self.benchmark('count and save', lambda user: legacy_toggle(user, listing), togglers[0], options['toggles'])
+        self.benchmark('F() delta', lambda user: set_favorite(user, listing.id), togglers[0], options['toggles'])
+        self.stress(listing, togglers, options['rounds'])
+    
+    def benchmark(self, label, toggle, user, toggles):
+        started = time.perf_counter()
+        for _ in range(toggles):
+            toggle(user)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{label}: {toggles / elapsed:.1f} toggles/s')
+    
+    def stress(self, listing, togglers, rounds):
+        errors = []
+        
+        def run(user):
+            try:
+                for _ in range(rounds):
+                    try:
+                        set_favorite(user, listing.id)
+                    except DatabaseError as exc:
+                        errors.append(exc)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=run, args=(user,)) for user in togglers]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        
+        listing.refresh_from_db(fields=['favorites_count'])
+        actual = ListingFavorite.objects.filter(listing=listing).count()
+        self.stdout.write(
+            f'{len(togglers)} threads x {rounds} toggles in {elapsed:.1f}s, '
+            f'{len(errors)} failed with database errors'
+        )
+        if listing.favorites_count == actual:
+            self.stdout.write(self.style.SUCCESS(f'favorites_count {actual} matches the favorites'))
+        else:
+            self.stdout.write(self.style.ERROR(
+                f'favorites_count {listing.favorites_count} drifted from {actual} favorites'
+            ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from apps.listings.view_buffer import get_view_buffer
+
+
+class Command(BaseCommand):
+    help = 'Flush buffered listing views to the database.'
+    
+    def handle(self, *args, **options):
+        buffer = get_view_buffer()
+        if not buffer.shared:
+            # A fresh local buffer is always empty; server processes flush their own on a timer
+            self.stdout.write(self.style.WARNING(
+                f'{type(buffer).__name__} lives inside each server process and flushes itself, '
+                f'nothing to drain from here'
+            ))
+            return
+        
+        total = 0
+        
+        # Keep draining until the shared buffer is empty
+        while True:
+            flushed = buffer.flush()
+            total += flushed
+            if not flushed:
+                break
+        
+        self.stdout.write(self.style.SUCCESS(f'Flushed {total} listing views'))
@@ -0,0 +1,89 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.categories.models import Category
+from apps.listings.geo import encode_geohash, filter_within_radius, haversine_expression
+from apps.listings.models import Listing
+from apps.users.models import User
+from marketplace.benchmarks import scratch_database
+
+# Listings cluster around metro areas, as they do in production
+CITIES = [
+    (40.7128, -74.0060), (34.0522, -118.2437), (41.8781, -87.6298), (29.7604, -95.3698),
+    (33.4484, -112.0740), (39.7392, -104.9903), (47.6062, -122.3321), (25.7617, -80.1918),
+]
+
+
+def full_scan(queryset, latitude, longitude, radius_km):
+    """Exact distance over every row, without the cell and bounding box prefilter."""
+    return queryset.annotate(
+        distance=haversine_expression(latitude, longitude)
+    ).filter(distance__lte=radius_km).order_by('distance')
+
+
+class Command(BaseCommand):
+    help = 'Measure radius query latency with and without the geohash prefilter, on a scratch database.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=1000000, help='Synthetic listings to place')
+        parser.add_argument('--queries', type=int, default=20, help='Query points per radius')
+        parser.add_argument('--seed', type=int, default=42)
+    
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.run(random.Random(options['seed']), options)
+    
+    def run(self, rng, options):
+        seller = User.objects.create(username='geobench', email='geobench@example.com')
+        category = Category.objects.create(name='geobench', slug='geobench')
+        
+        started = time.perf_counter()
+        batch = []
+        for _ in range(options['listings']):
+            city_latitude, city_longitude = rng.choice(CITIES)
+            latitude = city_latitude + rng.gauss(0, 0.5)
+            longitude = city_longitude + rng.gauss(0, 0.5)
+            # bulk_create skips Listing.save, so the cell is filled in here
+            batch.append(Listing(
+                title='geobench',
+                description='geobench',
+                price=10,
+                category=category,
+                seller=seller,
+                status='active',
+                latitude=latitude,
+                longitude=longitude,
+                geohash=encode_geohash(latitude, longitude)
+            ))
+            if len(batch) == 10000:
+                Listing.objects.bulk_create(batch)
+                batch = []
+        Listing.objects.bulk_create(batch)
+        self.stdout.write(f'Placed {options["listings"]} listings in {time.perf_counter() - started:.1f}s')
+        
+        # Without statistics SQLite prefers the status index to the coordinate ones
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        
+        queryset = Listing.objects.filter(status='active', is_active=True)
+        points = [
+            (latitude + rng.gauss(0, 0.3), longitude + rng.gauss(0, 0.3))
+            for latitude, longitude in rng.choices(CITIES, k=options['queries'])
+        ]
+        for radius in (1, 10, 50):
+            for label, radius_filter in (('full scan', full_scan), ('prefiltered', filter_within_radius)):
+                timings, matches = [], []
+                for latitude, longitude in points:
+                    started = time.perf_counter()
+                    ids = list(radius_filter(queryset, latitude, longitude, radius).values_list('id', flat=True)[:20])
+                    timings.append((time.perf_counter() - started) * 1000)
+                    matches.append(len(ids))
+                self.stdout.write(
+                    f'{radius} km {label}: median {statistics.median(timings):.1f}ms, '
+                    f'p95 {sorted(timings)[int(len(timings) * 0.95)]:.1f}ms, '
+                    f'{statistics.mean(matches):.1f} results on the first page'
+                )
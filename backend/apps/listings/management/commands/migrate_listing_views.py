@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from apps.listings.models import LegacyListingView
+from apps.listings.view_store import move_legacy_views
+
+
+class Command(BaseCommand):
+    help = 'Move legacy listing view logs into the partitioned event store.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows moved per transaction')
+    
+    def handle(self, *args, **options):
+        remaining = LegacyListingView.objects.count()
+        self.stdout.write(f'{remaining} legacy views to move')
+        
+        moved = 0
+        while True:
+            count = move_legacy_views(batch_size=options['batch_size'])
+            if not count:
+                break
+            moved += count
+            self.stdout.write(f'Moved {moved}/{remaining}')
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {moved} views; run rollup_listing_views --backfill-days to rebuild their rollups'
+        ))
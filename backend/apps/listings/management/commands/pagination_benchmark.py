@@ -0,0 +1,92 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIRequestFactory
+
+from apps.categories.models import Category
+from apps.listings.models import Listing
+from apps.listings.views import ListingListView
+from apps.users.models import User
+from marketplace.benchmarks import scratch_database
+from marketplace.pagination import KeysetPagination
+
+
+class OffsetListingListView(ListingListView):
+    """The previous listing list: page numbers, an OFFSET scan and a COUNT(*) per page."""
+    
+    pagination_class = PageNumberPagination
+
+
+class Command(BaseCommand):
+    help = 'Measure deep page latency of offset and keyset pagination on the listing list, on a scratch database.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=100000, help='Synthetic active listings')
+        parser.add_argument('--page', type=int, default=1000, help='Page number to fetch')
+        parser.add_argument('--repeat', type=int, default=10, help='Timed requests per approach')
+        parser.add_argument('--seed', type=int, default=42)
+    
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.run(random.Random(options['seed']), options)
+    
+    def run(self, rng, options):
+        seller = User.objects.create(username='pagebench', email='pagebench@example.com')
+        category = Category.objects.create(name='pagebench', slug='pagebench')
+        
+        started = time.perf_counter()
+        now = timezone.now()
+        for offset in range(0, options['listings'], 10000):
+            batch = Listing.objects.bulk_create([
+                Listing(
+                    title='pagebench',
+                    description='pagebench',
+                    price=rng.randint(1, 2000),
+                    category=category,
+                    seller=seller,
+                    status='active'
+                )
+                for _ in range(min(10000, options['listings'] - offset))
+            ])
+            # created_at is auto_now_add, so spread it out afterwards
+            for listing in batch:
+                listing.created_at = now - timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+            Listing.objects.bulk_update(batch, ['created_at'], batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.stdout.write(f'Created {options["listings"]} listings in {time.perf_counter() - started:.1f}s')
+        
+        factory = APIRequestFactory()
+        page_size = PageNumberPagination.page_size or KeysetPagination.page_size
+        for ordering in ('-created_at', 'price'):
+            # The cursor a client holds after reading page - 1 pages
+            paginator = KeysetPagination()
+            queryset = ListingListView().get_queryset().order_by(ordering)
+            paginator.ordering = paginator.get_ordering(queryset)
+            paginator.nullable_fields = paginator.get_nullable_fields(queryset, paginator.ordering)
+            last_seen = queryset.order_by(*paginator.ordering)[(options['page'] - 1) * page_size - 1]
+            cursor = paginator.encode_cursor(last_seen, reverse=False)
+            
+            for label, view, params in (
+                ('offset', OffsetListingListView.as_view(), {'page': options['page']}),
+                ('keyset', ListingListView.as_view(), {'cursor': cursor}),
+            ):
+                timings = []
+                for _ in range(options['repeat']):
+                    request = factory.get('/api/listings/', {'ordering': ordering, **params})
+                    started = time.perf_counter()
+                    response = view(request)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    assert response.status_code == 200, response.status_code
+                
+                self.stdout.write(
+                    f'ordering={ordering} page {options["page"]} {label}: '
+                    f'median {statistics.median(timings):.1f}ms, max {max(timings):.1f}ms, '
+                    f'{len(response.data["results"])} rows'
+                )
@@ -0,0 +1,36 @@
+from concurrent.futures import wait
+
+from django.core.management.base import BaseCommand
+
+from apps.chat.models import Message
+from apps.listings.models import ListingImage
+from marketplace.images import get_executors, run_process_image
+
+# model, image field, variants field, blurhash field
+IMAGE_FIELDS = [
+    (ListingImage, 'image', 'variants', 'blurhash'),
+    (Message, 'image', 'image_variants', 'image_blurhash'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Generate variants and placeholders for uploaded images that were never processed.'
+    
+    def handle(self, *args, **options):
+        dispatcher = get_executors()[1]
+        for model, field_name, variants_field, blurhash_field in IMAGE_FIELDS:
+            pending = [
+                pk for pk, name, variants in model.objects.exclude(**{field_name: ''}).exclude(
+                    **{f'{field_name}__isnull': True}
+                ).values_list('pk', field_name, variants_field).iterator()
+                if (variants or {}).get('source') != name
+            ]
+            futures = [
+                dispatcher.submit(run_process_image, model._meta.label, pk, field_name, variants_field, blurhash_field)
+                for pk in pending
+            ]
+            wait(futures)
+            processed = sum(1 for future in futures if future.result())
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.label}: processed {processed} of {len(pending)} images'
+            ))
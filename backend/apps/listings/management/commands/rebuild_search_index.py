@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from apps.listings.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for listings.'
+    
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.create_index()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt listing search index ({backend.__class__.__name__})'
+        ))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from apps.listings.trending import rebuild_activity_buckets, rebuild_trending_board
+
+
+class Command(BaseCommand):
+    help = 'Recompute trending scores from the hourly activity buckets.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--from-logs',
+            action='store_true',
+            help='Rebuild the activity buckets from view logs and favorites first'
+        )
+    
+    def handle(self, *args, **options):
+        if options['from_logs']:
+            buckets = rebuild_activity_buckets()
+            self.stdout.write(f'Rebuilt {buckets} activity buckets')
+        
+        listings = rebuild_trending_board()
+        self.stdout.write(self.style.SUCCESS(f'Ranked {listings} trending listings'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from apps.listings.favorites import reconcile_favorite_counts
+
+
+class Command(BaseCommand):
+    help = 'Repair listings whose favorites_count drifted from their favorites.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Listings updated per statement')
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted listings')
+    
+    def handle(self, *args, **options):
+        drifted_ids = reconcile_favorite_counts(
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run']
+        )
+        if options['dry_run']:
+            self.stdout.write(f'{len(drifted_ids)} listings have a drifted favorites count')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Repaired {len(drifted_ids)} favorites counts'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.listings.dashboard import refresh_category_price_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the shared category price stats used by listing pages and seller dashboards.'
+    
+    def handle(self, *args, **options):
+        categories = refresh_category_price_stats()
+        self.stdout.write(self.style.SUCCESS(f'Computed price stats of {categories} categories'))
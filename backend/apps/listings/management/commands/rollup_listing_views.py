@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.listings.analytics import purge_view_logs, rollup_views
+from apps.listings.view_store import ensure_view_partitions, month_start, next_month
+
+
+class Command(BaseCommand):
+    help = 'Compact raw listing views into hourly and daily analytics rollups.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backfill-days',
+            type=int,
+            help='Roll up the last N days instead of continuing from the last run'
+        )
+        parser.add_argument(
+            '--purge',
+            action='store_true',
+            help='Delete raw views and hourly rollups past their retention afterwards'
+        )
+    
+    def handle(self, *args, **options):
+        since = None
+        if options['backfill_days'] is not None:
+            since = timezone.now() - timedelta(days=options['backfill_days'])
+        
+        # Writers never create partitions, so this month and the next are made ahead of them
+        ensure_view_partitions([timezone.now(), next_month(month_start(timezone.now()))])
+        hours, days = rollup_views(since=since)
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {hours} hours over {days} days'))
+        
+        if options['purge']:
+            months, rollups = purge_view_logs()
+            self.stdout.write(f'Dropped {months} months of raw views and {rollups} hourly rollups')
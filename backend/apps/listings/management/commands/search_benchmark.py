@@ -0,0 +1,92 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from apps.categories.models import Category
+from apps.listings.models import Listing
+from apps.listings.search import get_search_backend
+from apps.users.models import User
+from marketplace.benchmarks import scratch_database
+
+WORDS = (
+    'vintage leather sofa oak table iphone samsung galaxy bike road mountain kids '
+    'toy lego camera lens nikon canon jacket winter boots running shoes desk lamp '
+    'guitar acoustic electric piano keyboard monitor gaming laptop dell macbook '
+    'stroller crib dresser mirror rug garden tools drill saw tent kayak skis'
+).split()
+CITIES = ['Austin', 'Boston', 'Chicago', 'Denver', 'Portland', 'Seattle']
+QUERIES = ['desk', 'oak table', 'gaming laptop', 'leather sofa vintage', 'canon', 'seattle bike']
+
+
+def legacy_filter(queryset, query):
+    """The previous search: one icontains OR across columns, on the whole query."""
+    return queryset.filter(
+        Q(title__icontains=query) |
+        Q(description__icontains=query) |
+        Q(city__icontains=query) |
+        Q(state__icontains=query)
+    ).order_by('-created_at')
+
+
+class Command(BaseCommand):
+    help = 'Compare listing search latency of icontains filters and the full-text index, on a scratch database.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=1000000, help='Synthetic listings to index')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per query')
+        parser.add_argument('--seed', type=int, default=42)
+    
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.run(random.Random(options['seed']), options)
+    
+    def run(self, rng, options):
+        seller = User.objects.create(username='searchbench', email='searchbench@example.com')
+        categories = [Category.objects.create(name=f'Bench {word}', slug=f'bench-{word}') for word in WORDS[:10]]
+        # A long tail of filler words keeps each product word in a realistic share of listings
+        syllables = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pa', 'do', 'fi']
+        filler = [''.join(rng.choices(syllables, k=rng.randint(2, 4))) for _ in range(5000)]
+        
+        started = time.perf_counter()
+        batch = []
+        for number in range(options['listings']):
+            batch.append(Listing(
+                title=' '.join(rng.choices(WORDS, k=2) + rng.choices(filler, k=rng.randint(1, 3))),
+                description=' '.join(rng.choices(WORDS, k=2) + rng.choices(filler, k=rng.randint(10, 40))),
+                price=rng.randint(1, 2000),
+                category=rng.choice(categories),
+                seller=seller,
+                city=rng.choice(CITIES),
+                status='active'
+            ))
+            if len(batch) == 10000:
+                Listing.objects.bulk_create(batch)
+                batch = []
+        Listing.objects.bulk_create(batch)
+        self.stdout.write(f'Created {options["listings"]} listings in {time.perf_counter() - started:.1f}s')
+        
+        backend = get_search_backend()
+        started = time.perf_counter()
+        backend.create_index()
+        backend.rebuild()
+        self.stdout.write(f'Indexed them with {type(backend).__name__} in {time.perf_counter() - started:.1f}s')
+        
+        queryset = Listing.objects.filter(status='active', is_active=True)
+        for query in QUERIES:
+            legacy = self.measure(lambda: list(legacy_filter(queryset, query).values_list('id', flat=True)[:20]), options['repeat'])
+            indexed = self.measure(
+                lambda: list(backend.filter(queryset, query).order_by('-search_rank', '-created_at').values_list('id', flat=True)[:20]),
+                options['repeat']
+            )
+            self.stdout.write(f'{query!r}: icontains {legacy:.1f}ms, full-text {indexed:.1f}ms (median of first page)')
+    
+    def measure(self, query, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            query()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,70 @@
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from apps.listings.geo import encode_geohash
+from apps.listings.similarity import CONDITIONS, SimilarityIndex
+
+WORDS = (
+    'vintage leather sofa oak table iphone samsung galaxy bike road mountain kids '
+    'toy lego camera lens nikon canon jacket winter boots running shoes desk lamp '
+    'guitar acoustic electric piano keyboard monitor gaming laptop dell macbook '
+    'stroller crib dresser mirror rug garden tools drill saw tent kayak skis'
+).split()
+
+
+class Command(BaseCommand):
+    help = 'Measure similar listings query throughput on a synthetic in-memory index.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=500000, help='Synthetic listings to index')
+        parser.add_argument('--queries', type=int, default=1000, help='Listings to find neighbours for')
+        parser.add_argument('--batch', type=int, default=64, help='Queries answered per batch')
+        parser.add_argument('--k', type=int, default=10, help='Neighbours per query')
+        parser.add_argument('--seed', type=int, default=42)
+    
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        count = options['listings']
+        
+        # Three level category tree: 10 roots, 10 children each, 10 leaves each
+        leaves = [
+            (root * 100 + child * 10 + leaf, f'/{root}/{root * 10 + child}/{root * 100 + child * 10 + leaf}/')
+            for root in range(1, 11) for child in range(10) for leaf in range(10)
+        ]
+        rows = []
+        for listing_id in range(1, count + 1):
+            category_id, path = rng.choice(leaves)
+            rows.append((
+                listing_id,
+                ' '.join(rng.choices(WORDS, k=rng.randint(2, 6))),
+                round(rng.lognormvariate(4, 1.5), 2),
+                rng.choice(CONDITIONS),
+                category_id,
+                path,
+                encode_geohash(rng.uniform(25, 49), rng.uniform(-124, -67)),
+            ))
+        
+        started = time.perf_counter()
+        index = SimilarityIndex.from_rows(rows)
+        build_time = time.perf_counter() - started
+        self.stdout.write(
+            f'Built index of {len(index)} listings in {build_time:.1f}s '
+            f'({index.vectors.nbytes / 2 ** 20:.0f} MiB of vectors)'
+        )
+        
+        query_ids = rng.sample(range(1, count + 1), min(options['queries'], count))
+        for batch_size in sorted({1, options['batch']}):
+            latencies = []
+            started = time.perf_counter()
+            for start in range(0, len(query_ids), batch_size):
+                batch_started = time.perf_counter()
+                index.neighbours(query_ids[start:start + batch_size], k=options['k'])
+                latencies.append(time.perf_counter() - batch_started)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'batch {batch_size}: {len(query_ids) / elapsed:.1f} queries/s, '
+                f'p50 batch latency {np.percentile(latencies, 50) * 1000:.1f}ms'
+            )
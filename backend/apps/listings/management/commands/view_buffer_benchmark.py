@@ -0,0 +1,88 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from rest_framework import generics
+from rest_framework.test import APIRequestFactory
+
+from apps.categories.models import Category
+from apps.listings.models import LegacyListingView, Listing, ListingView
+from apps.listings.view_buffer import flush_views, get_view_buffer
+from apps.listings.views import ListingDetailView
+from apps.users.models import User
+from marketplace.benchmarks import scratch_database
+
+
+class LegacyListingDetailView(ListingDetailView):
+    """The previous detail view: a read-modify-write save and a log insert per hit."""
+    
+    def retrieve(self, request, *args, **kwargs):
+        listing = self.get_object()
+        listing.views_count += 1
+        listing.save(update_fields=['views_count'])
+        LegacyListingView.objects.create(
+            listing=listing,
+            user=request.user if request.user.is_authenticated else None,
+            ip_address=self.get_client_ip(request),
+            user_agent=request.META.get('HTTP_USER_AGENT', '')
+        )
+        return generics.RetrieveAPIView.retrieve(self, request, *args, **kwargs)
+
+
+class Command(BaseCommand):
+    help = 'Measure listing detail throughput with per-hit writes and with the view buffer, on a scratch database.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=200)
+        parser.add_argument('--requests', type=int, default=5000, help='Detail hits timed per approach')
+        parser.add_argument('--seed', type=int, default=42)
+    
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.run(random.Random(options['seed']), options)
+    
+    def run(self, rng, options):
+        seller = User.objects.create(username='viewbench', email='viewbench@example.com')
+        category = Category.objects.create(name='viewbench', slug='viewbench')
+        Listing.objects.bulk_create([
+            Listing(title='viewbench', description='viewbench', price=10, category=category, seller=seller, status='active')
+            for _ in range(options['listings'])
+        ])
+        listing_ids = list(Listing.objects.values_list('id', flat=True))
+        
+        factory = APIRequestFactory()
+        hits = [rng.choice(listing_ids) for _ in range(options['requests'])]
+        
+        for label, view in (
+            ('per-hit writes', LegacyListingDetailView.as_view()),
+            ('view buffer', ListingDetailView.as_view()),
+        ):
+            Listing.objects.update(views_count=0)
+            started = time.perf_counter()
+            for listing_id in hits:
+                request = factory.get(
+                    f'/api/listings/{listing_id}/',
+                    REMOTE_ADDR=f'10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}',
+                    HTTP_USER_AGENT='Mozilla/5.0 (viewbench)'
+                )
+                response = view(request, listing_id=listing_id)
+                assert response.status_code == 200, response.status_code
+            elapsed = time.perf_counter() - started
+            
+            # Wait for background flushes, then write whatever is still buffered
+            while get_view_buffer().flush_lock.locked():
+                time.sleep(0.01)
+            flush_started = time.perf_counter()
+            flush_views()
+            flush_time = time.perf_counter() - flush_started
+            
+            counted = Listing.objects.aggregate(total=Sum('views_count'))['total']
+            self.stdout.write(
+                f'{label}: {len(hits) / elapsed:.0f} requests/s, final flush {flush_time * 1000:.0f}ms, '
+                f'{counted} of {len(hits)} views counted'
+            )
+        
+        self.stdout.write(
+            f'{LegacyListingView.objects.count()} legacy view rows, {ListingView.objects.count()} buffered view rows'
+        )
@@ -0,0 +1,124 @@
+import random
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from apps.categories.models import Category
+from apps.listings.models import LegacyListingView, Listing, ListingView
+from apps.listings.view_store import encode_ip, ensure_view_partitions, get_table_size, intern_user_agents
+from apps.users.models import User
+
+BROWSERS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{0}.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/{0}.1 Safari/605.1.15',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_{0} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148',
+    'Mozilla/5.0 (Linux; Android 14; SM-S91{0}B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Mobile Safari/537.36',
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare storage and query latency of legacy view logs and the compact event store.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=200000, help='Synthetic views written to each store')
+        parser.add_argument('--listings', type=int, default=1000)
+        parser.add_argument('--days', type=int, default=60, help='Days the views are spread over')
+        parser.add_argument('--seed', type=int, default=42)
+    
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # Everything is written in one transaction and rolled back at the end
+        with transaction.atomic():
+            self.run(rng, options)
+            transaction.set_rollback(True)
+    
+    def run(self, rng, options):
+        prefix = f'viewbench-{uuid.uuid4().hex[:8]}'
+        seller = User.objects.create(username=prefix, email=f'{prefix}@example.com')
+        category = Category.objects.create(name=prefix, slug=prefix)
+        listings = Listing.objects.bulk_create([
+            Listing(title=prefix, description=prefix, price=10, category=category, seller=seller, status='active')
+            for _ in range(options['listings'])
+        ])
+        listing_ids = [listing.id for listing in listings]
+        if listing_ids[0] is None:
+            listing_ids = list(Listing.objects.filter(seller=seller).values_list('id', flat=True))
+        
+        user_agents = [template.format(version) for template in BROWSERS for version in range(100, 150)]
+        addresses = [f'{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}' for _ in range(20000)]
+        now = timezone.now()
+        events = [
+            (
+                rng.choice(listing_ids),
+                rng.choice(addresses),
+                rng.choice(user_agents),
+                now - timedelta(seconds=rng.randint(0, options['days'] * 86400))
+            )
+            for _ in range(options['events'])
+        ]
+        
+        started = time.perf_counter()
+        LegacyListingView.objects.bulk_create(
+            [
+                LegacyListingView(listing_id=listing_id, ip_address=address, user_agent=user_agent, viewed_at=viewed_at)
+                for listing_id, address, user_agent, viewed_at in events
+            ],
+            batch_size=5000
+        )
+        legacy_write = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        user_agent_ids = intern_user_agents(event[2] for event in events)
+        ensure_view_partitions(event[3] for event in events)
+        ListingView.objects.bulk_create(
+            [
+                ListingView(listing_id=listing_id, ip=encode_ip(address), user_agent_id=user_agent_ids[user_agent], viewed_at=viewed_at)
+                for listing_id, address, user_agent, viewed_at in events
+            ],
+            batch_size=5000
+        )
+        compact_write = time.perf_counter() - started
+        
+        legacy_size = get_table_size(LegacyListingView._meta.db_table)
+        compact_size = get_table_size(ListingView._meta.db_table)
+        if legacy_size is not None:
+            compact_size += get_table_size('user_agents')
+            self.stdout.write(
+                f'storage: legacy {legacy_size / len(events):.0f} B/view, '
+                f'compact {compact_size / len(events):.0f} B/view including interned user agents'
+            )
+        self.stdout.write(f'write: legacy {legacy_write:.2f}s, compact {compact_write:.2f}s')
+        
+        hour = now.replace(minute=0, second=0, microsecond=0) - timedelta(days=options['days'] // 2)
+        listing_id = listing_ids[0]
+        cutoff = now - timedelta(days=30)
+        for label, model, columns in (
+            ('legacy', LegacyListingView, ('listing_id', 'user_id', 'ip_address', 'user_agent')),
+            ('compact', ListingView, ('listing_id', 'user_id', 'ip', 'user_agent_id')),
+        ):
+            hour_scan = self.measure(lambda: list(model.objects.filter(
+                viewed_at__gte=hour,
+                viewed_at__lt=hour + timedelta(hours=1)
+            ).order_by().values_list(*columns)))
+            listing_days = self.measure(lambda: list(model.objects.filter(
+                listing_id=listing_id,
+                viewed_at__gte=cutoff
+            ).order_by().values('viewed_at__date').annotate(count=Count('id'))))
+            self.stdout.write(
+                f'{label}: one hour scan {hour_scan:.1f}ms, '
+                f'one listing daily counts over 30 days {listing_days:.1f}ms'
+            )
+    
+    def measure(self, query, repeat=20):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            query()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='listingview',
+            name='viewed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
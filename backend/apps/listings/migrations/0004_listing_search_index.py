@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from apps.listings.search import get_search_backend
+    backend = get_search_backend(schema_editor.connection)
+    backend.create_index()
+    backend.rebuild()
+
+
+def drop_search_index(apps, schema_editor):
+    from apps.listings.search import get_search_backend
+    get_search_backend(schema_editor.connection).drop_index()
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('listings', '0003_listingview_viewed_at_default'),
+        ('categories', '0003_category_listing_counters'),
+    ]
+    
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
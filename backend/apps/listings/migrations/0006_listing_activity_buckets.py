@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('listings', '0005_listing_coordinates'),
+    ]
+    
+    operations = [
+        migrations.CreateModel(
+            name='ListingActivityBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('favorites', models.PositiveIntegerField(default=0)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_buckets', to='listings.listing')),
+            ],
+            options={
+                'db_table': 'listing_activity_buckets',
+                'indexes': [models.Index(fields=['hour'], name='listing_act_hour_04f7c1_idx')],
+                'unique_together': {('listing', 'hour')},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('listings', '0006_listing_activity_buckets'),
+    ]
+    
+    operations = [
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['updated_at'], name='listings_updated_baabdf_idx'),
+        ),
+    ]
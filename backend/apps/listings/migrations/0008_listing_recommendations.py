@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:29
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('users', '0001_initial'),
+        ('listings', '0007_listing_updated_at_index'),
+    ]
+    
+    operations = [
+        migrations.CreateModel(
+            name='ListingCooccurrence',
+            fields=[
+                ('listing', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='cooccurrence', serialize=False, to='listings.listing')),
+                ('neighbors', models.JSONField(default=list)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'listing_cooccurrences',
+            },
+        ),
+        migrations.CreateModel(
+            name='UserRecommendation',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing_recommendations', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('listing_ids', models.JSONField(default=list)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'user_recommendations',
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0008_listing_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingViewRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('visitors', models.BinaryField(default=bytes)),
+                ('user_agents', models.JSONField(default=dict)),
+            ],
+            options={
+                'db_table': 'listing_view_rollups',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='listingview',
+            index=models.Index(fields=['viewed_at'], name='listing_vie_viewed__b5db38_idx'),
+        ),
+        migrations.AddField(
+            model_name='listingviewrollup',
+            name='listing',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_rollups', to='listings.listing'),
+        ),
+        migrations.AddIndex(
+            model_name='listingviewrollup',
+            index=models.Index(fields=['period', 'start'], name='listing_vie_period_41e515_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='listingviewrollup',
+            unique_together={('listing', 'period', 'start')},
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('categories', '0003_category_listing_counters'),
+        ('listings', '0009_listing_view_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryPriceStats',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='price_stats', serialize=False, to='categories.category')),
+                ('listings_count', models.PositiveIntegerField(default=0)),
+                ('avg_price', models.FloatField(default=0)),
+                ('price_quantiles', models.JSONField(default=list)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'category_price_stats',
+            },
+        ),
+    ]
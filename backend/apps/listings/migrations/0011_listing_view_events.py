@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+PARTITIONED_TABLE_SQL = [
+    """
+    CREATE TABLE listing_view_events (
+        id bigint GENERATED BY DEFAULT AS IDENTITY,
+        listing_id bigint NOT NULL,
+        user_id bigint NULL,
+        ip bigint NULL,
+        user_agent_id bigint NULL,
+        viewed_at timestamp with time zone NOT NULL,
+        PRIMARY KEY (id, viewed_at)
+    ) PARTITION BY RANGE (viewed_at)
+    """,
+    'CREATE TABLE listing_view_events_default PARTITION OF listing_view_events DEFAULT',
+    'CREATE INDEX view_events_listing_idx ON listing_view_events (listing_id, viewed_at)',
+    'CREATE INDEX view_events_user_idx ON listing_view_events (user_id, viewed_at)',
+    'CREATE INDEX view_events_viewed_at_idx ON listing_view_events (viewed_at)',
+]
+
+
+def create_view_events_table(apps, schema_editor):
+    # Partitioned tables need the partition key in the primary key, which
+    # Django cannot express, so PostgreSQL gets hand written DDL
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.create_model(apps.get_model('listings', 'ListingView'))
+        return
+    for statement in PARTITIONED_TABLE_SQL:
+        schema_editor.execute(statement)
+
+
+def drop_view_events_table(apps, schema_editor):
+    schema_editor.delete_model(apps.get_model('listings', 'ListingView'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('listings', '0010_category_price_stats'),
+    ]
+
+    operations = [
+        # The existing table stays in place until migrate_listing_views moves its rows
+        migrations.RenameModel(
+            old_name='ListingView',
+            new_name='LegacyListingView',
+        ),
+        migrations.AlterModelOptions(
+            name='legacylistingview',
+            options={},
+        ),
+        migrations.AlterField(
+            model_name='legacylistingview',
+            name='listing',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='legacy_view_logs', to='listings.listing'),
+        ),
+        migrations.AlterField(
+            model_name='legacylistingview',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='legacy_viewed_listings', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=32, unique=True)),
+                ('value', models.TextField()),
+            ],
+            options={
+                'db_table': 'user_agents',
+            },
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ListingView',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('ip', models.BigIntegerField(blank=True, null=True)),
+                        ('viewed_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                        ('listing', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='view_logs', to='listings.listing')),
+                        ('user', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='viewed_listings', to=settings.AUTH_USER_MODEL)),
+                        ('user_agent', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='listings.useragent')),
+                    ],
+                    options={
+                        'db_table': 'listing_view_events',
+                        'indexes': [
+                            models.Index(fields=['listing', 'viewed_at'], name='view_events_listing_idx'),
+                            models.Index(fields=['user', 'viewed_at'], name='view_events_user_idx'),
+                            models.Index(fields=['viewed_at'], name='view_events_viewed_at_idx'),
+                        ],
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_view_events_table, drop_view_events_table),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-17 07:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0012_listing_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingSearchEntry',
+            fields=[
+                ('listing', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='listings.listing')),
+            ],
+            options={
+                'db_table': 'listing_search',
+                'managed': False,
+            },
+        ),
+    ]
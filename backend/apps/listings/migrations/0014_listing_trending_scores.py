@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-17 07:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('categories', '0003_category_listing_counters'),
+        ('listings', '0013_listing_search_entry'),
+    ]
+    
+    operations = [
+        migrations.CreateModel(
+            name='ListingTrendingScore',
+            fields=[
+                ('listing', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending_score', serialize=False, to='listings.listing')),
+                ('score', models.FloatField(default=0)),
+                ('epoch', models.DateTimeField()),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='categories.category')),
+            ],
+            options={
+                'db_table': 'listing_trending_scores',
+                'indexes': [models.Index(fields=['-score'], name='listing_tre_score_f90417_idx'), models.Index(fields=['category', '-score'], name='listing_tre_categor_47cc03_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-17 07:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0014_listing_trending_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryPriceStatsRefresh',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('computed_at', models.DateTimeField(blank=True, null=True)),
+                ('categories_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'category_price_stats_refresh',
+            },
+        ),
+    ]
@@ -1,12 +1,30 @@
-from django.db import models
-# from django.contrib.gis.db import models as gis_models
-# from django.contrib.gis.geos import Point
+from django.db import models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from apps.users.models import User
 from apps.categories.models import Category
-import os
-os.environ['GDAL_LIBRARY_PATH'] = '/usr/lib/libgdal.so'  # Use the actual path found above
+from .geo import encode_geohash, haversine_km
+
+
+class ListingQuerySet(models.QuerySet):
+    """QuerySet helpers for listings."""
+    
+    def with_list_data(self):
+        """Fetch everything the list serializer needs in the main query."""
+        images = ListingImage.objects.filter(listing=models.OuterRef('pk')).order_by()
+        primary = images.order_by('-is_primary', 'sort_order', 'created_at')
+        return self.select_related('seller', 'category').annotate(
+            images_total=Coalesce(
+                models.Subquery(
+                    images.values('listing').annotate(total=models.Count('id')).values('total')
+                ),
+                0
+            ),
+            primary_image_path=models.Subquery(primary.values('image')[:1]),
+            primary_image_variants=models.Subquery(primary.values('variants')[:1], output_field=models.JSONField()),
+            primary_image_blurhash=models.Subquery(primary.values('blurhash')[:1]),
+        )
 
 
 class Listing(models.Model):
@@ -40,7 +58,17 @@ class Listing(models.Model):
     condition = models.CharField(max_length=20, choices=CONDITION_CHOICES, default='good')
     
     # Location
-    # location = gis_models.PointField(null=True, blank=True)
+    latitude = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-90), MaxValueValidator(90)]
+    )
+    longitude = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-180), MaxValueValidator(180)]
+    )
+    geohash = models.CharField(max_length=12, blank=True, editable=False)
     address = models.TextField(blank=True)
     city = models.CharField(max_length=100, blank=True)
     state = models.CharField(max_length=100, blank=True)
@@ -72,6 +100,8 @@ class Listing(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     expires_at = models.DateTimeField(null=True, blank=True)
     
+    objects = ListingQuerySet.as_manager()
+    
     class Meta:
         db_table = 'listings'
         ordering = ['-created_at']
@@ -81,6 +111,9 @@ class Listing(models.Model):
             models.Index(fields=['seller', 'status']),
             models.Index(fields=['price']),
             models.Index(fields=['created_at']),
+            models.Index(fields=['updated_at']),
+            models.Index(fields=['geohash']),
+            models.Index(fields=['latitude', 'longitude']),
         ]
     
     def __str__(self):
@@ -90,13 +123,38 @@ class Listing(models.Model):
         # Set expiration date if not set and status is active
         if self.status == 'active' and not self.expires_at:
             self.expires_at = timezone.now() + timezone.timedelta(days=30)
-        super().save(*args, **kwargs)
+        
+        # Keep the geohash cell index in sync with the coordinates
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = encode_geohash(self.latitude, self.longitude)
+        else:
+            self.geohash = ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        
+        # Category counters are updated by signals inside the same transaction,
+        # from the state stored in the locked row rather than the one this
+        # instance was loaded with, so concurrent saves never apply a move twice
+        with transaction.atomic():
+            self._stored_state = self.lock_stored_state() if not self._state.adding else None
+            super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            self._stored_state = self.lock_stored_state()
+            return super().delete(*args, **kwargs)
+    
+    def lock_stored_state(self):
+        """Lock the row and read the fields that decide where the listing is counted."""
+        return Listing.objects.select_for_update().filter(pk=self.pk).values_list(
+            'status', 'is_active', 'category_id'
+        ).first()
     
     def set_location(self, latitude, longitude):
         """Set listing location from coordinates."""
-        # if latitude and longitude:
-        #     self.location = Point(longitude, latitude)
-        pass
+        self.latitude = latitude
+        self.longitude = longitude
     
     def get_full_address(self):
         """Get formatted full address."""
@@ -104,9 +162,9 @@ class Listing(models.Model):
         return ', '.join(filter(None, parts))
     
     def increment_views(self):
-        """Increment view count."""
+        """Increment view count atomically."""
+        Listing.objects.filter(id=self.id).update(views_count=models.F('views_count') + 1)
         self.views_count += 1
-        self.save(update_fields=['views_count'])
     
     def is_expired(self):
         """Check if listing is expired."""
@@ -114,11 +172,13 @@ class Listing(models.Model):
             return timezone.now() > self.expires_at
         return False
     
-    def get_distance_from_point(self, point):
+    def get_distance_from_point(self, latitude, longitude):
         """Get distance from a given point in kilometers."""
-        # if self.location and point:
-        #     return self.location.distance(point) * 100  # Convert to km
-        return None
+        if self.latitude is None or self.longitude is None:
+            return None
+        if latitude is None or longitude is None:
+            return None
+        return haversine_km(self.latitude, self.longitude, latitude, longitude)
 
 
 class ListingImage(models.Model):
@@ -130,6 +190,10 @@ class ListingImage(models.Model):
     is_primary = models.BooleanField(default=False)
     sort_order = models.IntegerField(default=0)
     
+    # Resized copies and placeholder, filled in by marketplace.images
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+    blurhash = models.CharField(max_length=64, blank=True, editable=False)
+    
     # Metadata
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -166,23 +230,240 @@ class ListingFavorite(models.Model):
         return f"{self.user.username} - {self.listing.title}"
 
 
+class ListingSearchEntry(models.Model):
+    """A row of the SQLite FTS5 index, which keys entries by listing id in ``rowid``.
+    
+    Lets searches join the index instead of matching it once per listing.
+    The table is created and maintained by the search backend.
+    """
+    
+    listing = models.OneToOneField(
+        Listing,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column='rowid',
+        db_constraint=False,
+        related_name='search_entry'
+    )
+    
+    class Meta:
+        managed = False
+        db_table = 'listing_search'
+
+
+class UserAgent(models.Model):
+    """A distinct user agent string, interned so view events only store its id."""
+    
+    digest = models.CharField(max_length=32, unique=True)  # md5 of the value
+    value = models.TextField()
+    
+    class Meta:
+        db_table = 'user_agents'
+    
+    def __str__(self):
+        return self.value
+
+
 class ListingView(models.Model):
-    """Model for tracking listing views."""
+    """Model for tracking listing views.
+    
+    Rows live in monthly partitions of ``listing_view_events`` on PostgreSQL,
+    see ``apps.listings.view_store``. The table has no foreign key
+    constraints so old months can be dropped cheaply; deletes of listings and
+    users still cascade through Django.
+    """
+    
+    listing = models.ForeignKey(
+        Listing,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        db_index=False,
+        related_name='view_logs'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        db_constraint=False,
+        db_index=False,
+        related_name='viewed_listings'
+    )
+    ip = models.BigIntegerField(null=True, blank=True)  # encoded by view_store.encode_ip
+    user_agent = models.ForeignKey(
+        UserAgent,
+        on_delete=models.DO_NOTHING,
+        null=True,
+        blank=True,
+        db_constraint=False,
+        db_index=False,
+        related_name='+'
+    )
+    viewed_at = models.DateTimeField(default=timezone.now, editable=False)
+    
+    class Meta:
+        db_table = 'listing_view_events'
+        indexes = [
+            models.Index(fields=['listing', 'viewed_at'], name='view_events_listing_idx'),
+            models.Index(fields=['user', 'viewed_at'], name='view_events_user_idx'),
+            models.Index(fields=['viewed_at'], name='view_events_viewed_at_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.listing_id} - {self.viewed_at}"
+    
+    @property
+    def ip_address(self):
+        from .view_store import decode_ip
+        return decode_ip(self.ip)
+
+
+class LegacyListingView(models.Model):
+    """A view logged before the partitioned store, moved over by ``migrate_listing_views``."""
     
-    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='view_logs')
-    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='viewed_listings')
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='legacy_view_logs')
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='legacy_viewed_listings'
+    )
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(blank=True)
-    viewed_at = models.DateTimeField(auto_now_add=True)
+    viewed_at = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
         db_table = 'listing_views'
-        ordering = ['-viewed_at']
+        indexes = [
+            models.Index(fields=['viewed_at']),
+        ]
     
     def __str__(self):
         return f"{self.listing.title} - {self.viewed_at}"
 
 
+class ListingActivityBucket(models.Model):
+    """Hourly view and favorite totals of a listing, the source of trending scores."""
+    
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='activity_buckets')
+    hour = models.DateTimeField()
+    views = models.PositiveIntegerField(default=0)
+    favorites = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        db_table = 'listing_activity_buckets'
+        unique_together = ['listing', 'hour']
+        indexes = [
+            models.Index(fields=['hour']),
+        ]
+    
+    def __str__(self):
+        return f"{self.listing_id} @ {self.hour}: {self.views} views, {self.favorites} favorites"
+
+
+class ListingTrendingScore(models.Model):
+    """Decayed trending score of a listing, the scoreboard shared by all workers."""
+    
+    listing = models.OneToOneField(Listing, on_delete=models.CASCADE, primary_key=True, related_name='trending_score')
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    score = models.FloatField(default=0)
+    epoch = models.DateTimeField()
+    
+    class Meta:
+        db_table = 'listing_trending_scores'
+        indexes = [
+            models.Index(fields=['-score']),
+            models.Index(fields=['category', '-score']),
+        ]
+    
+    def __str__(self):
+        return f"{self.listing_id}: {self.score:.2f}"
+
+
+class ListingViewRollup(models.Model):
+    """Views of a listing compacted per hour or per day, the source of seller analytics."""
+    
+    PERIOD_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+    
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='view_rollups')
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    start = models.DateTimeField()
+    views = models.PositiveIntegerField(default=0)
+    visitors = models.BinaryField(default=bytes)  # HyperLogLog sketch of visitors
+    user_agents = models.JSONField(default=dict)  # {user_agent: views} for the most common ones
+    
+    class Meta:
+        db_table = 'listing_view_rollups'
+        unique_together = ['listing', 'period', 'start']
+        indexes = [
+            models.Index(fields=['period', 'start']),
+        ]
+    
+    def __str__(self):
+        return f"{self.listing_id} {self.period} @ {self.start}: {self.views} views"
+
+
+class CategoryPriceStats(models.Model):
+    """Price distribution of the active listings of a category, shared by listing pages and seller dashboards."""
+    
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, primary_key=True, related_name='price_stats')
+    listings_count = models.PositiveIntegerField(default=0)
+    avg_price = models.FloatField(default=0)
+    price_quantiles = models.JSONField(default=list)  # prices at every percentile, cheapest first
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'category_price_stats'
+    
+    def __str__(self):
+        return f"Price stats of {self.category_id}"
+
+
+class CategoryPriceStatsRefresh(models.Model):
+    """Single row marking the last completed price stats refresh, which refreshes lock."""
+    
+    computed_at = models.DateTimeField(null=True, blank=True)
+    categories_count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        db_table = 'category_price_stats_refresh'
+    
+    def __str__(self):
+        return f"Price stats computed at {self.computed_at}"
+
+
+class ListingCooccurrence(models.Model):
+    """Most co-interacted listings of a listing, the item-item half of recommendations."""
+    
+    listing = models.OneToOneField(Listing, on_delete=models.CASCADE, primary_key=True, related_name='cooccurrence')
+    neighbors = models.JSONField(default=list)  # [[listing_id, score], ...] best first
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'listing_cooccurrences'
+    
+    def __str__(self):
+        return f"Neighbors of {self.listing_id}"
+
+
+class UserRecommendation(models.Model):
+    """Precomputed recommended listings of a user."""
+    
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='listing_recommendations')
+    listing_ids = models.JSONField(default=list)  # best first
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'user_recommendations'
+    
+    def __str__(self):
+        return f"Recommendations for {self.user_id}"
+
+
 class ListingReport(models.Model):
     """Model for listing reports."""
     
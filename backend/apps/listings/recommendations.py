@@ -0,0 +1,241 @@
+"""
+Item-item collaborative filtering for listing recommendations.
+
+Favorites and logged-in views form a sparse user by listing interaction
+matrix. The batch build counts how often listings are interacted with by
+the same users, keeps the strongest cosine-normalized neighbours of every
+listing and scores each user's candidates from the neighbours of what they
+already touched. Both the pair counting and the scoring are split over
+worker processes. Users who interact again are refreshed from the stored
+neighbours without rebuilding the matrix by the ``--active-since`` run of
+``build_recommendations``, never on the request path. Listings a user sells
+or has favorited are never recommended to them.
+"""
+
+import heapq
+import math
+import multiprocessing
+import os
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Listing, ListingCooccurrence, ListingFavorite, ListingView, UserRecommendation
+
+# Shared with forked workers instead of being pickled for every task
+_neighbors = {}
+_excluded = {}
+
+
+def get_recommendation_settings():
+    options = {
+        'WINDOW_DAYS': 90,
+        'FAVORITE_WEIGHT': 3.0,
+        'VIEW_WEIGHT': 1.0,
+        'MAX_ITEMS_PER_USER': 100,
+        'NEIGHBORS': 50,
+        'PER_USER': 50,
+        'PROCESSES': 0,
+    }
+    options.update(getattr(settings, 'LISTING_RECOMMENDATIONS', {}))
+    return options
+
+
+def load_interactions(user_ids=None, since=None):
+    """Get ``{user_id: {listing_id: weight}}`` from favorites and views."""
+    options = get_recommendation_settings()
+    since = since or timezone.now() - timedelta(days=options['WINDOW_DAYS'])
+    
+    favorites = ListingFavorite.objects.filter(created_at__gte=since)
+    views = ListingView.objects.filter(viewed_at__gte=since, user__isnull=False)
+    if user_ids is not None:
+        favorites = favorites.filter(user_id__in=user_ids)
+        views = views.filter(user_id__in=user_ids)
+    
+    interactions = defaultdict(Counter)
+    # Repeat views add a little, a favorite outweighs several views
+    for user_id, listing_id, count in views.values('user_id', 'listing_id').annotate(
+        count=Count('id')
+    ).order_by().values_list('user_id', 'listing_id', 'count'):
+        interactions[user_id][listing_id] += options['VIEW_WEIGHT'] * (1 + math.log(count))
+    for user_id, listing_id in favorites.values_list('user_id', 'listing_id'):
+        interactions[user_id][listing_id] += options['FAVORITE_WEIGHT']
+    
+    limit = options['MAX_ITEMS_PER_USER']
+    return {
+        user_id: dict(items.most_common(limit))
+        for user_id, items in interactions.items()
+    }
+
+
+def count_pairs(user_items):
+    """Count weighted co-occurrences of listing pairs over a chunk of users."""
+    pairs = Counter()
+    norms = Counter()
+    for items in user_items:
+        entries = sorted(items.items())
+        for position, (listing_id, weight) in enumerate(entries):
+            norms[listing_id] += weight * weight
+            for other_id, other_weight in entries[position + 1:]:
+                pairs[listing_id, other_id] += weight * other_weight
+    return pairs, norms
+
+
+def top_neighbors(pairs, norms, limit):
+    """Keep the strongest cosine-normalized neighbours of every listing."""
+    candidates = defaultdict(list)
+    for (listing_id, other_id), weight in pairs.items():
+        score = weight / math.sqrt(norms[listing_id] * norms[other_id])
+        candidates[listing_id].append((score, other_id))
+        candidates[other_id].append((score, listing_id))
+    return {
+        listing_id: [(other_id, score) for score, other_id in heapq.nlargest(limit, scored)]
+        for listing_id, scored in candidates.items()
+    }
+
+
+def score_user(items, neighbors, excluded, limit):
+    """Rank candidate listings for one user from the neighbours of their items."""
+    scores = Counter()
+    for listing_id, weight in items.items():
+        for other_id, similarity in neighbors.get(listing_id, ()):
+            if other_id not in items and other_id not in excluded:
+                scores[other_id] += weight * similarity
+    return [listing_id for listing_id, _ in scores.most_common(limit)]
+
+
+def score_chunk(args):
+    chunk, limit = args
+    return [
+        (user_id, score_user(items, _neighbors, _excluded.get(user_id, ()), limit))
+        for user_id, items in chunk
+    ]
+
+
+def chunked(items, size):
+    items = list(items)
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def run_parallel(function, tasks, processes):
+    """Map a function over tasks in forked worker processes.
+    
+    Workers are forked per call so they see the module globals set just
+    before it. Runs in this process when one process is requested or fork
+    is not available.
+    """
+    processes = processes or os.cpu_count() or 1
+    if processes <= 1 or len(tasks) <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        return [function(task) for task in tasks]
+    with multiprocessing.get_context('fork').Pool(min(processes, len(tasks))) as pool:
+        return pool.map(function, tasks)
+
+
+def get_excluded_listings(user_ids):
+    """Get the listings each user is selling or has favorited, which are never recommended to them."""
+    excluded = defaultdict(set)
+    for seller_id, listing_id in Listing.objects.filter(seller_id__in=user_ids).values_list('seller_id', 'id'):
+        excluded[seller_id].add(listing_id)
+    # Favorites outside the window or past MAX_ITEMS_PER_USER are not among the scored items
+    for user_id, listing_id in ListingFavorite.objects.filter(user_id__in=user_ids).values_list('user_id', 'listing_id'):
+        excluded[user_id].add(listing_id)
+    return excluded
+
+
+def store_recommendations(results):
+    UserRecommendation.objects.bulk_create(
+        [UserRecommendation(user_id=user_id, listing_ids=listing_ids) for user_id, listing_ids in results],
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['listing_ids', 'computed_at'],
+        batch_size=1000
+    )
+
+
+def build_recommendations(processes=None):
+    """Rebuild listing neighbours and every user's recommendations."""
+    global _neighbors, _excluded
+    options = get_recommendation_settings()
+    processes = options['PROCESSES'] if processes is None else processes
+    
+    interactions = load_interactions()
+    active_ids = set(Listing.objects.filter(status='active', is_active=True).values_list('id', flat=True))
+    # Only live listings take part; others can neither be neighbours nor recommended
+    interactions = {
+        user_id: {listing_id: weight for listing_id, weight in items.items() if listing_id in active_ids}
+        for user_id, items in interactions.items()
+    }
+    interactions = {user_id: items for user_id, items in interactions.items() if items}
+    
+    # A few chunks per process keeps the workers evenly loaded
+    chunk_size = len(interactions) // ((processes or os.cpu_count() or 1) * 4) + 1
+    
+    pairs, norms = Counter(), Counter()
+    for chunk_pairs, chunk_norms in run_parallel(count_pairs, chunked(interactions.values(), chunk_size), processes):
+        pairs.update(chunk_pairs)
+        norms.update(chunk_norms)
+    neighbors = top_neighbors(pairs, norms, options['NEIGHBORS'])
+    del pairs
+    
+    with transaction.atomic():
+        ListingCooccurrence.objects.all().delete()
+        ListingCooccurrence.objects.bulk_create(
+            [
+                ListingCooccurrence(listing_id=listing_id, neighbors=[list(entry) for entry in entries])
+                for listing_id, entries in neighbors.items()
+            ],
+            batch_size=1000
+        )
+    
+    _neighbors = neighbors
+    _excluded = get_excluded_listings(list(interactions))
+    try:
+        tasks = [(chunk, options['PER_USER']) for chunk in chunked(interactions.items(), chunk_size)]
+        results = run_parallel(score_chunk, tasks, processes)
+    finally:
+        _neighbors, _excluded = {}, {}
+    
+    total = 0
+    for chunk_results in results:
+        store_recommendations(chunk_results)
+        total += len(chunk_results)
+    return len(neighbors), total
+
+
+def refresh_user_recommendations(user_ids):
+    """Recompute recommendations of some users from the stored neighbours."""
+    options = get_recommendation_settings()
+    interactions = load_interactions(user_ids=user_ids)
+    listing_ids = {listing_id for items in interactions.values() for listing_id in items}
+    neighbors = {
+        listing_id: [tuple(entry) for entry in entries]
+        for listing_id, entries in ListingCooccurrence.objects.filter(
+            listing_id__in=listing_ids
+        ).values_list('listing_id', 'neighbors')
+    }
+    excluded = get_excluded_listings(list(interactions))
+    
+    results = [
+        (user_id, score_user(items, neighbors, excluded.get(user_id, ()), options['PER_USER']))
+        for user_id, items in interactions.items()
+    ]
+    store_recommendations(results)
+    return len(results)
+
+
+def get_active_user_ids(since):
+    """Get users who favorited or viewed listings since a point in time."""
+    return set(
+        ListingFavorite.objects.filter(created_at__gte=since).values_list('user_id', flat=True)
+    ) | set(
+        ListingView.objects.filter(viewed_at__gte=since, user__isnull=False).values_list('user_id', flat=True)
+    )
+
+
+def get_recommended_listing_ids(user):
+    """Get a user's precomputed recommendations, or None if there are none."""
+    return UserRecommendation.objects.filter(user=user).values_list('listing_ids', flat=True).first()
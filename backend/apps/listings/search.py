@@ -0,0 +1,268 @@
+"""
+Full-text search for listings.
+
+Listings are indexed into a database-native inverted index that is kept up
+to date incrementally by listing signals. SQLite uses an FTS5 table (porter
+stemming, BM25 ranking), PostgreSQL a tsvector table with a GIN index. Other
+databases fall back to ``icontains`` filtering.
+"""
+
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+SEARCH_TABLE = 'listing_search'
+
+# Column order shared by the index definitions and the indexing queries
+INDEX_SELECT = """
+    SELECT l.id, l.title, l.description, c.name, u.username,
+           l.city || ' ' || l.state || ' ' || l.country
+    FROM listings l
+    JOIN categories c ON c.id = l.category_id
+    JOIN users u ON u.id = l.seller_id
+"""
+
+
+def tokenize(query):
+    """Split a user query into lowercase word tokens."""
+    return re.findall(r'\w+', query.lower())
+
+
+class BaseSearchBackend:
+    """Base class for listing search backends."""
+    
+    def __init__(self, connection):
+        self.connection = connection
+    
+    def create_index(self):
+        """Create the index structures."""
+    
+    def drop_index(self):
+        """Drop the index structures."""
+    
+    def rebuild(self):
+        """Re-index every listing."""
+    
+    def index_listings(self, listing_ids):
+        """Add or refresh the given listings in the index."""
+    
+    def remove_listings(self, listing_ids):
+        """Remove the given listings from the index."""
+    
+    def filter(self, queryset, query):
+        """Filter a listing queryset by query, annotating ``search_rank``."""
+        raise NotImplementedError
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    """Fallback backend using icontains lookups, without an index."""
+    
+    def filter(self, queryset, query):
+        condition = Q()
+        for term in tokenize(query):
+            condition &= (
+                Q(title__icontains=term) |
+                Q(description__icontains=term) |
+                Q(category__name__icontains=term) |
+                Q(seller__username__icontains=term) |
+                Q(city__icontains=term) |
+                Q(state__icontains=term) |
+                Q(country__icontains=term)
+            )
+        return queryset.filter(condition).annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        )
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """FTS5 backend with porter stemming and BM25 ranking."""
+    
+    # BM25 column weights: title, description, category, seller, location
+    WEIGHTS = '10.0, 1.0, 4.0, 2.0, 2.0'
+    
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+                "title, description, category, seller, location, "
+                "tokenize='porter unicode61')"
+            )
+    
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+    
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} '
+                f'(rowid, title, description, category, seller, location) {INDEX_SELECT}'
+            )
+    
+    def index_listings(self, listing_ids):
+        listing_ids = [int(listing_id) for listing_id in listing_ids]
+        if not listing_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(listing_ids))
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})',
+                listing_ids
+            )
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} '
+                f'(rowid, title, description, category, seller, location) '
+                f'{INDEX_SELECT} WHERE l.id IN ({placeholders})',
+                listing_ids
+            )
+    
+    def remove_listings(self, listing_ids):
+        listing_ids = [int(listing_id) for listing_id in listing_ids]
+        if not listing_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(listing_ids))
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})',
+                listing_ids
+            )
+    
+    def filter(self, queryset, query):
+        terms = tokenize(query)
+        if not terms:
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+        
+        # Every term must match, as a prefix so partial words still hit
+        match = ' '.join(f'"{term}"*' for term in terms)
+        # Join the index once; matching it in per-row subqueries reruns the
+        # full-text query for every candidate and grows quadratically
+        return queryset.filter(search_entry__isnull=False).filter(
+            RawSQL(f'"{SEARCH_TABLE}" MATCH %s', [match], output_field=BooleanField())
+        ).annotate(
+            # bm25() is lower for better matches; negate so higher ranks first
+            search_rank=RawSQL(f'-bm25("{SEARCH_TABLE}", {self.WEIGHTS})', [], output_field=FloatField())
+        )
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """tsvector backend with a GIN index and cover density ranking."""
+    
+    DOCUMENT = (
+        "setweight(to_tsvector('english', coalesce(s.title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(s.category, '')), 'B') || "
+        "setweight(to_tsvector('english', coalesce(s.seller, '') || ' ' || coalesce(s.location, '')), 'C') || "
+        "setweight(to_tsvector('english', coalesce(s.description, '')), 'D')"
+    )
+    
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ('
+                'listing_id bigint PRIMARY KEY REFERENCES listings (id) '
+                'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+                'document tsvector NOT NULL)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx '
+                f'ON {SEARCH_TABLE} USING GIN (document)'
+            )
+    
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+    
+    def _upsert(self, where='', params=None):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (listing_id, document) '
+                f'SELECT s.id, {self.DOCUMENT} FROM ('
+                f'{INDEX_SELECT} {where}'
+                ') AS s (id, title, description, category, seller, location) '
+                'ON CONFLICT (listing_id) DO UPDATE SET document = EXCLUDED.document',
+                params or []
+            )
+    
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {SEARCH_TABLE}')
+        self._upsert()
+    
+    def index_listings(self, listing_ids):
+        listing_ids = [int(listing_id) for listing_id in listing_ids]
+        if listing_ids:
+            self._upsert('WHERE l.id = ANY(%s)', [listing_ids])
+    
+    def remove_listings(self, listing_ids):
+        listing_ids = [int(listing_id) for listing_id in listing_ids]
+        if not listing_ids:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {SEARCH_TABLE} WHERE listing_id = ANY(%s)',
+                [listing_ids]
+            )
+    
+    def filter(self, queryset, query):
+        terms = tokenize(query)
+        if not terms:
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+        
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(
+                f"SELECT listing_id FROM {SEARCH_TABLE} "
+                f"WHERE document @@ to_tsquery('english', %s)",
+                [tsquery]
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                f"SELECT ts_rank_cd(document, to_tsquery('english', %s)) "
+                f'FROM {SEARCH_TABLE} WHERE listing_id = "{table}"."id"',
+                [tsquery],
+                output_field=FloatField()
+            )
+        )
+
+
+VENDOR_BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend(using=None):
+    """Return the search backend for a database connection."""
+    using = using or connection
+    backend = getattr(settings, 'LISTING_SEARCH_BACKEND', None)
+    if backend:
+        return import_string(backend)(using)
+    return VENDOR_BACKENDS.get(using.vendor, SimpleSearchBackend)(using)
+
+
+def reindex_listings(queryset, batch_size=1000):
+    """Refresh the index entries of every listing in a queryset, in batches."""
+    backend = get_search_backend()
+    listing_ids = list(queryset.values_list('id', flat=True))
+    for start in range(0, len(listing_ids), batch_size):
+        backend.index_listings(listing_ids[start:start + batch_size])
+    return len(listing_ids)
+
+
+def search_listings(query, queryset=None):
+    """Full-text search over listings, ordered by relevance.
+    
+    Returns the given queryset (all listings by default) narrowed to the
+    matches and annotated with ``search_rank``; callers may re-order it.
+    """
+    if queryset is None:
+        from .models import Listing
+        queryset = Listing.objects.all()
+    if not query or not query.strip():
+        return queryset
+    return get_search_backend().filter(queryset, query).order_by('-search_rank', '-created_at')
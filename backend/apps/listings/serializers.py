@@ -1,24 +1,79 @@
 from rest_framework import serializers
-from django.contrib.gis.geos import Point
+from marketplace.images import get_variant_urls
 from .models import Listing, ListingImage, ListingFavorite, ListingView, ListingReport
-from apps.users.serializers import UserProfileSerializer
-from apps.categories.serializers import CategorySerializer
+from apps.users.serializers import UserProfileSerializer, UserSummarySerializer
+from apps.categories.serializers import CategorySerializer, CategorySummarySerializer
 
 
 class ListingImageSerializer(serializers.ModelSerializer):
-    """Serializer for listing images."""
+    """Serializer for listing images.
+    
+    ``variants`` stays empty until the image pipeline has processed the upload.
+    """
+    
+    variants = serializers.SerializerMethodField()
     
     class Meta:
         model = ListingImage
-        fields = ['id', 'image', 'caption', 'is_primary', 'sort_order', 'created_at']
+        fields = ['id', 'image', 'caption', 'is_primary', 'sort_order', 'variants', 'blurhash', 'created_at']
+        read_only_fields = ['blurhash']
+    
+    def get_variants(self, obj):
+        return get_variant_urls(obj.image.storage, obj.variants, self.context.get('request'))
+
+
+def load_page_favorites(context, listing_ids):
+    """Look up which listings of a page the current user has favorited."""
+    request = context.get('request')
+    user = getattr(request, 'user', None)
+    # Payloads shared between users leave favorites to ``apply_favorites``
+    if user is not None and user.is_authenticated and not context.get('shared'):
+        context['favorited_ids'] = set(
+            ListingFavorite.objects.filter(
+                user=user,
+                listing_id__in=listing_ids
+            ).values_list('listing_id', flat=True)
+        )
+    else:
+        context['favorited_ids'] = set()
+
+
+def apply_favorites(request, items):
+    """Fill in ``is_favorited`` on serialized listings built without a user."""
+    user = getattr(request, 'user', None)
+    favorited_ids = set()
+    if user is not None and user.is_authenticated and items:
+        favorited_ids = set(
+            ListingFavorite.objects.filter(
+                user=user,
+                listing_id__in=[item['id'] for item in items]
+            ).values_list('listing_id', flat=True)
+        )
+    for item in items:
+        item['is_favorited'] = item['id'] in favorited_ids
+    return items
+
+
+class ListingListSerializer(serializers.ListSerializer):
+    """List serializer that resolves per-row lookups once for the whole page."""
+    
+    def to_representation(self, data):
+        listings = list(data.all() if hasattr(data, 'all') else data)
+        load_page_favorites(self.context, [listing.id for listing in listings])
+        return super().to_representation(listings)
 
 
 class ListingSerializer(serializers.ModelSerializer):
-    """Basic serializer for listings."""
+    """Basic serializer for listings.
     
-    seller = UserProfileSerializer(read_only=True)
-    category = CategorySerializer(read_only=True)
+    Querysets should use ``Listing.objects.with_list_data()`` so image data
+    comes from annotations instead of per-row queries.
+    """
+    
+    seller = UserSummarySerializer(read_only=True)
+    category = CategorySummarySerializer(read_only=True)
     primary_image = serializers.SerializerMethodField()
+    primary_image_blurhash = serializers.SerializerMethodField()
     images_count = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     distance = serializers.SerializerMethodField()
@@ -28,46 +83,74 @@ class ListingSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'title', 'description', 'price', 'currency',
             'category', 'condition', 'seller', 'status', 'is_active',
-            'is_featured', 'is_negotiable', 'location', 'address',
+            'is_featured', 'is_negotiable', 'latitude', 'longitude', 'address',
             'city', 'state', 'country', 'postal_code', 'primary_image',
-            'images_count', 'views_count', 'favorites_count',
+            'primary_image_blurhash', 'images_count', 'views_count', 'favorites_count',
             'is_favorited', 'distance', 'created_at', 'updated_at'
         ]
         read_only_fields = ['views_count', 'favorites_count', 'created_at', 'updated_at']
+        list_serializer_class = ListingListSerializer
+    
+    def get_primary_image_row(self, obj):
+        """Get the path, variants and blurhash of the primary image, or None."""
+        if hasattr(obj, 'primary_image_path'):
+            if not obj.primary_image_path:
+                return None
+            return obj.primary_image_path, obj.primary_image_variants or {}, obj.primary_image_blurhash
+        
+        if not hasattr(obj, '_primary_image'):
+            # Fall back to the first image if there is no primary
+            obj._primary_image = obj.images.filter(is_primary=True).first() or obj.images.first()
+        if obj._primary_image is None:
+            return None
+        return obj._primary_image.image.name, obj._primary_image.variants, obj._primary_image.blurhash
     
     def get_primary_image(self, obj):
-        """Get the primary image URL."""
-        primary_image = obj.images.filter(is_primary=True).first()
-        if primary_image:
-            return self.context['request'].build_absolute_uri(primary_image.image.url)
-        # Return first image if no primary
-        first_image = obj.images.first()
-        if first_image:
-            return self.context['request'].build_absolute_uri(first_image.image.url)
-        return None
+        """Get the primary image thumbnail URL, or the original until it is processed."""
+        row = self.get_primary_image_row(obj)
+        if row is None:
+            return None
+        path, variants, _ = row
+        if variants.get('thumb'):
+            path = variants['thumb']['jpeg']
+        url = ListingImage._meta.get_field('image').storage.url(path)
+        return self.context['request'].build_absolute_uri(url)
+    
+    def get_primary_image_blurhash(self, obj):
+        row = self.get_primary_image_row(obj)
+        if row is None or not row[2]:
+            return None
+        return row[2]
     
     def get_images_count(self, obj):
         """Get count of images."""
+        if hasattr(obj, 'images_total'):
+            return obj.images_total
         return obj.images.count()
     
     def get_is_favorited(self, obj):
         """Check if current user has favorited this listing."""
+        favorited_ids = self.context.get('favorited_ids')
+        if favorited_ids is not None:
+            return obj.id in favorited_ids
         user = self.context['request'].user
         if user.is_authenticated:
             return obj.favorited_by.filter(user=user).exists()
         return False
     
     def get_distance(self, obj):
-        """Get distance from user's location."""
-        user = self.context['request'].user
-        if user.is_authenticated and user.location and obj.location:
-            return obj.get_distance_from_point(user.location)
-        return None
+        """Get distance in km from the searched location."""
+        distance = getattr(obj, 'distance', None)
+        if distance is None:
+            return None
+        return round(distance, 2)
 
 
 class ListingDetailSerializer(ListingSerializer):
     """Detailed serializer for listings."""
     
+    seller = UserProfileSerializer(read_only=True)
+    category = CategorySerializer(read_only=True)
     images = ListingImageSerializer(many=True, read_only=True)
     full_address = serializers.SerializerMethodField()
     is_expired = serializers.SerializerMethodField()
@@ -88,8 +171,6 @@ class ListingCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating listings."""
     
     images = ListingImageSerializer(many=True, required=False)
-    latitude = serializers.FloatField(write_only=True, required=False)
-    longitude = serializers.FloatField(write_only=True, required=False)
     
     class Meta:
         model = Listing
@@ -102,16 +183,10 @@ class ListingCreateSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
         images_data = validated_data.pop('images', [])
-        latitude = validated_data.pop('latitude', None)
-        longitude = validated_data.pop('longitude', None)
         
         # Set seller
         validated_data['seller'] = self.context['request'].user
         
-        # Set location
-        if latitude and longitude:
-            validated_data['location'] = Point(longitude, latitude)
-        
         # Create listing
         listing = Listing.objects.create(**validated_data)
         
@@ -125,9 +200,6 @@ class ListingCreateSerializer(serializers.ModelSerializer):
 class ListingUpdateSerializer(serializers.ModelSerializer):
     """Serializer for updating listings."""
     
-    latitude = serializers.FloatField(write_only=True, required=False)
-    longitude = serializers.FloatField(write_only=True, required=False)
-    
     class Meta:
         model = Listing
         fields = [
@@ -136,16 +208,15 @@ class ListingUpdateSerializer(serializers.ModelSerializer):
             'address', 'city', 'state', 'country', 'postal_code',
             'latitude', 'longitude', 'attributes'
         ]
+
+
+class ListingFavoriteListSerializer(serializers.ListSerializer):
+    """List serializer that resolves the favorited listings' lookups once per page."""
     
-    def update(self, instance, validated_data):
-        latitude = validated_data.pop('latitude', None)
-        longitude = validated_data.pop('longitude', None)
-        
-        # Update location
-        if latitude and longitude:
-            instance.set_location(latitude, longitude)
-        
-        return super().update(instance, validated_data)
+    def to_representation(self, data):
+        favorites = list(data.all() if hasattr(data, 'all') else data)
+        load_page_favorites(self.context, [favorite.listing_id for favorite in favorites])
+        return super().to_representation(favorites)
 
 
 class ListingFavoriteSerializer(serializers.ModelSerializer):
@@ -157,6 +228,7 @@ class ListingFavoriteSerializer(serializers.ModelSerializer):
         model = ListingFavorite
         fields = ['id', 'listing', 'created_at']
         read_only_fields = ['created_at']
+        list_serializer_class = ListingFavoriteListSerializer
 
 
 class ListingReportSerializer(serializers.ModelSerializer):
@@ -188,5 +260,5 @@ class ListingSearchSerializer(serializers.Serializer):
     radius = serializers.FloatField(required=False, default=50)  # km
     sort_by = serializers.CharField(required=False, default='created_at')
     sort_order = serializers.CharField(required=False, default='desc')
-    page = serializers.IntegerField(required=False, default=1)
-    page_size = serializers.IntegerField(required=False, default=20) 
\ No newline at end of file
+    cursor = serializers.CharField(required=False, allow_blank=True)
+    page_size = serializers.IntegerField(required=False, default=20, min_value=1, max_value=100) 
\ No newline at end of file
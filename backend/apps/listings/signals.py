@@ -0,0 +1,168 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from apps.categories.index import invalidate_category_counts
+from apps.categories.models import Category
+from apps.users.models import User
+from marketplace.cache import invalidate_tags
+from marketplace.images import schedule_image_processing
+from .dashboard import invalidate_seller_dashboard
+from .models import Listing, ListingFavorite, ListingImage
+from .search import get_search_backend, reindex_listings
+from .similarity import refresh_listings
+from .trending import record_activity, remove_from_trending, truncate_to_hour
+
+# Fields that feed the full-text index
+SEARCH_FIELDS = {'title', 'description', 'category', 'seller', 'city', 'state', 'country'}
+
+# Fields that feed the similarity vectors or decide whether a listing is indexed
+SIMILARITY_FIELDS = {'title', 'price', 'condition', 'category', 'geohash', 'status', 'is_active'}
+
+
+def get_listing_state(listing):
+    """Get the fields that decide where and whether a listing is counted."""
+    # Read from __dict__ so deferred fields do not trigger extra queries
+    return (
+        listing.__dict__.get('status'),
+        listing.__dict__.get('is_active'),
+        listing.__dict__.get('category_id'),
+    )
+
+
+def pop_stored_state(listing):
+    """Get the state locked and read by ``Listing.save`` or ``Listing.delete``.
+    
+    Rows that did not exist count nowhere. Instances deleted through a
+    queryset or a cascade were just loaded, so their own fields are current.
+    """
+    if '_stored_state' not in listing.__dict__:
+        return get_listing_state(listing)
+    return listing.__dict__.pop('_stored_state') or (None, None, None)
+
+
+def get_saved_state(listing, stored_state, update_fields=None):
+    """Get the state a save left in the row; fields not saved keep their stored value."""
+    state = get_listing_state(listing)
+    if update_fields is None:
+        return state
+    saved = {'status', 'is_active', 'category', 'category_id'}.intersection(update_fields)
+    return tuple(
+        value if name in saved or f'{name}_id' in saved else stored
+        for name, value, stored in zip(('status', 'is_active', 'category'), state, stored_state)
+    )
+
+
+def is_counted(state):
+    """Check whether a listing state counts as an active listing."""
+    status, is_active, category_id = state
+    return status == 'active' and bool(is_active) and category_id is not None
+
+
+def update_category_counters(old_state, new_state):
+    """Move a listing between category counters when its state changes."""
+    if is_counted(old_state):
+        Category.objects.adjust_listing_counts(old_state[2], -1)
+    if is_counted(new_state):
+        Category.objects.adjust_listing_counts(new_state[2], 1)
+
+
+def stored_value_changed(instance, field, update_fields=None):
+    """Check whether a save is about to change a field's stored value."""
+    if instance._state.adding or (update_fields is not None and field not in update_fields):
+        return False
+    stored = type(instance).objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+    return stored != getattr(instance, field)
+
+
+def is_live(state):
+    """Check whether a listing state can appear in the shared listing feeds."""
+    status, is_active, _ = state
+    return status == 'active' and bool(is_active)
+
+
+def invalidate_listing_caches():
+    invalidate_tags('listings')
+
+
+@receiver(post_save, sender=Listing)
+def listing_saved(sender, instance, created, update_fields=None, **kwargs):
+    old_state = pop_stored_state(instance)
+    if created:
+        old_state = (None, None, None)
+    state = get_saved_state(instance, old_state, update_fields)
+    if state != old_state:
+        if is_counted(old_state) != is_counted(state) or old_state[2] != state[2]:
+            update_category_counters(old_state, state)
+        transaction.on_commit(invalidate_category_counts)
+        if is_counted(old_state) and not is_counted(state):
+            listing_id = instance.id
+            transaction.on_commit(lambda: remove_from_trending([listing_id]))
+    # Feeds only show live listings, but any live listing can enter a ranking,
+    # so one tag covers them; edits to drafts and sold listings keep the feeds
+    if is_live(old_state) or is_live(state):
+        transaction.on_commit(invalidate_listing_caches)
+    seller_id = instance.seller_id
+    transaction.on_commit(lambda: invalidate_seller_dashboard(seller_id))
+    
+    if update_fields is None or SEARCH_FIELDS.intersection(update_fields):
+        listing_id = instance.id
+        transaction.on_commit(lambda: get_search_backend().index_listings([listing_id]))
+    
+    if update_fields is None or SIMILARITY_FIELDS.intersection(update_fields):
+        listing_id = instance.id
+        transaction.on_commit(lambda: refresh_listings([listing_id]))
+
+
+@receiver(post_delete, sender=Listing)
+def listing_deleted(sender, instance, **kwargs):
+    old_state = pop_stored_state(instance)
+    update_category_counters(old_state, (None, None, None))
+    transaction.on_commit(invalidate_category_counts)
+    if is_live(old_state):
+        transaction.on_commit(invalidate_listing_caches)
+    seller_id = instance.seller_id
+    transaction.on_commit(lambda: invalidate_seller_dashboard(seller_id))
+    
+    listing_id = instance.id
+    transaction.on_commit(lambda: get_search_backend().remove_listings([listing_id]))
+    transaction.on_commit(lambda: remove_from_trending([listing_id]))
+    transaction.on_commit(lambda: refresh_listings([listing_id]))
+
+
+@receiver(pre_save, sender=Category)
+def remember_category_rename(sender, instance, update_fields=None, **kwargs):
+    instance._search_text_changed = stored_value_changed(instance, 'name', update_fields)
+
+
+@receiver(pre_save, sender=User)
+def remember_username_change(sender, instance, update_fields=None, **kwargs):
+    instance._search_text_changed = stored_value_changed(instance, 'username', update_fields)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=User)
+def search_text_changed(sender, instance, **kwargs):
+    """Reindex listings whose indexed text embeds a renamed category or seller."""
+    if not instance.__dict__.pop('_search_text_changed', False):
+        return
+    field = 'category_id' if sender is Category else 'seller_id'
+    queryset = Listing.objects.filter(**{field: instance.id})
+    transaction.on_commit(lambda: reindex_listings(queryset))
+
+
+@receiver(post_save, sender=ListingImage)
+@receiver(post_delete, sender=ListingImage)
+def listing_image_changed(sender, **kwargs):
+    transaction.on_commit(invalidate_listing_caches)
+
+
+@receiver(post_save, sender=ListingImage)
+def listing_image_saved(sender, instance, **kwargs):
+    schedule_image_processing(instance)
+
+
+@receiver(post_save, sender=ListingFavorite)
+def listing_favorited(sender, instance, created, **kwargs):
+    if created:
+        record_activity(favorites={(instance.listing_id, truncate_to_hour(instance.created_at)): 1})
@@ -0,0 +1,373 @@
+"""
+Vectorized similar listings.
+
+Every active listing is encoded as a fixed size float32 vector made of
+weighted blocks: a log-scale price position, the category path, the
+condition, hashed TF-IDF of the title words and the geohash cell. Blocks
+are normalized so that the dot product of two vectors is their weighted
+cosine similarity, and the neighbours of a batch of listings come from one
+matrix product.
+
+The index lives in process memory and is never built inside a request.
+The first lookup starts a background thread that loads the snapshot written
+by ``build_similarity_index``, or builds the index from the database when
+there is none; until it is ready lookups return None and callers fall back
+to database queries. The same thread keeps the index current. Every
+``SYNC_INTERVAL`` it re-encodes listings whose ``updated_at`` moved since
+the last sync, looking back ``SYNC_OVERLAP`` further for transactions that
+committed late, and every ``RECONCILE_INTERVAL`` it compares the index with
+the live listings, which also drops listings deleted in other processes.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from apps.categories.models import path_to_ids
+from .models import Listing
+
+PRICE_DIMS = 8
+CONDITION_DIMS = 8
+CATEGORY_DIMS = 24
+TITLE_DIMS = 64
+LOCATION_DIMS = 24
+
+# (name, offset, dims, weight); weights decide how much each block counts
+BLOCKS = [
+    ('price', 0, PRICE_DIMS, 1.0),
+    ('condition', PRICE_DIMS, CONDITION_DIMS, 0.5),
+    ('category', PRICE_DIMS + CONDITION_DIMS, CATEGORY_DIMS, 2.0),
+    ('title', PRICE_DIMS + CONDITION_DIMS + CATEGORY_DIMS, TITLE_DIMS, 1.5),
+    ('location', PRICE_DIMS + CONDITION_DIMS + CATEGORY_DIMS + TITLE_DIMS, LOCATION_DIMS, 0.75),
+]
+DIMENSIONS = sum(dims for _, _, dims, _ in BLOCKS)
+
+CONDITIONS = [value for value, _ in Listing.CONDITION_CHOICES]
+LISTING_FIELDS = ('id', 'title', 'price', 'condition', 'category_id', 'category__path', 'geohash')
+TOKEN_PATTERN = re.compile(r'\w\w+')
+QUERY_CHUNK_SIZE = 32
+RECONCILE_CHUNK_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def stable_hash(value, dims):
+    # Python's hash() is salted per process, snapshots need a stable one
+    return zlib.crc32(value.encode()) % dims
+
+
+def tokenize(title):
+    return TOKEN_PATTERN.findall((title or '').lower())
+
+
+def soft_position(positions, dims, spread):
+    """Spread scalar positions over neighbouring dimensions with a gaussian."""
+    offsets = np.arange(dims, dtype=np.float32)[None, :] - positions[:, None]
+    return np.exp(-(offsets ** 2) / (2 * spread ** 2)).astype(np.float32)
+
+
+def compute_idf(rows):
+    """Inverse document frequency of each hashed title dimension."""
+    document_frequency = np.zeros(TITLE_DIMS, dtype=np.float32)
+    for row in rows:
+        for dim in {stable_hash(token, TITLE_DIMS) for token in tokenize(row[1])}:
+            document_frequency[dim] += 1
+    return np.log((1 + len(rows)) / (1 + document_frequency)).astype(np.float32) + 1
+
+
+def encode_rows(rows, idf):
+    """Encode ``LISTING_FIELDS`` rows into normalized feature vectors."""
+    vectors = np.zeros((len(rows), DIMENSIONS), dtype=np.float32)
+    if not rows:
+        return vectors
+    
+    prices = np.array([float(row[2] or 0) for row in rows], dtype=np.float32)
+    # One dimension per order of magnitude, from 1 to 10 million
+    positions = np.log10(prices + 1) * (PRICE_DIMS - 1) / 7
+    vectors[:, 0:PRICE_DIMS] = soft_position(positions, PRICE_DIMS, spread=0.6)
+    
+    conditions = np.array([
+        CONDITIONS.index(row[3]) if row[3] in CONDITIONS else len(CONDITIONS) for row in rows
+    ], dtype=np.float32)
+    offset = PRICE_DIMS
+    vectors[:, offset:offset + CONDITION_DIMS] = soft_position(conditions, CONDITION_DIMS, spread=0.5)
+    
+    for index, (_, title, _, _, category_id, path, geohash) in enumerate(rows):
+        # Ancestors count half as much per level up from the listing's category
+        category_ids = path_to_ids(path) if path else ([category_id] if category_id else [])
+        offset = PRICE_DIMS + CONDITION_DIMS
+        for depth, ancestor_id in enumerate(reversed(category_ids)):
+            vectors[index, offset + stable_hash(str(ancestor_id), CATEGORY_DIMS)] += 0.5 ** depth
+        
+        offset += CATEGORY_DIMS
+        for token in tokenize(title):
+            dim = stable_hash(token, TITLE_DIMS)
+            vectors[index, offset + dim] += idf[dim]
+        
+        offset += TITLE_DIMS
+        if geohash:
+            vectors[index, offset + stable_hash(geohash[:4], LOCATION_DIMS)] += 1.0
+            vectors[index, offset + stable_hash(geohash[:3], LOCATION_DIMS)] += 0.5
+    
+    total_weight = np.zeros(len(rows), dtype=np.float32)
+    for _, offset, dims, weight in BLOCKS:
+        block = vectors[:, offset:offset + dims]
+        norms = np.linalg.norm(block, axis=1)
+        present = norms > 0
+        block[present] *= (weight / norms[present])[:, None]
+        total_weight += present * weight ** 2
+    vectors /= np.sqrt(np.maximum(total_weight, 1e-12))[:, None]
+    return vectors
+
+
+class SimilarityIndex:
+    """Feature vectors of active listings with batched nearest neighbour search."""
+    
+    def __init__(self, idf, capacity=1024):
+        self.idf = idf
+        self.vectors = np.zeros((capacity, DIMENSIONS), dtype=np.float32)
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.size = 0
+        self.row_by_id = {}
+        self.free_rows = []
+        self.synced_at = None
+        self.lock = threading.RLock()
+    
+    @classmethod
+    def from_rows(cls, rows):
+        """Build an index from ``LISTING_FIELDS`` rows."""
+        index = cls(compute_idf(rows), capacity=max(len(rows), 1024))
+        index.upsert(rows)
+        return index
+    
+    def __len__(self):
+        return len(self.row_by_id)
+    
+    def upsert(self, rows):
+        """Encode listings into the index, replacing earlier versions."""
+        if not rows:
+            return
+        vectors = encode_rows(rows, self.idf)
+        with self.lock:
+            for row, vector in zip(rows, vectors):
+                listing_id = row[0]
+                position = self.row_by_id.get(listing_id)
+                if position is None:
+                    position = self.allocate_row()
+                    self.row_by_id[listing_id] = position
+                self.vectors[position] = vector
+                self.ids[position] = listing_id
+    
+    def remove(self, listing_ids):
+        with self.lock:
+            for listing_id in listing_ids:
+                position = self.row_by_id.pop(listing_id, None)
+                if position is not None:
+                    self.vectors[position] = 0
+                    self.ids[position] = -1
+                    self.free_rows.append(position)
+    
+    def allocate_row(self):
+        if self.free_rows:
+            return self.free_rows.pop()
+        if self.size == len(self.ids):
+            # Grow by doubling so appends stay amortized constant time
+            capacity = len(self.ids) * 2
+            self.vectors = np.resize(self.vectors, (capacity, DIMENSIONS))
+            self.vectors[self.size:] = 0
+            self.ids = np.concatenate([self.ids, np.full(capacity - self.size, -1, dtype=np.int64)])
+        self.size += 1
+        return self.size - 1
+    
+    def neighbours(self, listing_ids, k=5):
+        """Get the k most similar listings of each listing as ``(id, score)`` pairs."""
+        with self.lock:
+            known = [listing_id for listing_id in listing_ids if listing_id in self.row_by_id]
+            results = {listing_id: [] for listing_id in listing_ids}
+            if not known or k <= 0:
+                return results
+            
+            vectors = self.vectors[:self.size]
+            dead = np.array(self.free_rows, dtype=np.int64)
+            k = min(k, len(self.row_by_id) - 1)
+            if k <= 0:
+                return results
+            
+            # Chunked so the score matrix stays small for large batches
+            for start in range(0, len(known), QUERY_CHUNK_SIZE):
+                chunk = known[start:start + QUERY_CHUNK_SIZE]
+                rows = np.array([self.row_by_id[listing_id] for listing_id in chunk])
+                scores = vectors[rows] @ vectors.T
+                if len(dead):
+                    scores[:, dead] = -np.inf
+                scores[np.arange(len(rows)), rows] = -np.inf
+                
+                candidates = np.argpartition(scores, self.size - k, axis=1)[:, -k:]
+                candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+                order = np.argsort(-candidate_scores, axis=1)
+                for listing_id, positions, values in zip(
+                    chunk,
+                    np.take_along_axis(candidates, order, axis=1),
+                    np.take_along_axis(candidate_scores, order, axis=1)
+                ):
+                    results[listing_id] = [
+                        (int(self.ids[position]), float(value)) for position, value in zip(positions, values)
+                    ]
+            return results
+    
+    def save(self, path):
+        with self.lock:
+            live = self.ids[:self.size] >= 0
+            np.savez(
+                path,
+                idf=self.idf,
+                vectors=self.vectors[:self.size][live],
+                ids=self.ids[:self.size][live],
+                synced_at=np.array([self.synced_at.timestamp() if self.synced_at else 0.0]),
+            )
+    
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        count = len(data['ids'])
+        index = cls(data['idf'], capacity=max(count, 1024))
+        index.vectors[:count] = data['vectors']
+        index.ids[:count] = data['ids']
+        index.size = count
+        index.row_by_id = {int(listing_id): position for position, listing_id in enumerate(data['ids'])}
+        synced_at = float(data['synced_at'][0])
+        index.synced_at = datetime.fromtimestamp(synced_at, tz=dt_timezone.utc) if synced_at else None
+        return index
+
+
+_index = None
+_index_lock = threading.Lock()
+_maintainer = None
+
+
+def get_similarity_settings():
+    options = {'SYNC_INTERVAL': 60, 'SYNC_OVERLAP': 120, 'RECONCILE_INTERVAL': 900}
+    options.update(getattr(settings, 'LISTING_SIMILARITY', {}))
+    return options
+
+
+def active_listing_rows(queryset=None):
+    queryset = Listing.objects.all() if queryset is None else queryset
+    return list(queryset.filter(status='active', is_active=True).values_list(*LISTING_FIELDS))
+
+
+def build_similarity_index():
+    """Build a fresh index of every active listing."""
+    synced_at = timezone.now()
+    index = SimilarityIndex.from_rows(active_listing_rows())
+    index.synced_at = synced_at
+    return index
+
+
+def load_similarity_index():
+    """Load the snapshot and catch it up, or build the index when there is no snapshot."""
+    path = get_similarity_settings().get('SNAPSHOT_PATH')
+    if path and os.path.exists(path):
+        index = SimilarityIndex.load(path)
+        sync_similarity_index(index)
+        reconcile_similarity_index(index)
+        return index
+    return build_similarity_index()
+
+
+def sync_similarity_index(index):
+    """Re-encode listings changed since the index was last synced."""
+    synced_at = timezone.now()
+    changed = Listing.objects.all()
+    if index.synced_at is not None:
+        # updated_at is stamped before commit, so look back past transactions still open at the last sync
+        overlap = timedelta(seconds=get_similarity_settings()['SYNC_OVERLAP'])
+        changed = changed.filter(updated_at__gte=index.synced_at - overlap)
+    rows = list(changed.values_list('status', 'is_active', *LISTING_FIELDS))
+    
+    index.upsert([row[2:] for row in rows if row[0] == 'active' and row[1]])
+    index.remove([row[2] for row in rows if not (row[0] == 'active' and row[1])])
+    index.synced_at = synced_at
+    return len(rows)
+
+
+def reconcile_similarity_index(index):
+    """Drop listings that are gone or no longer live and add live ones the syncs missed."""
+    live_ids = set(Listing.objects.filter(status='active', is_active=True).values_list('id', flat=True))
+    with index.lock:
+        indexed_ids = set(index.row_by_id)
+    
+    removed_ids = indexed_ids - live_ids
+    index.remove(removed_ids)
+    missing_ids = sorted(live_ids - indexed_ids)
+    for start in range(0, len(missing_ids), RECONCILE_CHUNK_SIZE):
+        chunk = missing_ids[start:start + RECONCILE_CHUNK_SIZE]
+        index.upsert(active_listing_rows(Listing.objects.filter(id__in=chunk)))
+    return len(removed_ids), len(missing_ids)
+
+
+def maintain_similarity_index():
+    """Load the index, then keep it current for the life of the process."""
+    global _index
+    try:
+        _index = load_similarity_index()
+    except Exception:
+        logger.exception('Could not load the similarity index, it will be retried on the next lookup')
+        return
+    finally:
+        connection.close()
+    
+    options = get_similarity_settings()
+    last_reconcile = time.monotonic()
+    while True:
+        time.sleep(options['SYNC_INTERVAL'])
+        try:
+            sync_similarity_index(_index)
+            if time.monotonic() - last_reconcile >= options['RECONCILE_INTERVAL']:
+                last_reconcile = time.monotonic()
+                reconcile_similarity_index(_index)
+        except Exception:
+            logger.exception('Could not sync the similarity index')
+        finally:
+            connection.close()
+
+
+def get_similarity_index():
+    """Return the process wide index, or None while it is loaded in the background."""
+    global _maintainer
+    if _index is None:
+        with _index_lock:
+            if _index is None and (_maintainer is None or not _maintainer.is_alive()):
+                _maintainer = threading.Thread(
+                    target=maintain_similarity_index,
+                    name='similarity-index',
+                    daemon=True
+                )
+                _maintainer.start()
+    return _index
+
+
+def refresh_listings(listing_ids):
+    """Re-encode listings in this process's index right after they change."""
+    if _index is None:
+        return
+    rows = active_listing_rows(Listing.objects.filter(id__in=listing_ids))
+    _index.upsert(rows)
+    _index.remove(set(listing_ids) - {row[0] for row in rows})
+
+
+def get_similar_listing_ids(listing_id, limit=5):
+    """Get ids of the most similar listings, or None if the listing or the index is not ready."""
+    index = get_similarity_index()
+    if index is None or listing_id not in index.row_by_id:
+        return None
+    return [neighbour_id for neighbour_id, _ in index.neighbours([listing_id], k=limit)[listing_id]]
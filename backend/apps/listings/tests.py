@@ -0,0 +1,872 @@
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from io import BytesIO
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from PIL import Image
+from rest_framework.test import APIClient, APIRequestFactory
+
+from apps.categories.models import Category
+from apps.users.models import User
+from marketplace.cache import warn_if_cache_not_shared
+from marketplace.images import process_image
+from marketplace.pagination import KeysetPagination
+from .models import (
+    CategoryPriceStats, CategoryPriceStatsRefresh, Listing, ListingCooccurrence, ListingFavorite, ListingImage, ListingView, ListingViewRollup,
+    UserRecommendation
+)
+from . import similarity
+from .analytics import HyperLogLog, rollup_views, truncate_to_day
+from .dashboard import compute_seller_dashboard, estimate_similar_count, refresh_category_price_stats
+from .favorites import set_favorite
+from .recommendations import refresh_user_recommendations
+from .search import search_listings
+from .view_buffer import LocalViewBuffer, write_view_events
+from .view_store import create_partition, encode_ip, get_partition_months, partition_name
+from .utils import calculate_listing_stats, get_listing_recommendations, get_similar_listings
+from .trending import get_trending_board, rebuild_trending_board, record_activity, truncate_to_hour
+
+
+def create_listing(seller, category, **fields):
+    fields.setdefault('title', 'Oak desk')
+    fields.setdefault('description', 'Solid oak desk')
+    fields.setdefault('price', 50)
+    fields.setdefault('status', 'active')
+    return Listing.objects.create(seller=seller, category=category, **fields)
+
+
+class CategoryCounterTests(TestCase):
+    """Category counters follow the stored listing row, not stale instances."""
+    
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com', password='secret')
+        self.parent = Category.objects.create(name='Furniture', slug='furniture')
+        self.category = Category.objects.create(name='Desks', slug='desks', parent=self.parent)
+        self.other = Category.objects.create(name='Chairs', slug='chairs', parent=self.parent)
+    
+    def assertCounts(self, category, active, subtree):
+        category.refresh_from_db()
+        self.assertEqual((category.active_listings_count, category.subtree_listings_count), (active, subtree))
+    
+    def test_stale_copies_move_a_listing_once(self):
+        listing = create_listing(self.seller, self.category)
+        first, second = Listing.objects.get(id=listing.id), Listing.objects.get(id=listing.id)
+        
+        first.status = 'sold'
+        first.save()
+        second.status = 'sold'
+        second.save()
+        
+        self.assertCounts(self.category, 0, 0)
+        self.assertCounts(self.parent, 0, 0)
+    
+    def test_stale_copy_saving_other_fields_keeps_counters(self):
+        listing = create_listing(self.seller, self.category)
+        stale = Listing.objects.get(id=listing.id)
+        listing.category = self.other
+        listing.save()
+        
+        stale.title = 'Pine desk'
+        stale.save(update_fields=['title'])
+        
+        self.assertCounts(self.category, 0, 0)
+        self.assertCounts(self.other, 1, 1)
+        self.assertCounts(self.parent, 0, 1)
+    
+    def test_deleting_a_stale_copy_uses_the_stored_state(self):
+        listing = create_listing(self.seller, self.category)
+        stale = Listing.objects.get(id=listing.id)
+        listing.is_active = False
+        listing.save()
+        
+        stale.delete()
+        
+        self.assertCounts(self.category, 0, 0)
+        self.assertCounts(self.parent, 0, 0)
+
+
+@override_settings(ROOT_URLCONF='apps.listings.urls')
+class ListingSerializerQueryTests(TestCase):
+    """List endpoints serialize a page in a fixed number of queries."""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name='Desks', slug='desks')
+    
+    def create_listings(self, count):
+        for number in range(count):
+            username = f'seller{Listing.objects.count()}'
+            seller = User.objects.create(username=username, email=f'{username}@example.com')
+            listing = create_listing(seller, self.category, title=f'Desk {number}')
+            ListingImage.objects.create(listing=listing, image=f'listing_images/{listing.id}-1.jpg', is_primary=True)
+            ListingImage.objects.create(listing=listing, image=f'listing_images/{listing.id}-2.jpg')
+            ListingFavorite.objects.create(user=self.user, listing=listing)
+            with self.captureOnCommitCallbacks(execute=True):
+                record_activity(views={(listing.id, truncate_to_hour(timezone.now())): number + 1})
+    
+    def get(self, url, **params):
+        cache.clear()
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+    
+    def assertConstantQueries(self, url, **params):
+        self.create_listings(2)
+        with CaptureQueriesContext(connection) as queries:
+            self.get(url, **params)
+        self.assertLessEqual(len(queries), 8)
+        
+        self.create_listings(18)
+        with self.assertNumQueries(len(queries)):
+            data = self.get(url, **params)
+        return data['results'] if isinstance(data, dict) else data
+    
+    def test_listing_list(self):
+        results = self.assertConstantQueries('/')
+        self.assertEqual(len(results), 20)
+        self.assertTrue(all(item['is_favorited'] for item in results))
+        self.assertTrue(all(item['images_count'] == 2 for item in results))
+        self.assertTrue(all(item['primary_image'].endswith('-1.jpg') for item in results))
+    
+    def test_trending_listings(self):
+        results = self.assertConstantQueries('/trending/', limit=20)
+        self.assertEqual(len(results), 20)
+        self.assertTrue(all(item['is_favorited'] for item in results))
+    
+    def test_user_favorites(self):
+        results = self.assertConstantQueries('/favorites/')
+        self.assertEqual(len(results), 20)
+        self.assertTrue(all(item['listing']['images_count'] == 2 for item in results))
+
+
+class SearchIndexTests(TestCase):
+    """Indexed text follows renames of the category and the seller."""
+    
+    def setUp(self):
+        self.seller = User.objects.create(username='oakworks', email='oakworks@example.com')
+        self.category = Category.objects.create(name='Furniture', slug='furniture')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing = create_listing(self.seller, self.category, title='Standing desk')
+    
+    def search(self, query):
+        return list(search_listings(query).values_list('id', flat=True))
+    
+    def test_category_rename_reindexes_listings(self):
+        self.assertEqual(self.search('furniture'), [self.listing.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Office'
+            self.category.save()
+        self.assertEqual(self.search('furniture'), [])
+        self.assertEqual(self.search('office'), [self.listing.id])
+    
+    def test_username_change_reindexes_listings(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.seller.username = 'pinecraft'
+            self.seller.save()
+        self.assertEqual(self.search('oakworks'), [])
+        self.assertEqual(self.search('pinecraft'), [self.listing.id])
+
+
+@override_settings(ROOT_URLCONF='apps.listings.urls')
+class ListingOrderingTests(TestCase):
+    """Sorting by distance only applies when a location is given."""
+    
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create(username='seller', email='seller@example.com')
+        category = Category.objects.create(name='Desks', slug='desks')
+        self.far = create_listing(seller, category, latitude=40.80, longitude=-74.0)
+        self.near = create_listing(seller, category, latitude=40.71, longitude=-74.0)
+    
+    def test_distance_ordering_without_location_is_ignored(self):
+        response = self.client.get('/', {'ordering': 'distance'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.near.id, self.far.id])
+    
+    def test_distance_ordering_with_location(self):
+        response = self.client.get('/', {'ordering': '-distance', 'latitude': 40.70, 'longitude': -74.0, 'radius': 20})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.far.id, self.near.id])
+
+
+class KeysetPaginationTests(TestCase):
+    """Cursor pages cover every row once, including rows with a null key."""
+    
+    def setUp(self):
+        seller = User.objects.create(username='seller', email='seller@example.com')
+        category = Category.objects.create(name='Desks', slug='desks')
+        for latitude in (None, 40.7, None, 41.0, 40.7, None, 39.5):
+            create_listing(seller, category, latitude=latitude)
+        self.factory = APIRequestFactory()
+    
+    def get_page(self, ordering, cursor=None):
+        paginator = KeysetPagination()
+        params = {'page_size': 2}
+        if cursor:
+            params['cursor'] = cursor
+        request = Request(self.factory.get('/', params))
+        page = paginator.paginate_queryset(Listing.objects.order_by(ordering), request)
+        return [listing.id for listing in page], paginator
+    
+    def walk(self, ordering):
+        ids, paginator = self.get_page(ordering)
+        pages = [ids]
+        while paginator.next_cursor:
+            ids, paginator = self.get_page(ordering, paginator.next_cursor)
+            pages.append(ids)
+        
+        # Walk back from the last page to the first one
+        backwards = [pages[-1]]
+        while paginator.previous_cursor:
+            ids, paginator = self.get_page(ordering, paginator.previous_cursor)
+            backwards.insert(0, ids)
+        return pages, backwards
+    
+    def test_nullable_ordering_field(self):
+        for ordering in ('latitude', '-latitude'):
+            with self.subTest(ordering=ordering):
+                pages, backwards = self.walk(ordering)
+                ids = [listing_id for page in pages for listing_id in page]
+                listings = Listing.objects.in_bulk(ids)
+                latitudes = [listings[listing_id].latitude for listing_id in ids]
+                
+                self.assertEqual(sorted(ids), sorted(Listing.objects.values_list('id', flat=True)))
+                self.assertEqual(latitudes[-3:], [None, None, None])
+                values = latitudes[:-3]
+                self.assertEqual(values, sorted(values, reverse=ordering.startswith('-')))
+                self.assertEqual(backwards, pages)
+
+
+@override_settings(ROOT_URLCONF='apps.listings.urls')
+class TrendingListingsTests(TestCase):
+    """Trending rankings come from the shared board, or the buckets until it is built."""
+    
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create(username='seller', email='seller@example.com')
+        category = Category.objects.create(name='Desks', slug='desks')
+        self.listings = [create_listing(seller, category, title=f'Desk {number}') for number in range(3)]
+        self.now = truncate_to_hour(timezone.now())
+    
+    def record(self, listing, hours_ago, views=0, favorites=0):
+        hour = self.now - timezone.timedelta(hours=hours_ago)
+        with self.captureOnCommitCallbacks(execute=True):
+            record_activity(views={(listing.id, hour): views}, favorites={(listing.id, hour): favorites})
+    
+    def get_trending(self, **params):
+        cache.clear()
+        response = self.client.get('/trending/', params)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()['results']]
+    
+    def test_unbuilt_board_ranks_from_buckets(self):
+        first, second, third = self.listings
+        self.record(first, 1, views=3)
+        self.record(second, 1, favorites=1)
+        
+        self.assertEqual(self.get_trending(), [second.id, first.id])
+        self.assertIsNone(get_trending_board().get_epoch())
+    
+    def test_built_board_decays_older_activity(self):
+        first, second, third = self.listings
+        self.record(first, 72, views=10)
+        self.record(second, 1, views=4)
+        rebuild_trending_board()
+        self.assertEqual(self.get_trending(), [second.id, first.id])
+        
+        # New activity is folded into the stored scores
+        self.record(third, 0, views=5)
+        self.assertEqual(self.get_trending(), [third.id, second.id, first.id])
+    
+    def test_days_limits_the_window(self):
+        first, second, third = self.listings
+        self.record(first, 72, views=10)
+        self.record(second, 1, views=4)
+        rebuild_trending_board()
+        
+        self.assertEqual(self.get_trending(days=1), [second.id])
+        self.assertEqual(self.get_trending(days=7), [first.id, second.id])
+
+
+@override_settings(ROOT_URLCONF='apps.listings.urls')
+class SharedListingCacheTests(TestCase):
+    """Listing feeds are cached once for everyone and personalized per request."""
+    
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create(username='seller', email='seller@example.com')
+        self.buyer = User.objects.create(username='buyer', email='buyer@example.com')
+        self.category = Category.objects.create(name='Desks', slug='desks')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listings = [
+                create_listing(self.seller, self.category, title=f'Desk {number}', is_featured=True)
+                for number in range(2)
+            ]
+    
+    def get_featured(self, user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        response = client.get('/featured/')
+        self.assertEqual(response.status_code, 200)
+        return response
+    
+    def test_second_request_is_served_from_cache(self):
+        first = self.get_featured()
+        self.assertEqual(first['X-Cache'], 'MISS')
+        
+        # Anonymous hits build nothing, not even favorites
+        with self.assertNumQueries(0):
+            second = self.get_featured()
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.json(), first.json())
+    
+    def test_live_listing_changes_invalidate(self):
+        self.get_featured()
+        listing = self.listings[0]
+        listing.title = 'Walnut desk'
+        with self.captureOnCommitCallbacks(execute=True):
+            listing.save()
+        
+        response = self.get_featured()
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('Walnut desk', [item['title'] for item in response.json()['results']])
+    
+    def test_listings_outside_the_feeds_keep_the_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            draft = create_listing(self.seller, self.category, status='draft', is_featured=True)
+        self.get_featured()
+        draft.title = 'Walnut desk'
+        with self.captureOnCommitCallbacks(execute=True):
+            draft.save()
+        self.assertEqual(self.get_featured()['X-Cache'], 'HIT')
+        
+        # Leaving the feeds invalidates, like entering them
+        listing = self.listings[0]
+        listing.status = 'sold'
+        with self.captureOnCommitCallbacks(execute=True):
+            listing.save()
+        response = self.get_featured()
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.listings[1].id])
+    
+    def test_favorites_are_filled_in_per_user(self):
+        favorited = self.listings[0]
+        ListingFavorite.objects.create(user=self.buyer, listing=favorited)
+        
+        self.assertEqual(self.get_featured(self.seller)['X-Cache'], 'MISS')
+        response = self.get_featured(self.buyer)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(
+            {item['id']: item['is_favorited'] for item in response.json()['results']},
+            {favorited.id: True, self.listings[1].id: False}
+        )
+        self.assertFalse(any(item['is_favorited'] for item in self.get_featured(self.seller).json()['results']))
+        self.assertFalse(any(item['is_favorited'] for item in self.get_featured().json()['results']))
+    
+    def test_process_local_cache_warns_with_several_workers(self):
+        with self.settings(WEB_CONCURRENCY=1):
+            self.assertFalse(warn_if_cache_not_shared())
+        with self.settings(WEB_CONCURRENCY=4), self.assertLogs('marketplace.cache', 'WARNING'):
+            self.assertTrue(warn_if_cache_not_shared())
+
+
+class SimilarityIndexTests(TestCase):
+    """The in-memory index catches late commits and deletes from other processes."""
+    
+    def setUp(self):
+        self.seller = User.objects.create(username='seller', email='seller@example.com')
+        self.category = Category.objects.create(name='Desks', slug='desks')
+        self.listings = [
+            create_listing(self.seller, self.category, title=f'Oak desk {number}', price=50 + number)
+            for number in range(3)
+        ]
+    
+    def test_sync_rereads_changes_committed_after_the_watermark(self):
+        index = similarity.build_similarity_index()
+        late = create_listing(self.seller, self.category, title='Pine desk')
+        # Stamped before the last sync but committed after it
+        Listing.objects.filter(id=late.id).update(updated_at=index.synced_at - timezone.timedelta(seconds=30))
+        
+        similarity.sync_similarity_index(index)
+        
+        self.assertIn(late.id, index.row_by_id)
+    
+    def test_reconcile_drops_deleted_listings(self):
+        index = similarity.build_similarity_index()
+        deleted = self.listings[0]
+        deleted.delete()
+        missed = create_listing(self.seller, self.category, title='Pine desk')
+        Listing.objects.filter(id=missed.id).update(updated_at=index.synced_at - timezone.timedelta(days=1))
+        
+        self.assertEqual(similarity.reconcile_similarity_index(index), (1, 1))
+        self.assertNotIn(deleted.id, index.row_by_id)
+        self.assertIn(missed.id, index.row_by_id)
+    
+    @mock.patch('apps.listings.similarity.get_similarity_index', return_value=None)
+    def test_similar_listings_fall_back_while_the_index_loads(self, *mocks):
+        listing = self.listings[0]
+        
+        similar = get_similar_listings(listing)
+        
+        self.assertEqual({other.id for other in similar}, {other.id for other in self.listings[1:]})
+
+
+class RecommendationTests(TestCase):
+    """Recommendations leave out what a user already favorited."""
+    
+    def setUp(self):
+        self.user = User.objects.create(username='buyer', email='buyer@example.com')
+        seller = User.objects.create(username='seller', email='seller@example.com')
+        category = Category.objects.create(name='Desks', slug='desks')
+        self.desk, self.chair, self.lamp = [
+            create_listing(seller, category, title=title) for title in ('Desk', 'Chair', 'Lamp')
+        ]
+        ListingCooccurrence.objects.create(
+            listing=self.desk,
+            neighbors=[[self.chair.id, 0.9], [self.lamp.id, 0.5]]
+        )
+    
+    def favorite(self, listing, days_ago=0):
+        with self.captureOnCommitCallbacks(execute=True):
+            favorite = ListingFavorite.objects.create(user=self.user, listing=listing)
+        ListingFavorite.objects.filter(id=favorite.id).update(created_at=timezone.now() - timezone.timedelta(days=days_ago))
+    
+    def test_old_favorites_are_not_recommended(self):
+        self.favorite(self.desk)
+        # Outside the interaction window, so not among the scored items
+        self.favorite(self.chair, days_ago=365)
+        
+        refresh_user_recommendations([self.user.id])
+        
+        self.assertEqual(UserRecommendation.objects.get(user=self.user).listing_ids, [self.lamp.id])
+    
+    def test_favoriting_leaves_the_refresh_to_the_batch_job(self):
+        self.favorite(self.desk)
+        self.assertFalse(UserRecommendation.objects.filter(user=self.user).exists())
+        
+        refresh_user_recommendations([self.user.id])
+        self.favorite(self.chair)
+        
+        self.assertEqual(UserRecommendation.objects.get(user=self.user).listing_ids, [self.chair.id, self.lamp.id])
+        self.assertEqual([listing.id for listing in get_listing_recommendations(self.user)], [self.lamp.id])
+
+
+class ConcurrentFavoriteTests(TransactionTestCase):
+    """Concurrent toggles keep favorites_count equal to the stored favorites."""
+    
+    threads = 6
+    rounds = 15
+    
+    def toggle(self, user, listing_id):
+        # SQLite refuses concurrent writers instead of queueing them, so retry until the toggle lands
+        for _ in range(200):
+            try:
+                return set_favorite(user, listing_id)
+            except OperationalError:
+                time.sleep(random.uniform(0, 0.01))
+        raise AssertionError('Toggle never got the database')
+    
+    def test_concurrent_toggles(self):
+        seller = User.objects.create(username='seller', email='seller@example.com')
+        category = Category.objects.create(name='Desks', slug='desks')
+        listing = create_listing(seller, category)
+        users = [
+            User.objects.create(username=f'fan{number}', email=f'fan{number}@example.com')
+            for number in range(self.threads)
+        ]
+        errors = []
+        
+        def run(user):
+            try:
+                for _ in range(self.rounds):
+                    self.toggle(user, listing.id)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=run, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(errors, [])
+        listing.refresh_from_db()
+        # An odd number of toggles leaves every user's favorite in place
+        self.assertEqual(ListingFavorite.objects.filter(listing=listing).count(), self.threads)
+        self.assertEqual(listing.favorites_count, self.threads)
+
+
+class ViewRollupTests(TestCase):
+    """Backfills rebuild what the raw views still cover and keep older daily rollups."""
+    
+    def setUp(self):
+        seller = User.objects.create(username='seller', email='seller@example.com')
+        category = Category.objects.create(name='Desks', slug='desks')
+        self.listing = create_listing(seller, category)
+        self.today = truncate_to_day(timezone.now())
+    
+    def view(self, days_ago, count, user=None):
+        viewed_at = self.today - timezone.timedelta(days=days_ago) + timezone.timedelta(hours=12)
+        ListingView.objects.bulk_create([
+            ListingView(listing=self.listing, user=user, ip=number, viewed_at=viewed_at)
+            for number in range(count)
+        ])
+    
+    def daily_views(self):
+        return dict(
+            ListingViewRollup.objects.filter(listing=self.listing, period='day').values_list('start', 'views')
+        )
+    
+    def test_backfill_past_the_raw_views_keeps_daily_rollups(self):
+        purged_day = self.today - timezone.timedelta(days=200)
+        ListingViewRollup.objects.create(listing=self.listing, period='day', start=purged_day, views=7)
+        self.view(days_ago=2, count=3)
+        self.view(days_ago=1, count=2)
+        
+        hours, days = rollup_views(since=timezone.now() - timezone.timedelta(days=365))
+        
+        self.assertEqual(days, 3)
+        self.assertEqual(self.daily_views(), {
+            purged_day: 7,
+            self.today - timezone.timedelta(days=2): 3,
+            self.today - timezone.timedelta(days=1): 2,
+        })
+    
+    def test_backfill_without_raw_views_changes_nothing(self):
+        purged_day = self.today - timezone.timedelta(days=200)
+        ListingViewRollup.objects.create(listing=self.listing, period='day', start=purged_day, views=7)
+        
+        self.assertEqual(rollup_views(since=timezone.now() - timezone.timedelta(days=365)), (0, 0))
+        self.assertEqual(self.daily_views(), {purged_day: 7})
+    
+    def test_anonymous_visitors_match_sketches_from_before_ip_encoding(self):
+        day = self.today - timezone.timedelta(days=1)
+        ListingView.objects.create(
+            listing=self.listing,
+            ip=encode_ip('203.0.113.7'),
+            viewed_at=day + timezone.timedelta(hours=12)
+        )
+        rollup_views(since=day)
+        
+        rollup = ListingViewRollup.objects.get(listing=self.listing, period='day', start=day)
+        # Rolled up before views were stored encoded
+        legacy = HyperLogLog()
+        legacy.add('ip:203.0.113.7')
+        sketch = HyperLogLog.from_bytes(rollup.visitors)
+        sketch.merge(legacy)
+        self.assertEqual(round(sketch.count()), 1)
+    
+    def test_rerunning_a_backfill_is_idempotent(self):
+        self.view(days_ago=1, count=4)
+        rollup_views(since=timezone.now() - timezone.timedelta(days=3))
+        rollup_views(since=timezone.now() - timezone.timedelta(days=3))
+        
+        self.assertEqual(self.daily_views(), {self.today - timezone.timedelta(days=1): 4})
+    
+    def test_views_of_deleted_listings_are_skipped(self):
+        self.view(days_ago=1, count=2)
+        deleted_id = self.listing.id + 100
+        ListingView.objects.create(
+            listing_id=deleted_id,
+            ip=1,
+            viewed_at=self.today - timezone.timedelta(days=1) + timezone.timedelta(hours=12)
+        )
+        
+        with self.assertLogs('apps.listings.analytics', 'INFO'):
+            rollup_views(since=timezone.now() - timezone.timedelta(days=3))
+        
+        self.assertEqual(self.daily_views(), {self.today - timezone.timedelta(days=1): 2})
+        self.assertFalse(ListingViewRollup.objects.filter(listing_id=deleted_id).exists())
+
+
+class CategoryPriceStatsTests(TestCase):
+    """Listing pages and seller dashboards read the same category price stats."""
+    
+    def setUp(self):
+        self.seller = User.objects.create(username='seller', email='seller@example.com')
+        self.category = Category.objects.create(name='Desks', slug='desks')
+        self.listings = [
+            create_listing(self.seller, self.category, title=f'Desk {price}', price=price)
+            for price in (50, 51, 52, 500)
+        ]
+    
+    def test_stats_are_computed_on_first_use(self):
+        self.assertFalse(CategoryPriceStats.objects.exists())
+        
+        stats = calculate_listing_stats(self.listings[1])
+        
+        self.assertEqual(stats['avg_price_in_category'], 163.25)
+        self.assertEqual(stats['similar_listings_count'], 2)
+        self.assertEqual(CategoryPriceStats.objects.get().listings_count, 4)
+    
+    def test_listing_page_matches_the_dashboard(self):
+        rows = {row['id']: row for row in compute_seller_dashboard(self.seller.id)['listings']}
+        
+        for listing in self.listings:
+            stats = calculate_listing_stats(listing)
+            for key in ('avg_price_in_category', 'similar_listings_count'):
+                self.assertEqual(stats[key], rows[listing.id][key])
+    
+    def test_inactive_listing_does_not_count_itself(self):
+        calculate_listing_stats(self.listings[0])
+        sold = self.listings[1]
+        sold.status = 'sold'
+        
+        self.assertEqual(calculate_listing_stats(sold)['similar_listings_count'], 3)
+    
+    def test_cold_readers_reuse_the_first_refresh(self):
+        calculate_listing_stats(self.listings[0])
+        
+        with mock.patch(
+            'apps.listings.dashboard.refresh_category_price_stats',
+            wraps=refresh_category_price_stats
+        ) as refresh:
+            calculate_listing_stats(self.listings[1])
+        
+        refresh.assert_not_called()
+        self.assertEqual(CategoryPriceStatsRefresh.objects.get().categories_count, 1)
+    
+    def test_empty_catalogue_is_not_rescanned(self):
+        Listing.objects.update(status='sold')
+        calculate_listing_stats(self.listings[0])
+        
+        self.assertFalse(CategoryPriceStats.objects.exists())
+        self.assertIsNotNone(CategoryPriceStatsRefresh.objects.get().computed_at)
+        with self.assertNumQueries(2):
+            stats = calculate_listing_stats(self.listings[0])
+        self.assertEqual(stats['similar_listings_count'], 0)
+    
+    def test_refresh_skips_when_another_just_finished(self):
+        self.assertEqual(refresh_category_price_stats(), 1)
+        self.assertIsNone(refresh_category_price_stats(max_age=timezone.timedelta(hours=1)))
+    
+    def test_refresh_replaces_stats_in_place(self):
+        other = Category.objects.create(name='Chairs', slug='chairs')
+        chair = create_listing(self.seller, other, price=20)
+        refresh_category_price_stats()
+        
+        chair.status = 'sold'
+        chair.save()
+        self.listings[3].delete()
+        refresh_category_price_stats()
+        
+        stats = CategoryPriceStats.objects.get()
+        self.assertEqual((stats.category_id, stats.listings_count), (self.category.id, 3))
+        self.assertEqual(stats.avg_price, 51.0)
+
+
+class SimilarCountEstimateTests(TestCase):
+    """Listing pages estimate the price neighbours of a listing from the category quantiles."""
+    
+    def setUp(self):
+        seller = User.objects.create(username='seller', email='seller@example.com')
+        self.category = Category.objects.create(name='Desks', slug='desks')
+        rng = random.Random(7)
+        Listing.objects.bulk_create([
+            Listing(
+                title='Desk',
+                description='Desk',
+                price=round(rng.lognormvariate(5, 1), 2),
+                category=self.category,
+                seller=seller,
+                status='active'
+            )
+            for _ in range(500)
+        ])
+        refresh_category_price_stats()
+        self.stats = CategoryPriceStats.objects.get(category=self.category)
+    
+    def exact_count(self, price):
+        return Listing.objects.filter(price__gte=price * 0.7, price__lte=price * 1.3).count()
+    
+    def test_estimate_follows_the_exact_count(self):
+        for price in (20, 60, 150, 400, 1500):
+            with self.subTest(price=price):
+                self.assertAlmostEqual(estimate_similar_count(self.stats, price), self.exact_count(price), delta=5)
+    
+    def test_prices_outside_the_category(self):
+        cheapest, dearest = self.stats.price_quantiles[0], self.stats.price_quantiles[-1]
+        self.assertEqual(estimate_similar_count(self.stats, cheapest / 2), 0)
+        self.assertEqual(estimate_similar_count(self.stats, dearest * 2), 0)
+    
+    def test_missing_stats(self):
+        self.assertEqual(estimate_similar_count(None, 100), 0)
+        self.assertEqual(estimate_similar_count(CategoryPriceStats(listings_count=0), 100), 0)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Views are only partitioned on PostgreSQL')
+class ViewPartitionTests(TransactionTestCase):
+    """Partitions are made ahead of time and survive workers racing to make them."""
+    
+    def setUp(self):
+        seller = User.objects.create(username='seller', email='seller@example.com')
+        self.listing = create_listing(seller, Category.objects.create(name='Desks', slug='desks'))
+        self.month = datetime(2031, 3, 1, tzinfo=dt_timezone.utc)
+    
+    def tearDown(self):
+        # Flushing between tests empties partitions but keeps them
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {connection.ops.quote_name(partition_name(self.month))}')
+    
+    def test_writes_never_create_partitions(self):
+        write_view_events([{
+            'listing_id': self.listing.id,
+            'user_id': None,
+            'ip_address': '203.0.113.7',
+            'user_agent': 'Firefox',
+            'viewed_at': self.month,
+        }])
+        
+        self.assertNotIn(self.month, get_partition_months())
+        self.assertEqual(ListingView.objects.filter(viewed_at=self.month).count(), 1)
+    
+    def test_concurrent_creation_makes_one_partition(self):
+        ListingView.objects.create(listing=self.listing, viewed_at=self.month)
+        results, errors = [], []
+        
+        def create():
+            try:
+                results.append(create_partition(self.month))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=create) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(results), [False, False, False, True])
+        self.assertIn(self.month, get_partition_months())
+        self.assertEqual(ListingView.objects.filter(viewed_at=self.month).count(), 1)
+
+
+@override_settings(IMAGE_PIPELINE={'ASYNC': False})
+class ImagePipelineTests(TestCase):
+    """The row never points at a missing file while its image is stripped."""
+    
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        
+        seller = User.objects.create(username='seller', email='seller@example.com')
+        listing = create_listing(seller, Category.objects.create(name='Desks', slug='desks'))
+        buffer = BytesIO()
+        Image.new('RGB', (64, 48), (200, 30, 30)).save(buffer, format='JPEG')
+        self.source_name = default_storage.save('listing_images/desk.jpg', ContentFile(buffer.getvalue()))
+        self.image = ListingImage.objects.create(listing=listing, image=self.source_name)
+    
+    def stored_files(self):
+        return set(default_storage.listdir('listing_images')[1])
+    
+    def test_original_is_deleted_once_the_switch_commits(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertTrue(process_image('listings.ListingImage', self.image.pk))
+            self.image.refresh_from_db()
+            stored_name = self.image.image.name
+            
+            self.assertNotEqual(stored_name, self.source_name)
+            self.assertEqual(self.image.variants['source'], stored_name)
+            self.assertTrue(default_storage.exists(self.source_name))
+            self.assertTrue(default_storage.exists(stored_name))
+        
+        for callback in callbacks:
+            callback()
+        self.assertFalse(default_storage.exists(self.source_name))
+        self.assertTrue(default_storage.exists(stored_name))
+        self.assertTrue(default_storage.exists(self.image.variants['thumb']['webp']))
+    
+    def test_failed_switch_keeps_the_original(self):
+        with mock.patch.object(ListingImage, 'save', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                process_image('listings.ListingImage', self.image.pk)
+        
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.image.name, self.source_name)
+        self.assertEqual(self.stored_files(), {'desk.jpg'})
+        self.assertFalse(default_storage.listdir('listing_images/variants')[1])
+
+
+class ViewBufferTests(TestCase):
+    """Buffered views are written in batches and survive failed flushes."""
+    
+    def setUp(self):
+        seller = User.objects.create(username='seller', email='seller@example.com')
+        category = Category.objects.create(name='Desks', slug='desks')
+        self.listings = [create_listing(seller, category, title=f'Desk {number}') for number in range(2)]
+        # Timer flushes stay out of the way of the flushes under test
+        self.buffer = LocalViewBuffer(flush_size=100, flush_interval=3600)
+    
+    def push(self, listing, count=1):
+        for _ in range(count):
+            self.buffer.push({
+                'listing_id': listing.id,
+                'user_id': None,
+                'ip_address': '203.0.113.7',
+                'user_agent': 'Firefox',
+                'viewed_at': timezone.now(),
+            })
+    
+    def views_counts(self):
+        return [Listing.objects.get(id=listing.id).views_count for listing in self.listings]
+    
+    def test_flush_writes_views_and_counters(self):
+        self.push(self.listings[0], 3)
+        self.push(self.listings[1])
+        
+        self.assertEqual(self.buffer.flush(), 4)
+        
+        self.assertEqual(self.buffer.size(), 0)
+        self.assertEqual(self.views_counts(), [3, 1])
+        self.assertEqual(ListingView.objects.count(), 4)
+    
+    def test_failed_flush_requeues_its_events(self):
+        self.push(self.listings[0], 2)
+        
+        with mock.patch('apps.listings.view_buffer.write_view_events', side_effect=OperationalError('locked')):
+            with self.assertRaises(OperationalError):
+                self.buffer.flush()
+        
+        self.assertEqual(self.buffer.size(), 2)
+        self.assertFalse(self.buffer.should_flush())
+        self.buffer.flush()
+        self.assertEqual(self.buffer.size(), 0)
+        self.assertEqual(self.views_counts(), [2, 0])
+    
+    def test_views_of_deleted_listings_do_not_block_the_buffer(self):
+        self.push(self.listings[0], 2)
+        self.push(self.listings[1])
+        deleted_id = self.listings[0].id
+        self.listings[0].delete()
+        
+        with self.assertLogs('apps.listings.view_buffer', 'INFO'):
+            self.buffer.flush()
+        
+        self.assertEqual(self.buffer.size(), 0)
+        self.assertEqual(Listing.objects.get(id=self.listings[1].id).views_count, 1)
+        self.assertFalse(ListingView.objects.filter(listing_id=deleted_id).exists())
+        self.assertEqual(ListingView.objects.count(), 1)
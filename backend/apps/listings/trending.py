@@ -0,0 +1,464 @@
+"""
+Precomputed trending scores.
+
+Views and favorites are summed into hourly buckets per listing and folded
+into time-decayed scores kept in sorted structures, one over all listings
+and one per category. Each event adds its weight times
+``2 ** ((hour - epoch) / half_life)``, so newer activity outweighs older
+activity without rewriting stored scores. The rebuild command moves the
+epoch forward and recomputes every score from the buckets in the window;
+it runs on a schedule, never inside a request. Until the board is built,
+and for windows other than the configured one, listings are ranked from
+the buckets directly.
+"""
+
+import heapq
+import threading
+import uuid
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Listing, ListingActivityBucket, ListingFavorite, ListingTrendingScore, ListingView
+
+
+def truncate_to_hour(value):
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def get_scopes(category_id):
+    """Get the rankings a listing appears in: global and its category."""
+    if category_id is None:
+        return (None,)
+    return (None, category_id)
+
+
+class BaseTrendingBoard:
+    """Base class for trending scoreboards."""
+    
+    def __init__(self, half_life_hours=24, window_days=7, view_weight=1.0, favorite_weight=5.0, **options):
+        self.half_life_hours = half_life_hours
+        self.window_days = window_days
+        self.view_weight = view_weight
+        self.favorite_weight = favorite_weight
+    
+    def get_epoch(self):
+        """Return the hour scores are relative to, or None if never built."""
+        raise NotImplementedError
+    
+    def increment(self, deltas):
+        """Add ``(listing_id, category_id, delta)`` score changes."""
+        raise NotImplementedError
+    
+    def remove(self, listing_ids):
+        """Drop listings from every ranking."""
+        raise NotImplementedError
+    
+    def replace(self, epoch, scores):
+        """Swap in freshly computed ``(listing_id, category_id, score)`` entries."""
+        raise NotImplementedError
+    
+    def top(self, limit, category_ids=None):
+        """Get the ids of the highest scoring listings, optionally within categories."""
+        raise NotImplementedError
+    
+    def score(self, hour, views, favorites, epoch):
+        """Weight activity of one hour relative to the epoch."""
+        hours = (hour - epoch).total_seconds() / 3600
+        weight = views * self.view_weight + favorites * self.favorite_weight
+        return weight * 2 ** (hours / self.half_life_hours)
+
+
+class DatabaseTrendingBoard(BaseTrendingBoard):
+    """Scoreboard in a database table, shared by all workers.
+    
+    Each row carries the epoch of its score. Rankings are index scans on
+    ``score`` overall and on ``(category, score)`` within categories.
+    """
+    
+    def get_epoch(self):
+        return ListingTrendingScore.objects.values_list('epoch', flat=True).first()
+    
+    def increment(self, deltas):
+        epoch = self.get_epoch()
+        if epoch is None:
+            return
+        with transaction.atomic():
+            ListingTrendingScore.objects.bulk_create(
+                [
+                    ListingTrendingScore(listing_id=listing_id, category_id=category_id, epoch=epoch)
+                    for listing_id, category_id, _ in deltas
+                ],
+                ignore_conflicts=True
+            )
+            for listing_id, category_id, delta in deltas:
+                ListingTrendingScore.objects.filter(listing_id=listing_id).update(
+                    score=F('score') + delta,
+                    category_id=category_id
+                )
+    
+    def remove(self, listing_ids):
+        ListingTrendingScore.objects.filter(listing_id__in=list(listing_ids)).delete()
+    
+    def replace(self, epoch, scores):
+        with transaction.atomic():
+            ListingTrendingScore.objects.all().delete()
+            ListingTrendingScore.objects.bulk_create(
+                [
+                    ListingTrendingScore(listing_id=listing_id, category_id=category_id, score=score, epoch=epoch)
+                    for listing_id, category_id, score in scores
+                ],
+                batch_size=1000
+            )
+    
+    def top(self, limit, category_ids=None):
+        scores = ListingTrendingScore.objects.order_by('-score', 'listing_id')
+        if category_ids is not None:
+            scores = scores.filter(category_id__in=category_ids)
+        return list(scores.values_list('listing_id', flat=True)[:limit])
+
+
+class LocalTrendingBoard(BaseTrendingBoard):
+    """In-process scoreboard, used for tests and single-node deployments.
+    
+    Every ranking is a list of ``(-score, listing_id)`` kept sorted with
+    ``bisect``, so reading the top N is a slice.
+    """
+    
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._epoch = None
+        self._scores = {}
+        self._categories = {}
+        self._rankings = defaultdict(list)
+        self._lock = threading.Lock()
+    
+    def get_epoch(self):
+        return self._epoch
+    
+    def increment(self, deltas):
+        with self._lock:
+            for listing_id, category_id, delta in deltas:
+                old_score = self._scores.get(listing_id)
+                self._unrank(listing_id, old_score)
+                score = (old_score or 0) + delta
+                self._scores[listing_id] = score
+                self._categories[listing_id] = category_id
+                self._rank(listing_id, score)
+    
+    def remove(self, listing_ids):
+        with self._lock:
+            for listing_id in listing_ids:
+                self._unrank(listing_id, self._scores.pop(listing_id, None))
+                self._categories.pop(listing_id, None)
+    
+    def replace(self, epoch, scores):
+        rankings = defaultdict(list)
+        for listing_id, category_id, score in scores:
+            for scope in get_scopes(category_id):
+                rankings[scope].append((-score, listing_id))
+        for ranking in rankings.values():
+            ranking.sort()
+        
+        with self._lock:
+            self._epoch = epoch
+            self._scores = {listing_id: score for listing_id, _, score in scores}
+            self._categories = {listing_id: category_id for listing_id, category_id, _ in scores}
+            self._rankings = rankings
+    
+    def top(self, limit, category_ids=None):
+        with self._lock:
+            if category_ids is None:
+                entries = self._rankings.get(None, [])[:limit]
+            else:
+                entries = islice(heapq.merge(*(
+                    self._rankings.get(category_id, [])[:limit] for category_id in category_ids
+                )), limit)
+            return [listing_id for _, listing_id in entries]
+    
+    def _rank(self, listing_id, score):
+        for scope in get_scopes(self._categories[listing_id]):
+            insort(self._rankings[scope], (-score, listing_id))
+    
+    def _unrank(self, listing_id, score):
+        if score is None:
+            return
+        for scope in get_scopes(self._categories.get(listing_id)):
+            ranking = self._rankings.get(scope, [])
+            index = bisect_left(ranking, (-score, listing_id))
+            if index < len(ranking) and ranking[index] == (-score, listing_id):
+                del ranking[index]
+
+
+class RedisTrendingBoard(BaseTrendingBoard):
+    """Scoreboard in Redis sorted sets, shared by all workers."""
+    
+    def __init__(self, url=None, prefix='listings:trending', **options):
+        super().__init__(**options)
+        import redis
+        self.client = redis.Redis.from_url(url or settings.REDIS_URL)
+        self.prefix = prefix
+        self.epoch_key = f'{prefix}:epoch'
+        self.categories_key = f'{prefix}:categories'
+        self.scopes_key = f'{prefix}:scopes'
+    
+    def ranking_key(self, category_id=None):
+        if category_id is None:
+            return f'{self.prefix}:all'
+        return f'{self.prefix}:category:{category_id}'
+    
+    def get_epoch(self):
+        epoch = self.client.get(self.epoch_key)
+        if epoch is None:
+            return None
+        return datetime.fromtimestamp(int(epoch), tz=dt_timezone.utc)
+    
+    def increment(self, deltas):
+        pipe = self.client.pipeline(transaction=False)
+        for listing_id, category_id, delta in deltas:
+            for scope in get_scopes(category_id):
+                pipe.zincrby(self.ranking_key(scope), delta, listing_id)
+            if category_id is not None:
+                pipe.sadd(self.scopes_key, self.ranking_key(category_id))
+            pipe.hset(self.categories_key, listing_id, '' if category_id is None else category_id)
+        pipe.execute()
+    
+    def remove(self, listing_ids):
+        listing_ids = list(listing_ids)
+        if not listing_ids:
+            return
+        category_ids = self.client.hmget(self.categories_key, listing_ids)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zrem(self.ranking_key(), *listing_ids)
+        for listing_id, category_id in zip(listing_ids, category_ids):
+            if category_id:
+                pipe.zrem(self.ranking_key(int(category_id)), listing_id)
+        pipe.hdel(self.categories_key, *listing_ids)
+        pipe.execute()
+    
+    def replace(self, epoch, scores):
+        # Build into temporary keys and rename them over the live ones at once
+        suffix = uuid.uuid4().hex
+        rankings = defaultdict(dict)
+        categories = {}
+        for listing_id, category_id, score in scores:
+            for scope in get_scopes(category_id):
+                rankings[scope][listing_id] = score
+            categories[listing_id] = '' if category_id is None else category_id
+        
+        pipe = self.client.pipeline(transaction=False)
+        for scope, members in rankings.items():
+            pipe.zadd(f'{self.ranking_key(scope)}:{suffix}', members)
+        if categories:
+            pipe.hset(f'{self.categories_key}:{suffix}', mapping=categories)
+        pipe.execute()
+        
+        live_keys = {self.ranking_key(scope) for scope in rankings}
+        stale_keys = {key.decode() for key in self.client.smembers(self.scopes_key)} - live_keys
+        if not scores:
+            stale_keys.update({self.ranking_key(), self.categories_key})
+        
+        pipe = self.client.pipeline(transaction=True)
+        for key in live_keys:
+            pipe.rename(f'{key}:{suffix}', key)
+        if categories:
+            pipe.rename(f'{self.categories_key}:{suffix}', self.categories_key)
+        if stale_keys:
+            pipe.delete(*stale_keys)
+        pipe.delete(self.scopes_key)
+        category_keys = live_keys - {self.ranking_key()}
+        if category_keys:
+            pipe.sadd(self.scopes_key, *category_keys)
+        pipe.set(self.epoch_key, int(epoch.timestamp()))
+        pipe.execute()
+    
+    def top(self, limit, category_ids=None):
+        if category_ids is None:
+            return [int(member) for member in self.client.zrevrange(self.ranking_key(), 0, limit - 1)]
+        
+        pipe = self.client.pipeline(transaction=False)
+        for category_id in category_ids:
+            pipe.zrevrange(self.ranking_key(category_id), 0, limit - 1, withscores=True)
+        entries = heapq.merge(*(
+            [(-score, int(member)) for member, score in ranking]
+            for ranking in pipe.execute()
+        ))
+        return [listing_id for _, listing_id in islice(entries, limit)]
+
+
+_board = None
+_board_lock = threading.Lock()
+
+
+def get_trending_board():
+    """Return the configured scoreboard."""
+    global _board
+    if _board is None:
+        with _board_lock:
+            if _board is None:
+                options = dict(getattr(settings, 'LISTING_TRENDING', {}))
+                backend = options.pop('BACKEND', 'apps.listings.trending.DatabaseTrendingBoard')
+                _board = import_string(backend)(**{key.lower(): value for key, value in options.items()})
+    return _board
+
+
+def record_activity(views=(), favorites=()):
+    """Add view and favorite counts keyed by ``(listing_id, hour)``.
+    
+    Buckets are upserted in the current transaction and scores are bumped
+    once it commits.
+    """
+    views, favorites = Counter(views), Counter(favorites)
+    keys = set(views) | set(favorites)
+    if not keys:
+        return
+    
+    board = get_trending_board()
+    
+    # Group buckets by hour and increments so each group costs one UPDATE
+    listings_by_change = defaultdict(list)
+    for listing_id, hour in keys:
+        listings_by_change[hour, views[listing_id, hour], favorites[listing_id, hour]].append(listing_id)
+    
+    with transaction.atomic():
+        ListingActivityBucket.objects.bulk_create(
+            [ListingActivityBucket(listing_id=listing_id, hour=hour) for listing_id, hour in keys],
+            ignore_conflicts=True
+        )
+        for (hour, view_delta, favorite_delta), listing_ids in listings_by_change.items():
+            ListingActivityBucket.objects.filter(listing_id__in=listing_ids, hour=hour).update(
+                views=F('views') + view_delta,
+                favorites=F('favorites') + favorite_delta
+            )
+        transaction.on_commit(lambda: update_scores(board, views, favorites))
+
+
+def update_scores(board, views, favorites):
+    """Fold new activity into the scoreboard."""
+    epoch = board.get_epoch()
+    if epoch is None:
+        # Not built yet, the first rebuild reads this activity from the buckets
+        return
+    listing_ids = {listing_id for listing_id, _ in set(views) | set(favorites)}
+    categories = dict(
+        Listing.objects.filter(
+            id__in=listing_ids,
+            status='active',
+            is_active=True
+        ).values_list('id', 'category_id')
+    )
+    
+    deltas = Counter()
+    for listing_id, hour in set(views) | set(favorites):
+        if listing_id in categories:
+            deltas[listing_id] += board.score(hour, views[listing_id, hour], favorites[listing_id, hour], epoch)
+    board.increment([
+        (listing_id, categories[listing_id], delta) for listing_id, delta in deltas.items()
+    ])
+
+
+def remove_from_trending(listing_ids):
+    get_trending_board().remove(listing_ids)
+
+
+def rebuild_trending_board(board=None):
+    """Recompute every score from the buckets in the window and move the epoch to now."""
+    board = board or get_trending_board()
+    epoch = truncate_to_hour(timezone.now())
+    cutoff = epoch - timedelta(days=board.window_days)
+    
+    ListingActivityBucket.objects.filter(hour__lt=cutoff).delete()
+    buckets = ListingActivityBucket.objects.filter(
+        hour__gte=cutoff,
+        listing__status='active',
+        listing__is_active=True
+    ).values_list('listing_id', 'listing__category_id', 'hour', 'views', 'favorites')
+    
+    scores = Counter()
+    categories = {}
+    for listing_id, category_id, hour, views, favorites in buckets.iterator():
+        scores[listing_id] += board.score(hour, views, favorites, epoch)
+        categories[listing_id] = category_id
+    
+    board.replace(epoch, [
+        (listing_id, categories[listing_id], score) for listing_id, score in scores.items()
+    ])
+    return len(scores)
+
+
+def count_by_hour(queryset, field, cutoff):
+    """Count rows per listing and UTC hour since the cutoff."""
+    return {
+        (listing_id, hour): count
+        for listing_id, hour, count in queryset.filter(**{f'{field}__gte': cutoff}).annotate(
+            hour=TruncHour(field, tzinfo=dt_timezone.utc)
+        ).values('listing_id', 'hour').annotate(count=Count('id')).order_by().values_list(
+            'listing_id', 'hour', 'count'
+        )
+    }
+
+
+def rebuild_activity_buckets(days=None):
+    """Recreate the buckets in the window from view logs and favorites."""
+    if days is None:
+        days = getattr(settings, 'LISTING_TRENDING', {}).get('WINDOW_DAYS', 7)
+    cutoff = truncate_to_hour(timezone.now()) - timedelta(days=days)
+    
+    views = count_by_hour(ListingView.objects.all(), 'viewed_at', cutoff)
+    favorites = count_by_hour(ListingFavorite.objects.all(), 'created_at', cutoff)
+    keys = set(views) | set(favorites)
+    
+    with transaction.atomic():
+        ListingActivityBucket.objects.filter(hour__gte=cutoff).delete()
+        ListingActivityBucket.objects.bulk_create(
+            [
+                ListingActivityBucket(
+                    listing_id=listing_id,
+                    hour=hour,
+                    views=views.get((listing_id, hour), 0),
+                    favorites=favorites.get((listing_id, hour), 0)
+                )
+                for listing_id, hour in keys
+            ],
+            batch_size=1000
+        )
+    return len(keys)
+
+
+def rank_from_buckets(board, limit, category_ids=None, days=None):
+    """Rank listings by their weighted activity over the last days, without decay."""
+    days = board.window_days if days is None else min(max(days, 1), board.window_days)
+    cutoff = truncate_to_hour(timezone.now()) - timedelta(days=days)
+    buckets = ListingActivityBucket.objects.filter(
+        hour__gte=cutoff,
+        listing__status='active',
+        listing__is_active=True
+    )
+    if category_ids is not None:
+        buckets = buckets.filter(listing__category_id__in=category_ids)
+    return list(
+        buckets.values('listing_id').annotate(
+            weight=Sum(F('views') * board.view_weight + F('favorites') * board.favorite_weight)
+        ).order_by('-weight', 'listing_id').values_list('listing_id', flat=True)[:limit]
+    )
+
+
+def get_trending_listing_ids(limit=10, category_ids=None, days=None):
+    """Get the ids of the top listings, best first.
+    
+    The scoreboard answers for the configured window. A shorter window of
+    ``days``, or a board that was never built, is ranked from the buckets.
+    Buckets older than the window are pruned, so ``days`` is capped to it.
+    """
+    board = get_trending_board()
+    if days is None and board.get_epoch() is not None:
+        return board.top(limit, category_ids=category_ids)
+    return rank_from_buckets(board, limit, category_ids=category_ids, days=days)
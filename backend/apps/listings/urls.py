@@ -39,4 +39,5 @@ urlpatterns = [
     # Analytics (seller only)
     path('<int:listing_id>/stats/', views.listing_stats, name='listing-stats'),
     path('<int:listing_id>/analytics/', views.listing_analytics, name='listing-analytics'),
+    path('dashboard/', views.SellerDashboardView.as_view(), name='seller-dashboard'),
 ] 
\ No newline at end of file
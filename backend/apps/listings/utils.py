@@ -1,40 +1,38 @@
-from django.contrib.gis.geos import Point
-from django.contrib.gis.db.models.functions import Distance
-from django.db.models import Q, Count, Avg
-from django.utils import timezone
-from datetime import timedelta
-from .models import Listing, ListingView, ListingFavorite
+from decimal import Decimal
+
+from django.db.models import Q
+from .models import Listing
+from .dashboard import estimate_price_stats, get_category_price_stats
+from .geo import filter_within_radius, haversine_expression
+from .recommendations import get_recommended_listing_ids
+from .search import search_listings
+from .similarity import get_similar_listing_ids
+from .trending import get_trending_listing_ids
+from .view_buffer import record_view
 
 
 def get_nearby_listings(latitude, longitude, radius=50, limit=20):
     """Get listings within a specified radius."""
-    if not latitude or not longitude:
+    if latitude is None or longitude is None:
         return Listing.objects.none()
     
-    user_location = Point(longitude, latitude)
-    radius_degrees = radius / 100  # Convert km to degrees
-    
-    return Listing.objects.filter(
+    queryset = Listing.objects.filter(
         status='active',
-        is_active=True,
-        location__distance_lte=(user_location, radius_degrees)
-    ).annotate(
-        distance=Distance('location', user_location)
-    ).order_by('distance')[:limit]
+        is_active=True
+    ).with_list_data()
+    
+    return filter_within_radius(queryset, latitude, longitude, radius)[:limit]
 
 
-def get_trending_listings(days=7, limit=10):
-    """Get trending listings based on views and favorites."""
-    cutoff_date = timezone.now() - timedelta(days=days)
-    
-    return Listing.objects.filter(
+def get_trending_listings(limit=10, category_ids=None, days=None):
+    """Get trending listings from the precomputed scoreboard, best first."""
+    listing_ids = get_trending_listing_ids(limit=limit, category_ids=category_ids, days=days)
+    listings = Listing.objects.filter(
+        id__in=listing_ids,
         status='active',
-        is_active=True,
-        created_at__gte=cutoff_date
-    ).annotate(
-        recent_views=Count('view_logs', filter=Q(view_logs__viewed_at__gte=cutoff_date)),
-        recent_favorites=Count('favorited_by', filter=Q(favorited_by__created_at__gte=cutoff_date))
-    ).order_by('-recent_views', '-recent_favorites')[:limit]
+        is_active=True
+    ).with_list_data().in_bulk()
+    return [listings[listing_id] for listing_id in listing_ids if listing_id in listings]
 
 
 def get_featured_listings(limit=10):
@@ -43,19 +41,29 @@ def get_featured_listings(limit=10):
         status='active',
         is_active=True,
         is_featured=True
-    ).order_by('-created_at')[:limit]
+    ).with_list_data().order_by('-created_at')[:limit]
 
 
 def get_similar_listings(listing, limit=5):
-    """Get similar listings based on category and price range."""
-    price_range = listing.price * 0.3  # 30% price range
+    """Get the nearest listings from the similarity index, best first."""
+    # Over-fetch a little; rows changed since the last sync are filtered out below
+    listing_ids = get_similar_listing_ids(listing.id, limit=limit * 2)
+    if listing_ids is None:
+        # Listings that are not live yet, or any while the index loads, fall back to category and price range
+        price_range = listing.price * Decimal('0.3')
+        return Listing.objects.filter(
+            status='active',
+            is_active=True,
+            category=listing.category,
+            price__range=(listing.price - price_range, listing.price + price_range)
+        ).exclude(id=listing.id).with_list_data().order_by('-created_at')[:limit]
     
-    return Listing.objects.filter(
+    listings = Listing.objects.filter(
+        id__in=listing_ids,
         status='active',
-        is_active=True,
-        category=listing.category,
-        price__range=(listing.price - price_range, listing.price + price_range)
-    ).exclude(id=listing.id).order_by('-created_at')[:limit]
+        is_active=True
+    ).with_list_data().in_bulk()
+    return [listings[listing_id] for listing_id in listing_ids if listing_id in listings][:limit]
 
 
 def get_seller_listings(seller, exclude_listing=None, limit=10):
@@ -69,7 +77,7 @@ def get_seller_listings(seller, exclude_listing=None, limit=10):
     if exclude_listing:
         queryset = queryset.exclude(id=exclude_listing.id)
     
-    return queryset.order_by('-created_at')[:limit]
+    return queryset.with_list_data().order_by('-created_at')[:limit]
 
 
 def calculate_listing_stats(listing):
@@ -81,85 +89,28 @@ def calculate_listing_stats(listing):
         'similar_listings_count': 0,
     }
     
-    # Calculate average price in category
-    avg_price = Listing.objects.filter(
-        category=listing.category,
-        status='active',
-        is_active=True
-    ).aggregate(avg_price=Avg('price'))['avg_price']
-    
-    if avg_price:
-        stats['avg_price_in_category'] = float(avg_price)
-    
-    # Count similar listings
-    price_range = listing.price * 0.3
-    similar_count = Listing.objects.filter(
-        category=listing.category,
-        price__range=(listing.price - price_range, listing.price + price_range),
-        status='active',
-        is_active=True
-    ).exclude(id=listing.id).count()
-    
-    stats['similar_listings_count'] = similar_count
+    # The same shared category stats as the seller dashboard
+    if listing.category_id is not None:
+        price_stats = get_category_price_stats([listing.category_id])
+        stats['avg_price_in_category'], stats['similar_listings_count'] = estimate_price_stats(
+            price_stats.get(listing.category_id),
+            float(listing.price),
+            is_live=listing.status == 'active' and listing.is_active
+        )
     
     return stats
 
 
 def update_listing_views(listing, user=None, ip_address=None, user_agent=None):
-    """Update listing view count and create view log."""
-    listing.increment_views()
-    
-    # Create view log
-    ListingView.objects.create(
-        listing=listing,
+    """Buffer a listing view; counters and logs are written in batches."""
+    record_view(
+        listing,
         user=user,
         ip_address=ip_address,
         user_agent=user_agent
     )
 
 
-def get_listing_analytics(listing, days=30):
-    """Get analytics for a listing."""
-    cutoff_date = timezone.now() - timedelta(days=days)
-    
-    # Daily views
-    daily_views = ListingView.objects.filter(
-        listing=listing,
-        viewed_at__gte=cutoff_date
-    ).extra(
-        select={'day': 'date(viewed_at)'}
-    ).values('day').annotate(
-        count=Count('id')
-    ).order_by('day')
-    
-    # Views by location
-    location_views = ListingView.objects.filter(
-        listing=listing,
-        viewed_at__gte=cutoff_date
-    ).values('ip_address').annotate(
-        count=Count('id')
-    ).order_by('-count')[:10]
-    
-    # Referrer analysis (if available)
-    referrer_views = ListingView.objects.filter(
-        listing=listing,
-        viewed_at__gte=cutoff_date
-    ).values('user_agent').annotate(
-        count=Count('id')
-    ).order_by('-count')[:5]
-    
-    return {
-        'daily_views': list(daily_views),
-        'location_views': list(location_views),
-        'referrer_views': list(referrer_views),
-        'total_views_period': daily_views.count(),
-        'unique_visitors': ListingView.objects.filter(
-            listing=listing,
-            viewed_at__gte=cutoff_date
-        ).values('ip_address').distinct().count(),
-    }
-
-
 def search_listings_advanced(query, filters=None, user_location=None, limit=20):
     """Advanced search function for listings."""
     queryset = Listing.objects.filter(
@@ -169,14 +120,7 @@ def search_listings_advanced(query, filters=None, user_location=None, limit=20):
     
     # Text search
     if query:
-        queryset = queryset.filter(
-            Q(title__icontains=query) |
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query) |
-            Q(seller__username__icontains=query) |
-            Q(city__icontains=query) |
-            Q(state__icontains=query)
-        )
+        queryset = search_listings(query, queryset)
     
     # Apply filters
     if filters:
@@ -195,12 +139,15 @@ def search_listings_advanced(query, filters=None, user_location=None, limit=20):
         if 'is_featured' in filters:
             queryset = queryset.filter(is_featured=filters['is_featured'])
     
-    # Geo-based sorting
+    # Geo-based sorting, user_location is a (latitude, longitude) pair
     if user_location:
-        queryset = queryset.annotate(
-            distance=Distance('location', user_location)
+        queryset = queryset.filter(
+            latitude__isnull=False,
+            longitude__isnull=False
+        ).annotate(
+            distance=haversine_expression(*user_location)
         ).order_by('distance')
-    else:
+    elif not query:
         queryset = queryset.order_by('-created_at')
     
     return queryset[:limit]
@@ -208,29 +155,16 @@ def search_listings_advanced(query, filters=None, user_location=None, limit=20):
 
 def get_listing_recommendations(user, limit=10):
     """Get personalized listing recommendations for a user."""
-    if not user.is_authenticated:
-        return get_trending_listings(limit=limit)
-    
-    # Get user's favorite categories
-    favorite_categories = ListingFavorite.objects.filter(
-        user=user
-    ).values('listing__category').annotate(
-        count=Count('id')
-    ).order_by('-count')[:3]
-    
-    category_ids = [item['listing__category'] for item in favorite_categories]
-    
-    if category_ids:
-        # Get listings from favorite categories
-        recommendations = Listing.objects.filter(
-            category_id__in=category_ids,
+    listing_ids = get_recommended_listing_ids(user) if user.is_authenticated else None
+    if listing_ids:
+        # Favorites made since the last refresh are left out here
+        listings = Listing.objects.filter(
+            id__in=listing_ids[:limit * 2],
             status='active',
             is_active=True
-        ).exclude(
-            favorited_by=user
-        ).order_by('-created_at')[:limit]
-        
-        if recommendations.count() >= limit:
+        ).exclude(favorited_by__user=user).with_list_data().in_bulk()
+        recommendations = [listings[listing_id] for listing_id in listing_ids if listing_id in listings][:limit]
+        if recommendations:
             return recommendations
     
     # Fallback to trending listings
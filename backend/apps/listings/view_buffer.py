@@ -0,0 +1,279 @@
+"""
+Buffered ingestion of listing view events.
+
+Detail page hits are appended to a buffer instead of being written to the
+database straight away. The buffer is flushed in batches: view logs are
+inserted with a single ``bulk_create`` and view counters are bumped with
+atomic ``F()`` updates, one ``UPDATE`` per distinct increment.
+
+Flushes never run on the request path. A request that finds the buffer due
+starts a background flush, local buffers also flush themselves on a timer,
+and shared buffers can be drained by ``flush_listing_views``. Events of a
+failed flush are put back into the buffer for the next attempt, while
+views of listings deleted before the flush are dropped so they cannot
+fail every later flush.
+"""
+
+import atexit
+import json
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class BaseViewBuffer:
+    """Base class for view event buffers."""
+    
+    # Whether other processes, such as flush_listing_views, see the buffered events
+    shared = False
+    
+    def __init__(self, flush_size=500, flush_interval=5, **options):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.retry_at = 0
+        self.flush_lock = threading.Lock()
+    
+    def push(self, event):
+        """Append an event to the buffer."""
+        raise NotImplementedError
+    
+    def drain(self):
+        """Remove and return all buffered events."""
+        raise NotImplementedError
+    
+    def requeue(self, events):
+        """Put events that could not be written back at the front of the buffer."""
+        raise NotImplementedError
+    
+    def size(self):
+        """Return the number of buffered events."""
+        raise NotImplementedError
+    
+    def should_flush(self):
+        """Check whether the buffer reached its size or age threshold."""
+        now = time.monotonic()
+        if now < self.retry_at or self.flush_lock.locked():
+            return False
+        if self.size() >= self.flush_size:
+            return True
+        return now - self.last_flush >= self.flush_interval
+    
+    def flush(self):
+        """Write buffered events to the database.
+        
+        The events are put back into the buffer when the write fails.
+        """
+        self.last_flush = time.monotonic()
+        events = self.drain()
+        if events:
+            try:
+                write_view_events(events)
+            except Exception:
+                self.requeue(events)
+                # Back off instead of retrying on every request
+                self.retry_at = time.monotonic() + self.flush_interval
+                raise
+        return len(events)
+    
+    def flush_safely(self):
+        """Flush unless another thread is flushing, logging failures instead of raising."""
+        if not self.flush_lock.acquire(blocking=False):
+            return 0
+        try:
+            return self.flush()
+        except Exception:
+            logger.exception('Could not flush buffered listing views, they will be retried')
+            return 0
+        finally:
+            self.flush_lock.release()
+            # Flushes run in their own threads, which must not leak connections
+            connection.close()
+    
+    def flush_in_background(self):
+        """Flush from a worker thread so the request that found the buffer due is not delayed."""
+        threading.Thread(target=self.flush_safely, name='view-buffer-flush', daemon=True).start()
+
+
+class LocalViewBuffer(BaseViewBuffer):
+    """In-process buffer, used for tests and single-node deployments.
+    
+    Other processes cannot reach it, so it flushes itself on a timer.
+    """
+    
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._events = []
+        self._lock = threading.Lock()
+        self._timer = None
+    
+    def push(self, event):
+        with self._lock:
+            self._events.append(event)
+            if self._timer is None or not self._timer.is_alive():
+                self._timer = threading.Thread(target=self.flush_periodically, name='view-buffer-timer', daemon=True)
+                self._timer.start()
+    
+    def flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush_safely()
+            with self._lock:
+                # The next push starts a new timer
+                if not self._events:
+                    self._timer = None
+                    return
+    
+    def drain(self):
+        with self._lock:
+            events, self._events = self._events, []
+        return events
+    
+    def requeue(self, events):
+        with self._lock:
+            self._events[:0] = events
+    
+    def size(self):
+        return len(self._events)
+
+
+class RedisViewBuffer(BaseViewBuffer):
+    """Buffer backed by a Redis list, shared by all workers."""
+    
+    shared = True
+    
+    def __init__(self, url=None, key='listings:view_buffer', **options):
+        super().__init__(**options)
+        import redis
+        self.client = redis.Redis.from_url(url or settings.REDIS_URL)
+        self.key = key
+    
+    def encode(self, event):
+        return json.dumps(dict(event, viewed_at=event['viewed_at'].isoformat()))
+    
+    def push(self, event):
+        self.client.rpush(self.key, self.encode(event))
+    
+    def drain(self):
+        # Read and trim atomically so concurrent flushers never share events
+        pipe = self.client.pipeline()
+        pipe.lrange(self.key, 0, self.flush_size * 10 - 1)
+        pipe.ltrim(self.key, self.flush_size * 10, -1)
+        raw_events, _ = pipe.execute()
+        
+        events = []
+        for raw in raw_events:
+            event = json.loads(raw)
+            event['viewed_at'] = parse_datetime(event['viewed_at'])
+            events.append(event)
+        return events
+    
+    def requeue(self, events):
+        # LPUSH prepends one value at a time, so push the batch in reverse
+        self.client.lpush(self.key, *[self.encode(event) for event in reversed(events)])
+    
+    def size(self):
+        return self.client.llen(self.key)
+
+
+def write_view_events(events):
+    """Persist a batch of view events.
+    
+    Views of listings deleted since they were buffered are skipped. Returns
+    the number of views written.
+    """
+    from .models import Listing, ListingView
+    from .trending import record_activity, truncate_to_hour
+    from .view_store import encode_ip, intern_user_agents
+    
+    # Months without a partition yet land in the default one
+    user_agent_ids = intern_user_agents(event['user_agent'] for event in events)
+    
+    with transaction.atomic():
+        # Locked in id order so none is deleted before its activity buckets are written
+        live_ids = set(Listing.objects.select_for_update().filter(
+            id__in={event['listing_id'] for event in events}
+        ).order_by('id').values_list('id', flat=True))
+        live_events = [event for event in events if event['listing_id'] in live_ids]
+        if len(live_events) < len(events):
+            logger.info('Dropped %d buffered views of deleted listings', len(events) - len(live_events))
+        
+        increments = Counter(event['listing_id'] for event in live_events)
+        
+        # Group listings by increment so each distinct delta costs one UPDATE
+        listings_by_delta = defaultdict(list)
+        for listing_id, delta in increments.items():
+            listings_by_delta[delta].append(listing_id)
+        
+        ListingView.objects.bulk_create([
+            ListingView(
+                listing_id=event['listing_id'],
+                user_id=event['user_id'],
+                ip=encode_ip(event['ip_address']),
+                user_agent_id=user_agent_ids.get(event['user_agent']),
+                viewed_at=event['viewed_at'],
+            )
+            for event in live_events
+        ])
+        
+        for delta, listing_ids in listings_by_delta.items():
+            Listing.objects.filter(id__in=listing_ids).update(
+                views_count=F('views_count') + delta
+            )
+        
+        record_activity(views=Counter(
+            (event['listing_id'], truncate_to_hour(event['viewed_at'])) for event in live_events
+        ))
+    return len(live_events)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_view_buffer():
+    """Return the configured view buffer, creating it on first use."""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                options = dict(getattr(settings, 'LISTING_VIEW_BUFFER', {}))
+                backend = options.pop('BACKEND', 'apps.listings.view_buffer.LocalViewBuffer')
+                _buffer = import_string(backend)(
+                    flush_size=options.pop('FLUSH_SIZE', 500),
+                    flush_interval=options.pop('FLUSH_INTERVAL', 5),
+                    **{key.lower(): value for key, value in options.items()}
+                )
+                # Do not lose buffered views when the worker shuts down
+                atexit.register(_buffer.flush_safely)
+    return _buffer
+
+
+def record_view(listing, user=None, ip_address=None, user_agent=''):
+    """Buffer a view of a listing, starting a background flush when it is due."""
+    buffer = get_view_buffer()
+    buffer.push({
+        'listing_id': listing.id,
+        'user_id': user.id if user is not None else None,
+        'ip_address': ip_address,
+        'user_agent': user_agent or '',
+        'viewed_at': timezone.now(),
+    })
+    
+    if buffer.should_flush():
+        buffer.flush_in_background()
+
+
+def flush_views():
+    """Flush all buffered view events."""
+    return get_view_buffer().flush()
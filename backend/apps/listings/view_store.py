@@ -0,0 +1,260 @@
+"""
+Compact, time partitioned storage of listing view events.
+
+View events keep ids instead of text: user agents are interned into the
+``user_agents`` lookup table and IP addresses are stored as one integer.
+On PostgreSQL ``listing_view_events`` is range partitioned by month, so
+expiring old views drops whole partitions instead of deleting rows.
+Partitions are created ahead of time by ``rollup_listing_views``, never by
+writers; a default partition catches views outside the created months
+until their partition is created. Other databases keep a single table and
+expire whole months with batched deletes.
+"""
+
+import hashlib
+import ipaddress
+import threading
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import Min
+
+from .models import LegacyListingView, ListingView, UserAgent
+
+TABLE = ListingView._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+_user_agent_ids = {}
+_known_partitions = set()
+_lock = threading.Lock()
+
+
+def encode_ip(address):
+    """Pack an address into a signed 64-bit integer.
+    
+    IPv4 addresses keep their value. IPv6 addresses keep their /64 network,
+    which is what identifies a visitor behind rotating privacy addresses;
+    reserved prefixes aside they never overlap the IPv4 range.
+    """
+    if not address:
+        return None
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return None
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    if address.version == 4:
+        return int(address)
+    prefix = int(address) >> 64
+    return prefix - (1 << 64) if prefix >= 1 << 63 else prefix
+
+
+def decode_ip(value):
+    """Unpack an encoded address; IPv6 addresses come back as their /64 network."""
+    if value is None:
+        return None
+    if 0 <= value < 1 << 32:
+        return str(ipaddress.IPv4Address(value))
+    return str(ipaddress.IPv6Address((value % (1 << 64)) << 64))
+
+
+def intern_user_agents(values):
+    """Get ``{value: id}`` for user agent strings, adding unknown ones."""
+    ids = {}
+    missing = {}
+    for value in set(values):
+        if not value:
+            continue
+        if value in _user_agent_ids:
+            ids[value] = _user_agent_ids[value]
+        else:
+            missing[hashlib.md5(value.encode()).hexdigest()] = value
+    
+    if missing:
+        UserAgent.objects.bulk_create(
+            [UserAgent(digest=digest, value=value) for digest, value in missing.items()],
+            ignore_conflicts=True
+        )
+        interned = {
+            missing[digest]: user_agent_id
+            for digest, user_agent_id in UserAgent.objects.filter(digest__in=missing).values_list('digest', 'id')
+        }
+        ids.update(interned)
+        with _lock:
+            # User agents repeat heavily, a bounded cache spares most lookups
+            if len(_user_agent_ids) > 10000:
+                _user_agent_ids.clear()
+            _user_agent_ids.update(interned)
+    return ids
+
+
+def month_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def next_month(month):
+    if month.month == 12:
+        return month.replace(year=month.year + 1, month=1)
+    return month.replace(month=month.month + 1)
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month:%Y%m}'
+
+
+def is_partitioned():
+    return connection.vendor == 'postgresql'
+
+
+def get_partition_months():
+    """Get the months that have a partition, oldest first."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE parent.relname = %s',
+            [TABLE]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    prefix = f'{TABLE}_p'
+    return sorted(
+        datetime.strptime(name[len(prefix):], '%Y%m').replace(tzinfo=dt_timezone.utc)
+        for name in names if name.startswith(prefix)
+    )
+
+
+def create_partition(month):
+    """Create the partition of a month, moving its rows out of the default partition.
+    
+    Concurrent callers are serialized with an advisory lock, and whoever
+    comes second finds the partition made. Returns whether it was created.
+    """
+    name = connection.ops.quote_name(partition_name(month))
+    table = connection.ops.quote_name(TABLE)
+    default = connection.ops.quote_name(DEFAULT_PARTITION)
+    bounds = [month, next_month(month)]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [TABLE])
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [name])
+        if cursor.fetchone()[0]:
+            return False
+        cursor.execute(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {default} WHERE viewed_at >= %s AND viewed_at < %s RETURNING *) '
+            f'INSERT INTO {name} SELECT * FROM moved',
+            bounds
+        )
+        cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)', bounds)
+    return True
+
+
+def ensure_view_partitions(timestamps):
+    """Make sure the months of the given timestamps have partitions.
+    
+    Creating a partition takes locks on the whole table, so this belongs in
+    scheduled jobs and backfills rather than on the write path.
+    """
+    if not is_partitioned():
+        return
+    months = {month_start(value) for value in timestamps} - _known_partitions
+    if not months:
+        return
+    existing = set(get_partition_months())
+    for month in sorted(months - existing):
+        create_partition(month)
+    with _lock:
+        _known_partitions.update(months)
+
+
+def drop_view_partitions(before):
+    """Expire every whole month of views that ended before a point in time.
+    
+    Returns the number of months dropped.
+    """
+    cutoff = month_start(before)
+    if is_partitioned():
+        months = [month for month in get_partition_months() if month < cutoff]
+        with transaction.atomic(), connection.cursor() as cursor:
+            for month in months:
+                cursor.execute(f'DROP TABLE {connection.ops.quote_name(partition_name(month))}')
+            # Stragglers in the default partition expire with their month
+            cursor.execute(
+                f'DELETE FROM {connection.ops.quote_name(DEFAULT_PARTITION)} WHERE viewed_at < %s',
+                [cutoff]
+            )
+        with _lock:
+            _known_partitions.difference_update(months)
+        return len(months)
+    
+    oldest = ListingView.objects.aggregate(oldest=Min('viewed_at'))['oldest']
+    if oldest is None:
+        return 0
+    months = 0
+    month = month_start(oldest)
+    while month < cutoff:
+        end = next_month(month)
+        while True:
+            ids = list(ListingView.objects.filter(
+                viewed_at__gte=month,
+                viewed_at__lt=end
+            ).values_list('id', flat=True)[:5000])
+            if not ids:
+                break
+            ListingView.objects.filter(id__in=ids).delete()
+        months += 1
+        month = end
+    return months
+
+
+def move_legacy_views(batch_size=10000):
+    """Move the oldest batch of legacy view logs into the event store.
+    
+    Rows are deleted from the legacy table in the same transaction, so an
+    interrupted backfill resumes where it stopped. Returns the rows moved.
+    """
+    rows = list(LegacyListingView.objects.order_by('id').values_list(
+        'id', 'listing_id', 'user_id', 'ip_address', 'user_agent', 'viewed_at'
+    )[:batch_size])
+    if not rows:
+        return 0
+    
+    user_agent_ids = intern_user_agents(row[4] for row in rows)
+    ensure_view_partitions(row[5] for row in rows)
+    with transaction.atomic():
+        ListingView.objects.bulk_create(
+            [
+                ListingView(
+                    listing_id=listing_id,
+                    user_id=user_id,
+                    ip=encode_ip(ip_address),
+                    user_agent_id=user_agent_ids.get(user_agent),
+                    viewed_at=viewed_at
+                )
+                for _, listing_id, user_id, ip_address, user_agent, viewed_at in rows
+            ],
+            batch_size=1000
+        )
+        LegacyListingView.objects.filter(id__lte=rows[-1][0]).delete()
+    return len(rows)
+
+
+def get_table_size(table):
+    """Get the bytes used by a table, its partitions and its indexes."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT COALESCE(SUM(pg_total_relation_size(relid)), 0) FROM pg_partition_tree(%s)',
+                [table]
+            )
+        elif connection.vendor == 'sqlite':
+            cursor.execute(
+                'SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN '
+                '(SELECT name FROM sqlite_master WHERE tbl_name = %s)',
+                [table]
+            )
+        else:
+            return None
+        return cursor.fetchone()[0]
@@ -1,26 +1,34 @@
-from rest_framework import generics, permissions, status, filters
+from rest_framework import generics, permissions, serializers, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
-from django.contrib.gis.geos import Point
-from django.contrib.gis.db.models.functions import Distance
-from django.db.models import Q, Count
+from django.db import transaction
+from django.db.models import Count, Prefetch
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
+from apps.categories.index import get_category_index
+from marketplace.cache import CachedResponseMixin
+from marketplace.pagination import KeysetPagination
 
 from .models import Listing, ListingImage, ListingFavorite, ListingView, ListingReport
 from .serializers import (
     ListingSerializer, ListingDetailSerializer, ListingCreateSerializer,
     ListingUpdateSerializer, ListingImageSerializer, ListingFavoriteSerializer,
-    ListingReportSerializer, ListingSearchSerializer
+    ListingReportSerializer, ListingSearchSerializer, apply_favorites
 )
-from .filters import ListingFilter
+from .favorites import adjust_favorites_count, remove_favorite, set_favorite
+from .filters import ListingFilter, ListingOrderingFilter
 from .utils import (
     get_nearby_listings, get_trending_listings, get_featured_listings,
     get_similar_listings, get_seller_listings, calculate_listing_stats,
-    get_listing_analytics, get_listing_recommendations
+    get_listing_recommendations
 )
+from .analytics import get_listing_analytics
+from .dashboard import get_seller_dashboard
+from .geo import filter_within_radius
+from .search import search_listings
+from .view_buffer import record_view
 
 
 class ListingListView(generics.ListAPIView):
@@ -28,31 +36,20 @@ class ListingListView(generics.ListAPIView):
     
     serializer_class = ListingSerializer
     permission_classes = [permissions.AllowAny]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, ListingOrderingFilter]
     filterset_class = ListingFilter
-    search_fields = ['title', 'description', 'city', 'state', 'country']
-    ordering_fields = ['price', 'created_at', 'views_count', 'favorites_count']
+    # Sorting by distance needs latitude and longitude, it is ignored without them
+    ordering_fields = ['price', 'created_at', 'views_count', 'favorites_count', 'distance']
     ordering = ['-created_at']
     
     def get_queryset(self):
         queryset = Listing.objects.filter(
             status='active',
             is_active=True
-        ).select_related('seller', 'category').prefetch_related('images')
-        
-        # Geo-based filtering
-        latitude = self.request.query_params.get('latitude')
-        longitude = self.request.query_params.get('longitude')
-        radius = float(self.request.query_params.get('radius', 50))  # km
-        
-        if latitude and longitude:
-            user_location = Point(float(longitude), float(latitude))
-            queryset = queryset.filter(
-                location__distance_lte=(user_location, radius / 100)  # Convert km to degrees
-            ).annotate(
-                distance=Distance('location', user_location)
-            ).order_by('distance')
+        ).with_list_data()
         
+        # Radius filtering is handled by ListingFilter.geo_filter
         return queryset
 
 
@@ -61,25 +58,25 @@ class ListingDetailView(generics.RetrieveAPIView):
     
     serializer_class = ListingDetailSerializer
     permission_classes = [permissions.AllowAny]
-    queryset = Listing.objects.select_related('seller', 'category').prefetch_related('images')
+    queryset = Listing.objects.select_related('seller', 'category').prefetch_related(
+        'images', 'seller__verifications'
+    )
     lookup_field = "id"
     lookup_url_kwarg = "listing_id"
     
     def retrieve(self, request, *args, **kwargs):
         listing = self.get_object()
         
-        # Increment view count
-        listing.increment_views()
-        
-        # Log view
-        ListingView.objects.create(
-            listing=listing,
+        # Buffer the view; counters and logs are written in batches
+        record_view(
+            listing,
             user=request.user if request.user.is_authenticated else None,
             ip_address=self.get_client_ip(request),
             user_agent=request.META.get('HTTP_USER_AGENT', '')
         )
         
-        return super().retrieve(request, *args, **kwargs)
+        serializer = self.get_serializer(listing)
+        return Response(serializer.data)
     
     def get_client_ip(self, request):
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -130,6 +127,22 @@ class ListingDeleteView(generics.DestroyAPIView):
         instance.save()
 
 
+class ListingSearchPagination(KeysetPagination):
+    """Keyset pagination reading the cursor and page size from the search body."""
+    
+    count_mode = 'approximate'
+    
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.data.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+    
+    def get_cursor_value(self, request):
+        return request.data.get(self.cursor_query_param)
+
+
 class ListingSearchView(APIView):
     """Advanced search view for listings."""
     
@@ -143,17 +156,11 @@ class ListingSearchView(APIView):
             queryset = Listing.objects.filter(
                 status='active',
                 is_active=True
-            ).select_related('seller', 'category').prefetch_related('images')
+            ).with_list_data()
             
             # Text search
             if params.get('query'):
-                query = params['query']
-                queryset = queryset.filter(
-                    Q(title__icontains=query) |
-                    Q(description__icontains=query) |
-                    Q(city__icontains=query) |
-                    Q(state__icontains=query)
-                )
+                queryset = search_listings(params['query'], queryset)
             
             # Category filter
             if params.get('category'):
@@ -170,45 +177,43 @@ class ListingSearchView(APIView):
                 queryset = queryset.filter(condition=params['condition'])
             
             # Geo-based search
-            if params.get('latitude') and params.get('longitude'):
-                user_location = Point(params['longitude'], params['latitude'])
-                radius = params.get('radius', 50) / 100  # Convert km to degrees
-                queryset = queryset.filter(
-                    location__distance_lte=(user_location, radius)
-                ).annotate(
-                    distance=Distance('location', user_location)
+            if params.get('latitude') is not None and params.get('longitude') is not None:
+                queryset = filter_within_radius(
+                    queryset,
+                    params['latitude'],
+                    params['longitude'],
+                    params.get('radius', 50)
                 )
             
             # Sorting
             sort_by = params.get('sort_by', 'created_at')
             sort_order = params.get('sort_order', 'desc')
             
+            if sort_by == 'relevance' and params.get('query'):
+                sort_by = 'search_rank'
+            
             if sort_order == 'desc':
                 sort_by = f'-{sort_by}'
             
-            if params.get('latitude') and params.get('longitude'):
+            if params.get('latitude') is not None and params.get('longitude') is not None:
                 # If geo search is active, sort by distance first
                 queryset = queryset.order_by('distance', sort_by)
             else:
                 queryset = queryset.order_by(sort_by)
             
             # Pagination
-            page = params.get('page', 1)
-            page_size = params.get('page_size', 20)
-            start = (page - 1) * page_size
-            end = start + page_size
-            
-            total_count = queryset.count()
-            listings = queryset[start:end]
+            paginator = ListingSearchPagination()
+            listings = paginator.paginate_queryset(queryset, request, view=self)
             
             serializer = ListingSerializer(listings, many=True, context={'request': request})
             
             return Response({
                 'results': serializer.data,
-                'total_count': total_count,
-                'page': page,
-                'page_size': page_size,
-                'total_pages': (total_count + page_size - 1) // page_size
+                'total_count': paginator.count,
+                'total_count_is_approximate': paginator.count_is_approximate,
+                'page_size': paginator.page_size,
+                'next_cursor': paginator.next_cursor,
+                'previous_cursor': paginator.previous_cursor
             })
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -221,12 +226,9 @@ class ListingFavoriteView(generics.CreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
-        
-        # Update favorites count
-        listing = serializer.instance.listing
-        listing.favorites_count = listing.favorited_by.count()
-        listing.save(update_fields=['favorites_count'])
+        with transaction.atomic():
+            serializer.save(user=self.request.user)
+            adjust_favorites_count(serializer.instance.listing_id, 1)
 
 
 class ListingUnfavoriteView(generics.DestroyAPIView):
@@ -239,12 +241,7 @@ class ListingUnfavoriteView(generics.DestroyAPIView):
         return ListingFavorite.objects.filter(user=self.request.user)
     
     def perform_destroy(self, instance):
-        listing = instance.listing
-        instance.delete()
-        
-        # Update favorites count
-        listing.favorites_count = listing.favorited_by.count()
-        listing.save(update_fields=['favorites_count'])
+        remove_favorite(self.request.user, instance.listing_id)
 
 
 class UserFavoritesView(generics.ListAPIView):
@@ -254,7 +251,11 @@ class UserFavoritesView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        return ListingFavorite.objects.filter(user=self.request.user)
+        return ListingFavorite.objects.filter(
+            user=self.request.user
+        ).prefetch_related(
+            Prefetch('listing', queryset=Listing.objects.with_list_data())
+        )
 
 
 class UserListingsView(generics.ListAPIView):
@@ -266,7 +267,7 @@ class UserListingsView(generics.ListAPIView):
     def get_queryset(self):
         return Listing.objects.filter(
             seller=self.request.user
-        ).select_related('category').prefetch_related('images')
+        ).with_list_data()
 
 
 class ListingReportView(generics.CreateAPIView):
@@ -310,54 +311,79 @@ class ListingImageDeleteView(generics.DestroyAPIView):
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def toggle_favorite(request, listing_id):
-    """Toggle favorite status for a listing."""
-    try:
-        listing = Listing.objects.get(id=listing_id, status='active', is_active=True)
-        favorite, created = ListingFavorite.objects.get_or_create(
-            user=request.user,
-            listing=listing
-        )
-        
-        if not created:
-            favorite.delete()
-            is_favorited = False
-        else:
-            is_favorited = True
-        
-        # Update favorites count
-        listing.favorites_count = listing.favorited_by.count()
-        listing.save(update_fields=['favorites_count'])
-        
-        return Response({
-            'is_favorited': is_favorited,
-            'favorites_count': listing.favorites_count
-        })
-    
-    except Listing.DoesNotExist:
+    """Toggle favorite status for a listing, or set it with ``favorited``."""
+    favorited = request.data.get('favorited')
+    if favorited is not None:
+        try:
+            favorited = serializers.BooleanField().to_internal_value(favorited)
+        except serializers.ValidationError:
+            return Response(
+                {'error': 'favorited must be true or false'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    
+    if not Listing.objects.filter(id=listing_id, status='active', is_active=True).exists():
         return Response(
             {'error': 'Listing not found'},
             status=status.HTTP_404_NOT_FOUND
         )
+    
+    is_favorited, favorites_count = set_favorite(request.user, listing_id, favorited)
+    return Response({
+        'is_favorited': is_favorited,
+        'favorites_count': favorites_count
+    })
 
 
 # Additional listing views
-class TrendingListingsView(generics.ListAPIView):
+class SharedListingCacheMixin(CachedResponseMixin):
+    """Cache listing payloads once for everyone and add favorites per request."""
+    
+    cache_tags = ('listings', 'categories', 'users')
+    
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['shared'] = True
+        return context
+    
+    def personalize(self, request, data):
+        items = data['results'] if isinstance(data, dict) else data
+        apply_favorites(request, items)
+        return data
+
+
+class TrendingListingsView(SharedListingCacheMixin, generics.ListAPIView):
     """View for trending listings."""
     
     serializer_class = ListingSerializer
     permission_classes = [permissions.AllowAny]
+    cache_name = 'trending_listings'
     
     def get_queryset(self):
-        days = int(self.request.query_params.get('days', 7))
         limit = int(self.request.query_params.get('limit', 10))
-        return get_trending_listings(days=days, limit=limit)
-
-
-class FeaturedListingsView(generics.ListAPIView):
+        days = self.request.query_params.get('days')
+        days = int(days) if days else None
+        category_ids = None
+        category_slug = self.request.query_params.get('category')
+        if category_slug:
+            # Rank within the category and everything below it
+            index = get_category_index()
+            category = next(
+                (category for category in index.by_id.values() if category.slug == category_slug),
+                None
+            )
+            if category is None:
+                return []
+            category_ids = index.descendant_ids(category.id)
+        return get_trending_listings(limit=limit, category_ids=category_ids, days=days)
+
+
+class FeaturedListingsView(SharedListingCacheMixin, generics.ListAPIView):
     """View for featured listings."""
     
     serializer_class = ListingSerializer
     permission_classes = [permissions.AllowAny]
+    cache_name = 'featured_listings'
     
     def get_queryset(self):
         limit = int(self.request.query_params.get('limit', 10))
@@ -371,6 +397,9 @@ class NearbyListingsView(generics.ListAPIView):
     permission_classes = [permissions.AllowAny]
     
     def get_queryset(self):
+        if 'latitude' not in self.request.query_params or 'longitude' not in self.request.query_params:
+            return Listing.objects.none()
+        
         latitude = float(self.request.query_params.get('latitude'))
         longitude = float(self.request.query_params.get('longitude'))
         radius = float(self.request.query_params.get('radius', 50))
@@ -466,4 +495,13 @@ def listing_analytics(request, listing_id):
     
     days = int(request.query_params.get('days', 30))
     analytics = get_listing_analytics(listing=listing, days=days)
-    return Response(analytics) 
\ No newline at end of file
+    return Response(analytics)
+
+
+class SellerDashboardView(APIView):
+    """Stats and analytics of every listing of the requesting seller."""
+    
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        return Response(get_seller_dashboard(request.user.id))
@@ -184,6 +184,9 @@ class Transaction(models.Model):
     class Meta:
         db_table = 'transactions'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+        ]
     
     def __str__(self):
         return f"{self.transaction_type} - {self.amount} {self.currency}"
@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from apps.listings.dashboard import invalidate_seller_dashboard
+from .models import Payment
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def payment_changed(sender, instance, **kwargs):
+    """Drop the cached dashboard of the seller, whose sales and revenue changed."""
+    seller_id = instance.seller_id
+    transaction.on_commit(lambda: invalidate_seller_dashboard(seller_id))
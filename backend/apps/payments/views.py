@@ -5,6 +5,7 @@ from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
 from django.conf import settings
 import stripe
+from marketplace.pagination import KeysetPagination
 
 from .models import Payment, PaymentMethod, Refund, Transaction, Payout
 from .serializers import (
@@ -173,6 +174,7 @@ class TransactionListView(generics.ListAPIView):
     
     serializer_class = TransactionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
         return Transaction.objects.filter(
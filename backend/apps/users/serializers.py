@@ -83,6 +83,19 @@ class UserProfileSerializer(serializers.ModelSerializer):
         return status
 
 
+class UserSummarySerializer(serializers.ModelSerializer):
+    """Lightweight user representation for lists, served without extra queries."""
+    
+    class Meta:
+        model = User
+        fields = [
+            'id', 'username', 'first_name', 'last_name', 'avatar',
+            'city', 'state', 'country', 'email_verified', 'phone_verified',
+            'is_seller'
+        ]
+        read_only_fields = fields
+
+
 class UserUpdateSerializer(serializers.ModelSerializer):
     """Serializer for updating user profile."""
     
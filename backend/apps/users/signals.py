@@ -0,0 +1,20 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from marketplace.cache import invalidate_tags
+from .models import User
+from .serializers import UserSummarySerializer
+
+# Fields embedded in cached payloads of other apps
+SUMMARY_FIELDS = set(UserSummarySerializer.Meta.fields)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, update_fields=None, **kwargs):
+    """Drop cached payloads embedding user summaries."""
+    # Saves that only touch other fields, such as last_login, keep the caches
+    if update_fields is not None and not SUMMARY_FIELDS.intersection(update_fields):
+        return
+    transaction.on_commit(lambda: invalidate_tags('users'))
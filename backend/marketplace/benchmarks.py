@@ -0,0 +1,37 @@
+"""
+Scratch databases for the benchmark management commands.
+
+Benchmarks create many thousands of synthetic rows, so they never touch
+the configured database. They run against a freshly migrated copy created
+the way the test runner creates its database and destroyed afterwards.
+"""
+
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def scratch_database(verbosity=0):
+    """Run the block against a throwaway test database."""
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_test_name = test_settings.get('NAME')
+    if connection.vendor == 'sqlite':
+        # A file rather than shared memory, so background threads do not hit table locks
+        handle, test_settings['NAME'] = tempfile.mkstemp(prefix='benchmark-', suffix='.sqlite3')
+        os.close(handle)
+    
+    setup_test_environment()
+    try:
+        connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+    finally:
+        teardown_test_environment()
+        test_settings['NAME'] = old_test_name
@@ -0,0 +1,163 @@
+"""
+Cache-aside helpers with versioned keys and tag based invalidation.
+
+Every cached value is stored under a key that embeds the current version of
+each tag it depends on. Invalidating a tag bumps its version, so entries
+built from stale data are never read again and simply age out of the cache.
+Hit and miss counters are kept per cache name in the cache itself, so they
+cover every worker. Both only work across workers with a shared cache
+backend; ``warn_if_cache_not_shared`` flags a process-local one.
+"""
+
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+TAG_VERSION_PREFIX = 'cache:tag:'
+METRICS_PREFIX = 'cache:metrics:'
+DEFAULT_TIMEOUT = 300
+
+MISSING = object()
+
+
+def warn_if_cache_not_shared():
+    """Warn when several workers would each keep their own tag versions."""
+    workers = getattr(settings, 'WEB_CONCURRENCY', 1)
+    if workers > 1 and isinstance(caches['default'], LocMemCache):
+        logger.warning(
+            'The default cache is local to each process but %d workers are configured; '
+            'cached responses will outlive invalidations made by other workers', workers
+        )
+        return True
+    return False
+
+
+def new_tag_version():
+    # Time based, so a version lost to eviction never repeats an older one
+    return time.time_ns() // 1000
+
+
+def get_tag_versions(tags):
+    """Get the current version of each tag, initializing unknown tags."""
+    keys = [f'{TAG_VERSION_PREFIX}{tag}' for tag in tags]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = new_tag_version()
+            if not cache.add(key, version, timeout=None):
+                version = cache.get(key, version)
+            versions[key] = version
+    return [versions[key] for key in keys]
+
+
+def invalidate_tags(*tags):
+    """Bump tag versions so every entry depending on them is skipped."""
+    for tag in tags:
+        key = f'{TAG_VERSION_PREFIX}{tag}'
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_tag_version(), timeout=None)
+
+
+def get_timeout(name):
+    return getattr(settings, 'API_CACHE_TIMEOUTS', {}).get(name, DEFAULT_TIMEOUT)
+
+
+def make_cache_key(name, tags=(), params=None):
+    """Build a key from a cache name, request parameters and tag versions."""
+    digest = ''
+    if params:
+        encoded = '&'.join(f'{key}={params[key]}' for key in sorted(params))
+        digest = hashlib.md5(encoded.encode()).hexdigest()
+    versions = '.'.join(str(version) for version in get_tag_versions(tags))
+    return f'cache:{name}:{digest}:{versions}'
+
+
+def record_metric(name, outcome):
+    key = f'{METRICS_PREFIX}{name}:{outcome}'
+    if cache.add(key, 1, timeout=None):
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def get_cache_metrics(names=None):
+    """Get hit and miss counts for each cache name."""
+    if names is None:
+        names = list(getattr(settings, 'API_CACHE_TIMEOUTS', {}))
+    keys = [f'{METRICS_PREFIX}{name}:{outcome}' for name in names for outcome in ('hit', 'miss')]
+    counts = cache.get_many(keys)
+    return {
+        name: {
+            'hits': counts.get(f'{METRICS_PREFIX}{name}:hit', 0),
+            'misses': counts.get(f'{METRICS_PREFIX}{name}:miss', 0),
+        }
+        for name in names
+    }
+
+
+def reset_cache_metrics(names=None):
+    if names is None:
+        names = list(getattr(settings, 'API_CACHE_TIMEOUTS', {}))
+    cache.delete_many([f'{METRICS_PREFIX}{name}:{outcome}' for name in names for outcome in ('hit', 'miss')])
+
+
+def cache_get(name, key):
+    """Read a cached value and count the hit or miss."""
+    value = cache.get(key, MISSING)
+    record_metric(name, 'miss' if value is MISSING else 'hit')
+    return value
+
+
+def get_or_compute(name, producer, tags=(), params=None, timeout=None):
+    """Return a cached value, computing and storing it on a miss."""
+    key = make_cache_key(name, tags, params)
+    value = cache_get(name, key)
+    if value is MISSING:
+        value = producer()
+        cache.set(key, value, get_timeout(name) if timeout is None else timeout)
+    return value
+
+
+class CachedResponseMixin:
+    """Serve successful GET responses of a view from the cache.
+    
+    Views set ``cache_name`` and ``cache_tags``. Responses are keyed on the
+    URL arguments and query parameters, so payloads must not depend on the
+    requesting user; views can fill in per-user fields in ``personalize``.
+    """
+    
+    cache_name = None
+    cache_tags = ()
+    
+    def get_cache_params(self, request):
+        return {**self.kwargs, **request.query_params.dict()}
+    
+    def personalize(self, request, data):
+        """Adjust a shared payload for the requesting user."""
+        return data
+    
+    def get(self, request, *args, **kwargs):
+        key = make_cache_key(self.cache_name, self.cache_tags, self.get_cache_params(request))
+        data = cache_get(self.cache_name, key)
+        if data is not MISSING:
+            response = Response(self.personalize(request, data))
+            response['X-Cache'] = 'HIT'
+            return response
+        
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, get_timeout(self.cache_name))
+            response.data = self.personalize(request, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,309 @@
+"""
+Background image pipeline for uploaded photos.
+
+Saving a row with a new image schedules it once the transaction commits,
+so upload requests return straight away. A dispatcher thread reads the
+original and hands the bytes to a pool of worker processes, which apply
+the EXIF orientation, strip metadata, render every variant as WebP and
+JPEG and compute a blurhash placeholder with Pillow. The dispatcher then
+stores the files, points the row at a stripped copy of the original and
+records variant paths and the placeholder on it. Replaced files are only
+deleted once that change commits. Rows whose image changed while they
+were processed are left for the newer run.
+"""
+
+import logging
+import math
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+
+import numpy as np
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+VARIANTS = {
+    'thumb': (200, 200),
+    'card': (600, 600),
+    'full': (1600, 1600),
+}
+FORMATS = {
+    'webp': 'WEBP',
+    'jpeg': 'JPEG',
+}
+# Originals in these formats are re-encoded without their metadata
+STRIPPED_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+
+def get_pipeline_settings():
+    options = {
+        'ASYNC': True,
+        'PROCESSES': 2,
+        'QUALITY': 82,
+    }
+    options.update(getattr(settings, 'IMAGE_PIPELINE', {}))
+    return options
+
+
+def encode_base83(value, length):
+    return ''.join(BASE83[value // 83 ** (length - position - 1) % 83] for position in range(length))
+
+
+def srgb_to_linear(values):
+    values = values / 255
+    return np.where(values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4)
+
+
+def linear_to_srgb(value):
+    value = min(max(value, 0), 1)
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def encode_blurhash(image, x_components=4, y_components=3):
+    """Encode a small RGB image as a blurhash string."""
+    pixels = srgb_to_linear(np.asarray(image, dtype=np.float64))
+    height, width = pixels.shape[:2]
+    factors = []
+    for y in range(y_components):
+        for x in range(x_components):
+            basis = np.outer(
+                np.cos(np.pi * y * np.arange(height) / height),
+                np.cos(np.pi * x * np.arange(width) / width)
+            )
+            normalisation = 1 if x == y == 0 else 2
+            factors.append(normalisation * (pixels * basis[:, :, None]).sum(axis=(0, 1)) / (width * height))
+    
+    dc, ac = factors[0], factors[1:]
+    blurhash = encode_base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised = max(0, min(82, math.floor(max(float(np.abs(factor).max()) for factor in ac) * 166 - 0.5)))
+        maximum = (quantised + 1) / 166
+        blurhash += encode_base83(quantised, 1)
+    else:
+        maximum = 1
+        blurhash += encode_base83(0, 1)
+    
+    red, green, blue = (linear_to_srgb(value) for value in dc)
+    blurhash += encode_base83((red << 16) + (green << 8) + blue, 4)
+    for factor in ac:
+        red, green, blue = (
+            max(0, min(18, math.floor(math.copysign(abs(value / maximum) ** 0.5, value) * 9 + 9.5)))
+            for value in factor
+        )
+        blurhash += encode_base83(red * 19 * 19 + green * 19 + blue, 2)
+    return blurhash
+
+
+def render_image(data, quality=82):
+    """Render variants, a stripped original and a blurhash from image bytes.
+    
+    Runs in worker processes, so it only touches Pillow and NumPy.
+    """
+    with Image.open(BytesIO(data)) as source:
+        source_format = source.format
+        # Apply the orientation before the EXIF block holding it is dropped
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ('RGB', 'RGBA', 'L'):
+            has_alpha = image.mode in ('P', 'LA', 'PA') or 'A' in image.getbands()
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        
+        original = None
+        if source_format in STRIPPED_FORMATS:
+            buffer = BytesIO()
+            options = {'quality': 95} if source_format != 'PNG' else {'optimize': True}
+            image.save(buffer, format=source_format, **options)
+            original = buffer.getvalue()
+        
+        # Flatten transparency onto white, JPEG has no alpha channel
+        if image.mode != 'RGB':
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A') if image.mode == 'RGBA' else None)
+            image = background
+        
+        variants = {}
+        for name, size in VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail(size, Image.LANCZOS)
+            variant = {'width': resized.width, 'height': resized.height}
+            for extension, image_format in FORMATS.items():
+                buffer = BytesIO()
+                resized.save(buffer, format=image_format, quality=quality, optimize=True)
+                variant[extension] = buffer.getvalue()
+            variants[name] = variant
+        
+        placeholder = image.copy()
+        placeholder.thumbnail((32, 32))
+        return {
+            'original': original,
+            'width': image.width,
+            'height': image.height,
+            'variants': variants,
+            'blurhash': encode_blurhash(placeholder),
+        }
+
+
+_pool = None
+_dispatcher = None
+_pool_lock = threading.Lock()
+
+
+def get_executors():
+    """Return the worker process pool and the dispatcher threads feeding it."""
+    global _pool, _dispatcher
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                processes = get_pipeline_settings()['PROCESSES']
+                _dispatcher = ThreadPoolExecutor(max_workers=processes, thread_name_prefix='image-pipeline')
+                # Workers start fresh, forking a threaded server process is unsafe
+                start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                _pool = ProcessPoolExecutor(
+                    max_workers=processes,
+                    mp_context=multiprocessing.get_context(start_method)
+                )
+    return _pool, _dispatcher
+
+
+def get_variant_urls(storage, variants, request=None):
+    """Turn the variant paths recorded on a row into URLs."""
+    build_url = request.build_absolute_uri if request is not None else str
+    return {
+        name: {
+            'width': variant['width'],
+            'height': variant['height'],
+            **{extension: build_url(storage.url(variant[extension])) for extension in FORMATS},
+        }
+        for name, variant in (variants or {}).items()
+        if name in VARIANTS
+    }
+
+
+def variant_name(source_name, variant, extension):
+    path = PurePosixPath(source_name)
+    return str(path.parent / 'variants' / f'{path.stem}_{variant}.{extension}')
+
+
+def stripped_name(source_name):
+    path = PurePosixPath(source_name)
+    return str(path.parent / f'{path.stem}_stripped{path.suffix}')
+
+
+def delete_variant_files(storage, variants):
+    for name, variant in variants.items():
+        if name in VARIANTS:
+            for extension in FORMATS:
+                if variant.get(extension):
+                    storage.delete(variant[extension])
+
+
+def process_image(model_label, pk, field_name='image', variants_field='variants', blurhash_field='blurhash'):
+    """Render and store the variants of one row's image."""
+    model = apps.get_model(model_label)
+    instance = model.objects.filter(pk=pk).first()
+    field_file = getattr(instance, field_name, None) if instance else None
+    if not field_file:
+        return False
+    source_name = field_file.name
+    storage = field_file.storage
+    
+    with storage.open(source_name, 'rb') as handle:
+        data = handle.read()
+    options = get_pipeline_settings()
+    try:
+        if options['ASYNC']:
+            result = get_executors()[0].submit(render_image, data, options['QUALITY']).result()
+        else:
+            result = render_image(data, options['QUALITY'])
+    except Exception:
+        logger.exception('Could not process image %s', source_name)
+        # Remember the failure so the row is not picked up again
+        model.objects.filter(pk=pk, **{field_name: source_name}).update(
+            **{variants_field: {'source': source_name, 'failed': True}}
+        )
+        return False
+    
+    variants = {'source': source_name, 'width': result['width'], 'height': result['height']}
+    for name, rendered in result['variants'].items():
+        variants[name] = {'width': rendered['width'], 'height': rendered['height']}
+        for extension in FORMATS:
+            variants[name][extension] = storage.save(
+                variant_name(source_name, name, extension),
+                ContentFile(rendered[extension])
+            )
+    
+    stored_name = None
+    if result['original'] is not None:
+        # Stored beside the original, which the row keeps pointing at until it commits
+        stored_name = storage.save(stripped_name(source_name), ContentFile(result['original']))
+        variants['source'] = stored_name
+    
+    def delete_rendered_files():
+        delete_variant_files(storage, variants)
+        if stored_name is not None:
+            storage.delete(stored_name)
+    
+    try:
+        with transaction.atomic():
+            instance = model.objects.select_for_update().filter(pk=pk).first()
+            if instance is None or getattr(instance, field_name).name != source_name:
+                # Deleted or replaced meanwhile; the newer image is processed on its own
+                transaction.on_commit(delete_rendered_files)
+                return False
+            
+            previous = getattr(instance, variants_field) or {}
+            if stored_name is not None:
+                getattr(instance, field_name).name = stored_name
+            setattr(instance, variants_field, variants)
+            setattr(instance, blurhash_field, result['blurhash'])
+            instance.save(update_fields=[field_name, variants_field, blurhash_field])
+            
+            def delete_replaced_files():
+                # New files never reuse old names, so earlier variants are always stale
+                delete_variant_files(storage, previous)
+                if stored_name is not None:
+                    storage.delete(source_name)
+            
+            transaction.on_commit(delete_replaced_files)
+    except Exception:
+        delete_rendered_files()
+        raise
+    return True
+
+
+def run_process_image(*args):
+    close_old_connections()
+    try:
+        return process_image(*args)
+    except Exception:
+        logger.exception('Image pipeline failed for %s %s', args[0], args[1])
+        return False
+    finally:
+        close_old_connections()
+
+
+def needs_processing(instance, field_name='image', variants_field='variants'):
+    field_file = getattr(instance, field_name)
+    variants = getattr(instance, variants_field) or {}
+    return bool(field_file) and variants.get('source') != field_file.name
+
+
+def schedule_image_processing(instance, field_name='image', variants_field='variants', blurhash_field='blurhash'):
+    """Process a row's image in the background once the transaction commits."""
+    if not needs_processing(instance, field_name, variants_field):
+        return
+    args = (instance._meta.label, instance.pk, field_name, variants_field, blurhash_field)
+    if get_pipeline_settings()['ASYNC']:
+        transaction.on_commit(lambda: get_executors()[1].submit(run_process_image, *args))
+    else:
+        transaction.on_commit(lambda: process_image(*args))
@@ -0,0 +1,251 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are addressed by the ordering values of the last row seen instead of
+an offset, so fetching any page costs one index range scan no matter how
+deep it is. The queryset ordering is used as the key and ``id`` is always
+appended as a tiebreaker, e.g. ``(created_at, id)`` or ``(distance, id)``.
+Ordering fields are model fields or annotations. Nullable fields sort their
+nulls after every value in either direction, so a page boundary on a null is
+still well defined on every database.
+"""
+
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import connections
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination keyed on the queryset ordering plus ``id``."""
+    
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    
+    # Used when the queryset is not ordered
+    ordering = ('-created_at',)
+    
+    # None skips counting, 'exact' runs COUNT(*), 'approximate' is cheap but bounded
+    count_mode = None
+    count_query_param = 'count'
+    approximate_count_limit = 1000
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        
+        self.count = None
+        self.count_is_approximate = False
+        count_mode = request.query_params.get(self.count_query_param, self.count_mode)
+        if count_mode == 'exact':
+            self.count = queryset.count()
+        elif count_mode == 'approximate':
+            self.count, self.count_is_approximate = self.get_approximate_count(queryset)
+        
+        self.nullable_fields = self.get_nullable_fields(queryset, self.ordering)
+        cursor = self.decode_cursor(self.get_cursor_value(request))
+        reverse = cursor is not None and cursor['reverse']
+        ordering = [self.invert(field) for field in self.ordering] if reverse else self.ordering
+        
+        # Walking backwards meets the nulls first
+        queryset = queryset.order_by(*self.order_expressions(ordering, nulls_first=reverse))
+        if cursor is not None:
+            queryset = queryset.filter(self.keyset_filter(ordering, cursor['values'], self.nullable_fields, reverse))
+        
+        # Fetch one extra row to know whether another page follows
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+        
+        if reverse:
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+        
+        self.next_cursor = None
+        self.previous_cursor = None
+        if results and self.has_next:
+            self.next_cursor = self.encode_cursor(results[-1], reverse=False)
+        if results and self.has_previous:
+            self.previous_cursor = self.encode_cursor(results[0], reverse=True)
+        
+        return results
+    
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                page_size = int(request.query_params[self.page_size_query_param])
+                if page_size > 0:
+                    return min(page_size, self.max_page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+    
+    def get_cursor_value(self, request):
+        return request.query_params.get(self.cursor_query_param)
+    
+    def get_ordering(self, queryset):
+        """Get the key fields from the queryset ordering, ending with ``id``."""
+        ordering = list(queryset.query.order_by) or list(queryset.query.get_meta().ordering)
+        if not ordering or not all(isinstance(field, str) for field in ordering):
+            ordering = list(self.ordering)
+        
+        ordering = [field for field in ordering if field.lstrip('-') not in ('id', 'pk')]
+        # The tiebreaker follows the direction of the primary sort
+        tiebreaker = '-id' if ordering and ordering[0].startswith('-') else 'id'
+        return ordering + [tiebreaker]
+    
+    @staticmethod
+    def get_nullable_fields(queryset, ordering):
+        """Get the key fields that may hold NULL."""
+        nullable = set()
+        for field in ordering:
+            name = field.lstrip('-')
+            if name in queryset.query.annotations:
+                continue
+            try:
+                if queryset.model._meta.get_field(name).null:
+                    nullable.add(name)
+            except FieldDoesNotExist:
+                # Lookups across relations may be null through the join
+                nullable.add(name)
+        return nullable
+    
+    def order_expressions(self, ordering, nulls_first):
+        expressions = []
+        for field in ordering:
+            name = field.lstrip('-')
+            if name not in self.nullable_fields:
+                expressions.append(field)
+            elif nulls_first:
+                expressions.append(F(name).desc(nulls_first=True) if field.startswith('-') else F(name).asc(nulls_first=True))
+            else:
+                expressions.append(F(name).desc(nulls_last=True) if field.startswith('-') else F(name).asc(nulls_last=True))
+        return expressions
+    
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+    
+    @staticmethod
+    def keyset_filter(ordering, values, nullable_fields=(), nulls_first=False):
+        """Build the row comparison ``(f1, f2, ...) > (v1, v2, ...)`` as a Q."""
+        conditions = []
+        for position, field in enumerate(ordering):
+            name = field.lstrip('-')
+            value = values[position]
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            if value is None:
+                if not nulls_first:
+                    # Nothing sorts after the trailing nulls
+                    continue
+                condition = Q(**{f'{name}__isnull': False})
+            else:
+                condition = Q(**{f'{name}__{lookup}': value})
+                if name in nullable_fields and not nulls_first:
+                    condition |= Q(**{f'{name}__isnull': True})
+            for previous, previous_value in zip(ordering[:position], values):
+                previous_name = previous.lstrip('-')
+                if previous_value is None:
+                    condition &= Q(**{f'{previous_name}__isnull': True})
+                else:
+                    condition &= Q(**{previous_name: previous_value})
+            conditions.append(condition)
+        return reduce(or_, conditions)
+    
+    def encode_cursor(self, obj, reverse):
+        values = [
+            encode_value(getattr(obj, field.lstrip('-')))
+            for field in self.ordering
+        ]
+        payload = json.dumps({'v': values, 'r': reverse}, separators=(',', ':'))
+        return b64encode(payload.encode('utf-8')).decode('ascii')
+    
+    def decode_cursor(self, encoded):
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            values = payload['v']
+            reverse = bool(payload['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return {'values': values, 'reverse': reverse}
+    
+    def get_approximate_count(self, queryset):
+        """Return ``(count, is_approximate)`` without scanning the whole result set."""
+        if connections[queryset.db].vendor == 'postgresql':
+            # The planner's row estimate costs no scan at all
+            plan = json.loads(queryset.explain(format='json'))
+            return int(plan[0]['Plan']['Plan Rows']), True
+        
+        count = queryset[:self.approximate_count_limit + 1].count()
+        if count > self.approximate_count_limit:
+            return self.approximate_count_limit, True
+        return count, False
+    
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+    
+    def get_next_link(self):
+        return self.get_link(self.next_cursor)
+    
+    def get_previous_link(self):
+        if self.previous_cursor is None and self.has_previous:
+            # The previous page is the first one
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.get_link(self.previous_cursor)
+    
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+            response['count_is_approximate'] = self.count_is_approximate
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+    
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'count': {'type': 'integer'},
+                'count_is_approximate': {'type': 'boolean'},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -193,6 +193,116 @@ CHANNEL_LAYERS = {
 # Redis configuration
 REDIS_URL = config('REDIS_URL', default='redis://localhost:6379')
 
+# Cache configuration: Redis in production, an in-process LRU for tests and single-node deployments.
+# Tag versions live in the cache, so with the in-process cache an invalidation only
+# reaches the worker that made it; run several workers with CACHE_USE_REDIS only.
+WEB_CONCURRENCY = config('WEB_CONCURRENCY', default=1, cast=int)
+if config('CACHE_USE_REDIS', default=False, cast=bool):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': config('CACHE_REDIS_URL', default=REDIS_URL),
+            'KEY_PREFIX': 'marketplace',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'marketplace',
+            'OPTIONS': {
+                'MAX_ENTRIES': config('CACHE_LOCAL_MAX_ENTRIES', default=10000, cast=int),
+            },
+        },
+    }
+
+# Response cache lifetimes per endpoint, in seconds
+API_CACHE_TIMEOUTS = {
+    'featured_listings': config('CACHE_FEATURED_LISTINGS_TIMEOUT', default=300, cast=int),
+    'trending_listings': config('CACHE_TRENDING_LISTINGS_TIMEOUT', default=600, cast=int),
+    'category_tree': config('CACHE_CATEGORY_TREE_TIMEOUT', default=3600, cast=int),
+    'category_detail': config('CACHE_CATEGORY_DETAIL_TIMEOUT', default=900, cast=int),
+    'seller_dashboard': config('CACHE_SELLER_DASHBOARD_TIMEOUT', default=300, cast=int),
+}
+
+# Category tree snapshot kept per process
+CATEGORY_INDEX = {
+    # Bounds how stale other processes can be when the cache is not shared
+    'MAX_AGE': config('CATEGORY_INDEX_MAX_AGE', default=60, cast=int),  # seconds
+}
+
+# Listing view ingestion
+LISTING_VIEW_BUFFER = {
+    'BACKEND': config('LISTING_VIEW_BUFFER_BACKEND', default='apps.listings.view_buffer.LocalViewBuffer'),
+    'FLUSH_SIZE': config('LISTING_VIEW_FLUSH_SIZE', default=500, cast=int),
+    'FLUSH_INTERVAL': config('LISTING_VIEW_FLUSH_INTERVAL', default=5, cast=int),  # seconds
+}
+
+# Trending listings scoreboard, rebuilt on a schedule with rebuild_trending
+LISTING_TRENDING = {
+    'BACKEND': config('LISTING_TRENDING_BACKEND', default='apps.listings.trending.DatabaseTrendingBoard'),
+    'HALF_LIFE_HOURS': config('LISTING_TRENDING_HALF_LIFE_HOURS', default=24, cast=float),
+    'WINDOW_DAYS': config('LISTING_TRENDING_WINDOW_DAYS', default=7, cast=int),
+    'VIEW_WEIGHT': config('LISTING_TRENDING_VIEW_WEIGHT', default=1.0, cast=float),
+    'FAVORITE_WEIGHT': config('LISTING_TRENDING_FAVORITE_WEIGHT', default=5.0, cast=float),
+}
+
+# Similar listings index
+LISTING_SIMILARITY = {
+    'SNAPSHOT_PATH': config('LISTING_SIMILARITY_SNAPSHOT_PATH', default=''),
+    'SYNC_INTERVAL': config('LISTING_SIMILARITY_SYNC_INTERVAL', default=60, cast=int),  # seconds
+    # Re-read changes this far before the last sync, longer than any listing write transaction
+    'SYNC_OVERLAP': config('LISTING_SIMILARITY_SYNC_OVERLAP', default=120, cast=int),  # seconds
+    # Full comparison with the live listings, which drops deletes made by other processes
+    'RECONCILE_INTERVAL': config('LISTING_SIMILARITY_RECONCILE_INTERVAL', default=900, cast=int),  # seconds
+}
+
+# Listing recommendations
+LISTING_RECOMMENDATIONS = {
+    'WINDOW_DAYS': config('LISTING_RECOMMENDATIONS_WINDOW_DAYS', default=90, cast=int),
+    'FAVORITE_WEIGHT': config('LISTING_RECOMMENDATIONS_FAVORITE_WEIGHT', default=3.0, cast=float),
+    'VIEW_WEIGHT': config('LISTING_RECOMMENDATIONS_VIEW_WEIGHT', default=1.0, cast=float),
+    'MAX_ITEMS_PER_USER': config('LISTING_RECOMMENDATIONS_MAX_ITEMS_PER_USER', default=100, cast=int),
+    'NEIGHBORS': config('LISTING_RECOMMENDATIONS_NEIGHBORS', default=50, cast=int),
+    'PER_USER': config('LISTING_RECOMMENDATIONS_PER_USER', default=50, cast=int),
+    'PROCESSES': config('LISTING_RECOMMENDATIONS_PROCESSES', default=0, cast=int),  # 0 uses every core
+}
+
+# Category price stats shown on listing pages and seller dashboards, also refreshed by refresh_category_price_stats
+LISTING_PRICE_STATS = {
+    'REFRESH_INTERVAL': config('LISTING_PRICE_STATS_REFRESH_INTERVAL', default=3600, cast=int),  # seconds
+}
+
+# Listing view analytics rollups
+LISTING_ANALYTICS = {
+    # Recommendations read logged-in views of the last 90 days from the raw log
+    'RAW_RETENTION_DAYS': config('LISTING_ANALYTICS_RAW_RETENTION_DAYS', default=90, cast=int),
+    'HOURLY_RETENTION_DAYS': config('LISTING_ANALYTICS_HOURLY_RETENTION_DAYS', default=7, cast=int),
+    'TOP_USER_AGENTS': config('LISTING_ANALYTICS_TOP_USER_AGENTS', default=10, cast=int),
+}
+
+# Uploaded image processing
+IMAGE_PIPELINE = {
+    'ASYNC': config('IMAGE_PIPELINE_ASYNC', default=True, cast=bool),
+    'PROCESSES': config('IMAGE_PIPELINE_PROCESSES', default=2, cast=int),
+    'QUALITY': config('IMAGE_PIPELINE_QUALITY', default=82, cast=int),
+}
+
+# Websocket chat message batching
+CHAT_MESSAGE_BATCH = {
+    'MAX_BATCH_SIZE': config('CHAT_MESSAGE_MAX_BATCH_SIZE', default=100, cast=int),
+    'MAX_DELAY': config('CHAT_MESSAGE_MAX_DELAY', default=0.01, cast=float),  # seconds
+}
+
+# Chat presence and typing indicators
+CHAT_PRESENCE = {
+    'BACKEND': config('CHAT_PRESENCE_BACKEND', default='apps.chat.presence.InMemoryPresenceBackend'),
+    'TIMEOUT': config('CHAT_PRESENCE_TIMEOUT', default=60, cast=int),  # seconds without heartbeat
+    'TYPING_WINDOW': config('CHAT_TYPING_WINDOW', default=3.0, cast=float),  # seconds
+    # The default coalesces per process; use apps.chat.presence.RedisTypingCoalescer with several workers
+    'TYPING_BACKEND': config('CHAT_TYPING_BACKEND', default='apps.chat.presence.TypingCoalescer'),
+}
+
 # Celery configuration
 CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = REDIS_URL